@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BookingSalons.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.AUTOCOMPLETE_PRELOAD:
+    # Load the autocomplete index before the worker takes requests
+    from salons.autocomplete import start_index  # noqa: E402
+
+    start_index()
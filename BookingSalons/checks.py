@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.checks import Error
+
+# Cache backends whose entries live inside one process: every gunicorn worker
+# would see its own copy
+PER_PROCESS_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def require_shared_cache(setting, error_id):
+    """
+    System check errors when DEBUG is off and the cache alias named by the
+    `setting` setting is not shared between processes.
+    """
+    if settings.DEBUG:
+        return []
+    alias = getattr(settings, setting)
+    if alias not in settings.CACHES:
+        return [Error(f'{setting} names the unknown cache alias {alias!r}.', id=error_id)]
+    backend = settings.CACHES[alias]['BACKEND']
+    if backend not in PER_PROCESS_CACHE_BACKENDS:
+        return []
+    return [Error(
+        f'{setting} uses the {alias!r} cache with {backend}, which is not shared between worker processes.',
+        hint='Point SHARED_CACHE_BACKEND at Redis (django.core.cache.backends.redis.RedisCache) '
+             'or the database cache (django.core.cache.backends.db.DatabaseCache).',
+        id=error_id,
+    )]
@@ -0,0 +1,101 @@
+import atexit
+import copy
+import itertools
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord attributes that are not user supplied `extra` fields
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; `extra` fields passed to the logger are included."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        elif record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every record at INFO and above but only one DEBUG record out of `1 / rate`."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if not self.every:
+            return False
+        return next(self._counter) % self.every == 0
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Hands records to a background thread that writes them to `handlers`.
+
+    Request threads merge `msg % args` and put the record on a bounded queue;
+    JSON formatting and file or console I/O happen in the listener thread. When the queue is full the
+    record is dropped and counted instead of blocking the request. In LOGGING,
+    `handlers` refers to configured handlers as 'cfg://handlers.<name>'.
+    """
+
+    def __init__(self, handlers, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+        # dictConfig resolves 'cfg://' references on item access, not on iteration
+        handlers = [handlers[index] for index in range(len(handlers))]
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Flush queued records and stop the listener thread."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def prepare(self, record):
+        """
+        Like QueueHandler.prepare(), merge `msg % args` and render the traceback
+        in the calling thread: args may change after the call, and their __str__
+        (e.g. a model's, which may query) must not run in the listener thread.
+        The traceback stays in `exc_text` for JSONFormatter.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.stop()
+        super().close()
@@ -0,0 +1,482 @@
+"""
+Prometheus-style metrics: counters and histograms served at /metrics in the
+text exposition format.
+
+Values live in the process by default. With several worker processes
+(gunicorn), set METRICS_MULTIPROC_DIR: each process then keeps its values in
+its own memory-mapped file in that directory and /metrics sums the files of
+every process. Files of exited workers are merged into one archive file when
+/metrics is read, so counters do not go back when gunicorn replaces a worker
+and the directory does not grow with every replacement; empty the directory
+before the server starts.
+"""
+import fcntl
+import glob
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+# In METRICS_MULTIPROC_DIR: merged values of exited processes, and the lock that
+# keeps readers from seeing a file both merged and not yet deleted
+ARCHIVE_FILE = 'archive.db'
+LOCK_FILE = 'metrics.lock'
+
+
+class ProcessValues:
+    """Sample values of this process, keyed by (sample name, label pairs) JSON."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def read(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class MmapValues:
+    """
+    Sample values of this process in a memory-mapped file that other processes
+    read. Layout: the used size (uint32, padded to 8 bytes), then entries of key
+    length (uint32), UTF-8 key padded to 8 bytes and value (float64). An entry is
+    complete before the used size covers it, so readers never see half of one.
+    """
+    INITIAL_SIZE = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(self.INITIAL_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._used = struct.unpack_from('I', self._map, 0)[0] or 8
+        self._positions = {key: position for key, _, position in self._entries(self._map, self._used)}
+
+    def inc(self, key, amount):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._add(key)
+            value = struct.unpack_from('d', self._map, position)[0]
+            struct.pack_into('d', self._map, position, value + amount)
+
+    def read(self):
+        with self._lock:
+            return {key: value for key, value, _ in self._entries(self._map, self._used)}
+
+    def close(self):
+        with self._lock:
+            self._map.close()
+            self._file.close()
+
+    def _add(self, key):
+        encoded = key.encode()
+        padded = len(encoded) + (8 - (len(encoded) + 4) % 8) % 8
+        size = 4 + padded + 8
+        if self._used + size > len(self._map):
+            grown = max(len(self._map) * 2, self._used + size)
+            self._map.close()
+            self._file.truncate(grown)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        struct.pack_into(f'I{padded}sd', self._map, self._used, len(encoded), encoded, 0.0)
+        position = self._used + 4 + padded
+        self._used += size
+        struct.pack_into('I', self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    @staticmethod
+    def _entries(data, used):
+        position = 8
+        while position < used:
+            length = struct.unpack_from('I', data, position)[0]
+            padded = length + (8 - (length + 4) % 8) % 8
+            key = bytes(data[position + 4:position + 4 + length]).decode()
+            position += 4 + padded
+            yield key, struct.unpack_from('d', data, position)[0], position
+            position += 8
+
+    @classmethod
+    def read_file(cls, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < 8:
+            return {}
+        return {key: value for key, value, _ in cls._entries(data, struct.unpack_from('I', data, 0)[0])}
+
+
+def _file_pid(path):
+    """Process id of a `{pid}-{suffix}.db` file, None for the archive."""
+    pid = os.path.basename(path).split('-', 1)[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user
+        return True
+    return True
+
+
+@contextmanager
+def _directory_lock(directory, operation):
+    with open(os.path.join(directory, LOCK_FILE), 'a') as file:
+        fcntl.flock(file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def collect_dead_processes(directory):
+    """
+    Merge the files of exited processes into ARCHIVE_FILE and delete them.
+    Returns the number of merged files.
+    """
+    dead = [
+        path for path in glob.glob(os.path.join(directory, '*.db'))
+        if _file_pid(path) is not None and not _pid_alive(_file_pid(path))
+    ]
+    if not dead:
+        return 0
+    merged = 0
+    with _directory_lock(directory, fcntl.LOCK_EX):
+        archive = MmapValues(os.path.join(directory, ARCHIVE_FILE))
+        try:
+            for path in dead:
+                if not os.path.exists(path):
+                    # Merged by another process
+                    continue
+                for key, value in MmapValues.read_file(path).items():
+                    archive.inc(key, value)
+                os.remove(path)
+                merged += 1
+        finally:
+            archive.close()
+    return merged
+
+
+def _key(sample, labels):
+    return json.dumps([sample, sorted(labels.items())], ensure_ascii=False)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        return {name: str(value) for name, value in labels.items()}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters only go up')
+        self.registry.store.inc(_key(self.name, self._labels(labels)), amount)
+
+    def samples(self, values):
+        return sorted((labels, value) for (sample, labels), value in values.items() if sample == self.name)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        store = self.registry.store
+        # Per bucket counts, made cumulative when exposed: one write per observation
+        bound = next(bound for bound in self.buckets if value <= bound)
+        store.inc(_key(f'{self.name}_bucket', {**labels, 'le': _format(bound)}), 1)
+        store.inc(_key(f'{self.name}_sum', labels), value)
+        store.inc(_key(f'{self.name}_count', labels), 1)
+
+    def samples(self, values):
+        rows = []
+        for (sample, labels), count in sorted(values.items()):
+            if sample != f'{self.name}_count':
+                continue
+            cumulative = 0
+            for bound in self.buckets:
+                bucket = labels + (('le', _format(bound)),)
+                cumulative += values.get((f'{self.name}_bucket', tuple(sorted(bucket))), 0)
+                rows.append((f'{self.name}_bucket', bucket, cumulative))
+            rows.append((f'{self.name}_sum', labels, values.get((f'{self.name}_sum', labels), 0)))
+            rows.append((f'{self.name}_count', labels, count))
+        return rows
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._store = None
+        self._store_pid = None
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    @property
+    def store(self):
+        """Values of this process; a forked worker gets its own instead of its parent's."""
+        if self._store is None or self._store_pid != os.getpid():
+            with self._lock:
+                if self._store is None or self._store_pid != os.getpid():
+                    directory = settings.METRICS_MULTIPROC_DIR
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                        path = os.path.join(directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.db')
+                        self._store = MmapValues(path)
+                    else:
+                        if settings.WEB_CONCURRENCY > 1:
+                            logger.warning(
+                                'METRICS_MULTIPROC_DIR is not set with %d workers: /metrics only '
+                                'shows the values of the worker that answers', settings.WEB_CONCURRENCY,
+                            )
+                        self._store = ProcessValues()
+                    self._store_pid = os.getpid()
+        return self._store
+
+    def reset(self):
+        """Forget the values of this process (tests)."""
+        with self._lock:
+            self._store = None
+
+    def values(self):
+        """{(sample name, label pairs): value} of this process, or summed over every process."""
+        directory = settings.METRICS_MULTIPROC_DIR
+        if directory:
+            # This process shows up even before its first sample
+            self.store
+            collect_dead_processes(directory)
+            with _directory_lock(directory, fcntl.LOCK_SH):
+                sources = [MmapValues.read_file(path) for path in glob.glob(os.path.join(directory, '*.db'))]
+        else:
+            sources = [self.store.read()]
+        values = {}
+        for source in sources:
+            for key, value in source.items():
+                sample, labels = json.loads(key)
+                key = (sample, tuple(tuple(pair) for pair in labels))
+                values[key] = values.get(key, 0.0) + value
+        return values
+
+    def value(self, sample, **labels):
+        """Current value of one sample, e.g. value('otp_verifications_total', result='valid')."""
+        return self.values().get((sample, tuple(sorted((name, str(value)) for name, value in labels.items()))), 0.0)
+
+    def exposition(self):
+        values = self.values()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            if metric.type == 'counter':
+                rows = [(metric.name, labels, value) for labels, value in metric.samples(values)]
+                if not rows and not metric.labelnames:
+                    rows = [(metric.name, (), 0)]
+            else:
+                rows = metric.samples(values)
+            lines.extend(f'{sample}{_labels_text(labels)} {_format(value)}' for sample, labels, value in rows)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP requests by route and status code.', ['method', 'route', 'status'])
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route.', ['method', 'route'])
+REQUEST_QUERIES = registry.histogram(
+    'http_request_db_queries', 'Database queries per HTTP request by route.', ['route'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+CACHE_REQUESTS = registry.counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit or miss).', ['cache', 'result'])
+CACHE_INVALIDATIONS = registry.counter(
+    'cache_invalidations_total', 'Cache invalidations by cache.', ['cache'])
+OTP_SENT = registry.counter('otp_sent_total', 'OTP codes issued and queued for SMS delivery.')
+OTP_VERIFICATIONS = registry.counter(
+    'otp_verifications_total', 'OTP verifications by result (valid, invalid, expired, locked).', ['result'])
+BOOKING_CREATES = registry.counter('booking_creates_total', 'Bookings created.')
+BOOKING_CONFLICTS = registry.counter(
+    'booking_conflicts_total', 'Bookings rejected because the staff member is busy, by action.', ['action'])
+
+
+class RequestQueries:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self):
+        with self._lock:
+            self.count += 1
+
+
+# Set by MetricsMiddleware for the duration of a request
+_request_queries = ContextVar('request_queries', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is not None:
+        queries.add()
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class MetricsMiddleware:
+    """Request count, latency and query count per route (the URL pattern name)."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_counter)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        return self.record(request, response, queries, started)
+
+    async def __acall__(self, request):
+        queries, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        return self.record(request, response, queries, started)
+
+    @staticmethod
+    def start():
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection=connection)
+        queries = RequestQueries()
+        return queries, _request_queries.set(queries), time.perf_counter()
+
+    @staticmethod
+    def record(request, response, queries, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        # Pattern names, not paths: the number of label values stays bounded
+        route = (match.view_name or 'unnamed') if match else 'unmatched'
+        method = request.method if request.method in METHODS else 'other'
+        REQUESTS.inc(method=method, route=route, status=response.status_code)
+        REQUEST_LATENCY.observe(elapsed, method=method, route=route)
+        REQUEST_QUERIES.observe(queries.count, route=route)
+        return response
+
+
+def metrics_view(request):
+    """
+    Metrics of every process. With METRICS_TOKEN set, scrapers send it as a
+    bearer token; without one metrics are only served with DEBUG on.
+    """
+    if not settings.METRICS_ENABLED or not (settings.METRICS_TOKEN or settings.DEBUG):
+        raise Http404
+    if settings.METRICS_TOKEN and not constant_time_compare(
+        request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.exposition(), content_type=CONTENT_TYPE)
+
+
+@checks.register(checks.Tags.security)
+def check_metrics(app_configs, **kwargs):
+    if not settings.METRICS_ENABLED:
+        return []
+    errors = []
+    if not settings.METRICS_TOKEN and not settings.DEBUG:
+        errors.append(checks.Warning(
+            'METRICS_TOKEN is not set: /metrics answers 404 while DEBUG is off.',
+            hint='Set METRICS_TOKEN for the scraper, or METRICS_ENABLED=False.',
+            id='BookingSalons.W001',
+        ))
+    if not settings.METRICS_MULTIPROC_DIR and settings.WEB_CONCURRENCY > 1:
+        errors.append(checks.Error(
+            f'{settings.WEB_CONCURRENCY} workers (WEB_CONCURRENCY) keep their metrics per process: '
+            '/metrics would only show the worker that answers.',
+            hint='Set METRICS_MULTIPROC_DIR to a directory shared by the workers.',
+            id='BookingSalons.E001',
+        ))
+    return errors
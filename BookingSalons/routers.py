@@ -0,0 +1,119 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Set by PrimaryPinMiddleware for the duration of a request
+_routing = ContextVar('db_routing', default=None)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Entries of DatabaseCache backends: always on the primary, they are not replicated data
+CACHE_APP_LABEL = 'django_cache'
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.replica_reads = False
+        # Reads go to the primary once the request wrote (or a recent request did)
+        self.pinned = pinned
+        self.wrote = False
+
+
+class PrimaryReplicaRouter:
+    """
+    Reads of views with `replica_reads = True` go to a random DATABASE_REPLICAS
+    alias; everything else, and every read after a write, uses the primary.
+    Outside requests (commands, workers) all queries use the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return 'default'
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related objects come from the database their instance was read from
+            return instance._state.db
+        state = _routing.get()
+        if state is None or state.pinned or not state.replica_reads or not settings.DATABASE_REPLICAS:
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            # Filling the cache on a read is not a write the client must see
+            return 'default'
+        state = _routing.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class PrimaryPinMiddleware:
+    """
+    Per request routing state for PrimaryReplicaRouter.
+
+    Replica reads are enabled for safe requests to views that opt in with
+    `replica_reads = True`. After a write a cookie pins the client's reads to
+    the primary for DATABASE_PRIMARY_PIN_SECONDS, so the next requests see the
+    write even if replicas lag behind.
+    """
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'db_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django would run a sync process_view in a thread
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(pinned=self.cookie_name in request.COOKIES)
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=self.cookie_name in request.COOKIES)
+        token = _routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin(state, response)
+
+    def pin(self, state, response):
+        if state.wrote:
+            response.set_cookie(
+                self.cookie_name, '1', max_age=settings.DATABASE_PRIMARY_PIN_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return PrimaryPinMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _routing.get()
+        view_class = getattr(view_func, 'cls', None)
+        if state is not None and request.method in SAFE_METHODS and getattr(view_class, 'replica_reads', False):
+            state.replica_reads = True
+        return None
@@ -37,7 +37,13 @@ ROOT_URLCONF = 'BookingSalons.urls'
 
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole request
+    'BookingSalons.timing.ServerTimingMiddleware',
+    'BookingSalons.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'BookingSalons.routers.PrimaryPinMiddleware',
+    # Sync only (whitenoise 6.5): under ASGI, Django runs it in a thread for every
+    # request; the middleware around it is async capable
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -70,36 +76,172 @@ WSGI_APPLICATION = 'BookingSalons.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'bookingsalons',
-        'USER': 'bookingsalons_user',
-        'PASSWORD': 'HzLXLTnURag1E9WapNppnL8NK2b6s3Y7',
-        'HOST': 'dpg-d0tco4be5dus73foa2v0-a.oregon-postgres.render.com',
-        'PORT': '5432',
+DB_ENGINE = os.getenv('DB_ENGINE', 'django.db.backends.postgresql')
+
+# Connections are closed at the end of each request by default. The ASGI handler runs
+# sync code in a new thread per request, so persistent connections would pile up there;
+# set DB_CONN_MAX_AGE (e.g. 600) for WSGI deployments, where each worker thread reuses
+# its connection and checks it before reuse. Replicas (comma separated DB_REPLICA_HOSTS,
+# or DB_REPLICA_NAMES files with SQLite) take their own DB_REPLICA_* values, defaulting
+# to the primary ones.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '0'))
+DB_CONN_HEALTH_CHECKS = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+DB_REPLICA_CONN_MAX_AGE = int(os.getenv('DB_REPLICA_CONN_MAX_AGE', str(DB_CONN_MAX_AGE)))
+DB_REPLICA_CONN_HEALTH_CHECKS = os.getenv('DB_REPLICA_CONN_HEALTH_CHECKS', str(DB_CONN_HEALTH_CHECKS)) == 'True'
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': BASE_DIR / os.getenv('DB_NAME', 'db.sqlite3'),
+            'OPTIONS': {
+                # Take the write lock at BEGIN so concurrent bookings wait instead of failing
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            # File based test database so tests can use several threads
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
+    }
+    replicas = [{'NAME': BASE_DIR / name} for name in os.getenv('DB_REPLICA_NAMES', '').split(',') if name]
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.getenv('DB_NAME', 'bookingsalons'),
+            'USER': os.getenv('DB_USER', 'bookingsalons_user'),
+            'PASSWORD': os.getenv('DB_PASSWORD', 'HzLXLTnURag1E9WapNppnL8NK2b6s3Y7'),
+            'HOST': os.getenv('DB_HOST', 'dpg-d0tco4be5dus73foa2v0-a.oregon-postgres.render.com'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+        }
     }
+    replicas = [{'HOST': host} for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host]
+
+DATABASES['default'].update(CONN_MAX_AGE=DB_CONN_MAX_AGE, CONN_HEALTH_CHECKS=DB_CONN_HEALTH_CHECKS)
+for number, replica in enumerate(replicas, start=1):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        **replica,
+        'CONN_MAX_AGE': DB_REPLICA_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_REPLICA_CONN_HEALTH_CHECKS,
+        # Tests read replicas through the primary connection
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Safe requests to views with `replica_reads = True` read from a replica, see BookingSalons.routers
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['BookingSalons.routers.PrimaryReplicaRouter']
+# How long a client reads from the primary after one of its requests wrote
+DATABASE_PRIMARY_PIN_SECONDS = int(os.getenv('DATABASE_PRIMARY_PIN_SECONDS', '10'))
+
+
+# Cache settings
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'bookingsalons'),
+    },
+    # Entries every worker process must see (salon cache versions, OTP codes,
+    # throttles). Use Redis in production; the database cache works without an
+    # extra service after `manage.py createcachetable`. A per-process backend
+    # fails the system check unless DEBUG is on (BookingSalons.checks).
+    'shared': {
+        'BACKEND': os.getenv('SHARED_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('SHARED_CACHE_LOCATION', 'cache_entries'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('SHARED_CACHE_MAX_ENTRIES', '100000'))},
+    },
 }
 
+# Serialized salons cache, invalidated by salons.signals
+SALON_CACHE_ENABLED = os.getenv('SALON_CACHE_ENABLED', 'True') == 'True'
+SALON_CACHE_ALIAS = 'shared'
+SALON_CACHE_TIMEOUT = int(os.getenv('SALON_CACHE_TIMEOUT', '3600'))  # seconds
+# Host (as in the Host header) whose requests are cached: serialized photo URLs
+# are absolute. Requests for any other host are served uncached.
+SALON_CACHE_HOST = os.getenv('SALON_CACHE_HOST', '')
+
+# Threads running the concurrent queries of the async endpoints (salons.async_views)
+ASYNC_QUERY_WORKERS = int(os.getenv('ASYNC_QUERY_WORKERS', '32'))
+
+# Salon photo renditions (salons.photos), built by background threads after upload;
+# 0 workers builds them inline in the request
+PHOTO_RENDITION_WIDTHS = [int(width) for width in os.getenv('PHOTO_RENDITION_WIDTHS', '320,640,1280').split(',')]
+PHOTO_RENDITION_QUALITY = {
+    'webp': int(os.getenv('PHOTO_WEBP_QUALITY', '80')),
+    'jpeg': int(os.getenv('PHOTO_JPEG_QUALITY', '82')),
+}
+PHOTO_RENDITION_WORKERS = int(os.getenv('PHOTO_RENDITION_WORKERS', '1'))
+# Files per POST /api/salons/{id}/photos/bulk/ request
+SALON_PHOTO_BULK_MAX = int(os.getenv('SALON_PHOTO_BULK_MAX', '30'))
+
+# In-process autocomplete index: loaded when a WSGI/ASGI worker starts and fully
+# reloaded in the background every AUTOCOMPLETE_REFRESH_SECONDS (signals update it in between)
+AUTOCOMPLETE_PRELOAD = os.getenv('AUTOCOMPLETE_PRELOAD', 'True') == 'True'
+AUTOCOMPLETE_REFRESH_SECONDS = int(os.getenv('AUTOCOMPLETE_REFRESH_SECONDS', '300'))
+
 
 # REST Framework settings
 REST_FRAMEWORK = {
+    # Users are built from token claims, see users.authentication.TokenUser
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Sliding windows of users.throttling, per phone number and per client IP,
+    # kept in the THROTTLE_CACHE_ALIAS cache
+    'DEFAULT_THROTTLE_RATES': {
+        'otp_send_phone': os.getenv('OTP_SEND_PHONE_RATE', '5/hour'),
+        'otp_send_ip': os.getenv('OTP_SEND_IP_RATE', '30/hour'),
+        'otp_verify_phone': os.getenv('OTP_VERIFY_PHONE_RATE', '20/hour'),
+        'otp_verify_ip': os.getenv('OTP_VERIFY_IP_RATE', '60/hour'),
+    },
 }
 
+# One-time codes, kept in the cache by users.otp (no user rows are written before verification)
+OTP_STORE = os.getenv('OTP_STORE', 'users.otp.CacheOTPStore')
+# Codes, attempt counters and throttle windows must be shared by every worker
+# process, or each one accepts only its own codes and applies the limits separately
+OTP_CACHE_ALIAS = 'shared'
+THROTTLE_CACHE_ALIAS = 'shared'
+OTP_TTL = int(os.getenv('OTP_TTL', '300'))  # seconds
+OTP_MAX_ATTEMPTS = int(os.getenv('OTP_MAX_ATTEMPTS', '5'))
+# Fixed code for development; set DEFAULT_OTP to an empty value to send random codes
+DEFAULT_OTP = os.getenv('DEFAULT_OTP', '11111')
+OTP_LENGTH = 5
+
+# SMS delivery (users.sms): backend class and background queue
+# The console backend prints OTP codes to stdout: it is only the default with DEBUG on,
+# without DEBUG an unset SMS_BACKEND fails the system check (users.E003)
+SMS_BACKEND = os.getenv('SMS_BACKEND', 'users.sms.ConsoleBackend' if DEBUG else '')
+SMS_FILE_PATH = os.getenv('SMS_FILE_PATH', str(BASE_DIR / 'sms.log'))
+SMS_WORKERS = int(os.getenv('SMS_WORKERS', '2'))
+SMS_MAX_RETRIES = int(os.getenv('SMS_MAX_RETRIES', '3'))
+SMS_RETRY_BACKOFF = float(os.getenv('SMS_RETRY_BACKOFF', '1.0'))  # seconds, doubled per attempt
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=int(os.getenv('JWT_ACCESS_TOKEN_LIFETIME', '1').split('#')[0].strip())),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.getenv('JWT_REFRESH_TOKEN_LIFETIME', '7').split('#')[0].strip())),
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_USER_CLASS': 'users.authentication.TokenUser',
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.TokenObtainPairSerializer',
 }
 
+# Full User rows loaded for token users on demand (users.authentication.get_cached_user)
+AUTH_USER_CACHE_ALIAS = 'default'
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', '60'))  # seconds
+
+# Booking settings
+SALON_OPENING_TIME = os.getenv('SALON_OPENING_TIME', '09:00')
+SALON_CLOSING_TIME = os.getenv('SALON_CLOSING_TIME', '21:00')
+BOOKING_SLOT_STEP = int(os.getenv('BOOKING_SLOT_STEP', '15'))  # minutes
+BOOKING_DEFAULT_DURATION = int(os.getenv('BOOKING_DEFAULT_DURATION', '60'))  # minutes
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = os.getenv('CORS_ALLOW_ALL_ORIGINS', 'True') == 'True'
 CORS_ALLOW_CREDENTIALS = os.getenv('CORS_ALLOW_CREDENTIALS', 'True') == 'True'
@@ -142,6 +284,24 @@ SWAGGER_SETTINGS = {
 }
 
 # Logging settings
+# Request threads only enqueue records, BookingSalons.log.QueueListenerHandler
+# writes them from a background thread (console as text, django.log as JSON lines)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# Server-Timing header and a timing log line per request (BookingSalons.timing.ServerTimingMiddleware)
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'False') == 'True'
+# Executions of one SQL template in a request reported as an N+1 pattern
+SERVER_TIMING_DUPLICATE_THRESHOLD = int(os.getenv('SERVER_TIMING_DUPLICATE_THRESHOLD', '5'))
+
+# Prometheus metrics at /metrics (BookingSalons.metrics)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+# Shared directory for multi-process servers (gunicorn workers); empty keeps values per process
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+# Bearer token scrapers must send; without one /metrics is only served with DEBUG on
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Worker processes; gunicorn and uvicorn take it as their default worker count
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.1'))  # share of DEBUG records kept
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -154,6 +314,15 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'BookingSalons.log.JSONFormatter',
+        },
+    },
+    'filters': {
+        'sample_debug': {
+            '()': 'BookingSalons.log.SamplingFilter',
+            'rate': LOG_DEBUG_SAMPLE_RATE,
+        },
     },
     'handlers': {
         'console': {
@@ -163,18 +332,34 @@ LOGGING = {
         'file': {
             'class': 'logging.FileHandler',
             'filename': BASE_DIR / 'django.log',
-            'formatter': 'verbose',
+            'formatter': 'json',
+        },
+        # Configured after 'console' and 'file' (handlers are set up in name order)
+        'queue': {
+            'class': 'BookingSalons.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+            'filters': ['sample_debug'],
         },
     },
     'loggers': {
         'django': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': True,
         },
         'users': {
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG',
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': True,
+        },
+        'salons': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': True,
+        },
+        'BookingSalons': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
             'propagate': True,
         },
     },
@@ -0,0 +1,245 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# Set by ServerTimingMiddleware for the duration of a request
+_timings = ContextVar('request_timings', default=None)
+
+# Placeholder lists of IN (...) clauses vary with the number of values
+_PLACEHOLDERS = re.compile(r'%s(?:\s*,\s*%s)+')
+_SKIPPED_DIRS = tuple(
+    os.path.normcase(os.path.abspath(path)) + os.sep for path in {sys.prefix, sys.base_prefix}
+) + ('<',)
+
+
+class RequestTimings:
+    """Query, serializer and render times of one request; updated from the async views' query threads too."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.serializing = 0
+        self.render_started = None
+        # SQL template -> [executions, distinct params, call site]
+        self.templates = {}
+
+    def record_query(self, sql, params, duration):
+        template = _PLACEHOLDERS.sub('%s, ...', sql)
+        with self.lock:
+            self.queries += 1
+            self.db += duration
+            seen = self.templates.get(template)
+            if seen is None:
+                self.templates[template] = [1, {_freeze(params)}, None]
+                return
+            seen[0] += 1
+            seen[1].add(_freeze(params))
+            repeated = seen[2] is None
+        if repeated:
+            # Only the first repetition pays for the stack walk
+            seen[2] = call_site()
+
+    def duplicates(self, threshold):
+        """Templates run at least `threshold` times: N+1 patterns (varying params) or plain repeats."""
+        return [
+            {
+                'sql': template, 'count': count, 'site': site,
+                'kind': 'n+1' if len(params) > 1 else 'repeated',
+            }
+            for template, (count, params, site) in self.templates.items()
+            if count >= threshold
+        ]
+
+
+def _freeze(params):
+    try:
+        return hash(tuple(params)) if params is not None else None
+    except TypeError:
+        return repr(params)
+
+
+def call_site():
+    """
+    File:line of the innermost frame in project code: outside Django, DRF and
+    this module, and not another execute wrapper (first argument `execute`).
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.normcase(os.path.abspath(code.co_filename))
+        if (
+            filename != os.path.normcase(os.path.abspath(__file__))
+            and not filename.startswith(_SKIPPED_DIRS)
+            and code.co_varnames[:1] != ('execute',)
+        ):
+            return f'{os.path.relpath(filename, settings.BASE_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def record_queries(execute, sql, params, many, context):
+    """Execute wrapper of every connection; only counts while a request is being timed."""
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.record_query(sql, params, time.perf_counter() - started)
+
+
+def install_query_recorder(sender=None, connection=None, **kwargs):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+def instrument_serializers():
+    """
+    Time BaseSerializer.data, where DRF serializers build their representation
+    (ListSerializer and Serializer call it through super()). Nested serializers
+    are part of the outermost call; queries run while serializing count as DB
+    time, not serializer time.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    data = BaseSerializer.data
+    if getattr(data.fget, 'timed', False):
+        return
+
+    def timed_data(serializer):
+        timings = _timings.get()
+        if timings is None or timings.serializing:
+            return data.fget(serializer)
+        timings.serializing += 1
+        started, db_before = time.perf_counter(), timings.db
+        try:
+            return data.fget(serializer)
+        finally:
+            timings.serializing -= 1
+            timings.serialize += time.perf_counter() - started - (timings.db - db_before)
+
+    timed_data.timed = True
+    BaseSerializer.data = property(timed_data)
+
+
+class ServerTimingMiddleware:
+    """
+    Per request query count, database, serializer and render time, sent as a
+    Server-Timing header (visible in the browser's network panel) and logged as
+    one structured line. SQL templates repeated SERVER_TIMING_DUPLICATE_THRESHOLD
+    times are reported with the call site that runs them, and turn the line into
+    a warning. Enabled with SERVER_TIMING_ENABLED; put it first in MIDDLEWARE.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django would run a sync process_template_response in a thread
+            self.process_template_response = self.aprocess_template_response
+        connection_created.connect(install_query_recorder)
+        instrument_serializers()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings)
+
+    @staticmethod
+    def start():
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection=connection)
+        timings = RequestTimings()
+        return timings, _timings.set(timings)
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        duplicates = timings.duplicates(settings.SERVER_TIMING_DUPLICATE_THRESHOLD)
+        response['Server-Timing'] = self.header(timings, duplicates, total)
+        self.log(request, response, timings, duplicates, total)
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        return ServerTimingMiddleware.process_template_response(self, request, response)
+
+    def process_template_response(self, request, response):
+        # Called last for the first middleware, right before the response is rendered
+        timings = _timings.get()
+        if timings is not None:
+            timings.render_started = time.perf_counter()
+            response.add_post_render_callback(self.rendered)
+        return response
+
+    @staticmethod
+    def rendered(response):
+        timings = _timings.get()
+        if timings is not None and timings.render_started is not None:
+            timings.render = time.perf_counter() - timings.render_started
+
+    @staticmethod
+    def header(timings, duplicates, total):
+        metrics = [
+            f'db;desc="{timings.queries} queries";dur={timings.db * 1000:.1f}',
+            f'serialize;dur={timings.serialize * 1000:.1f}',
+            f'render;dur={timings.render * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ]
+        if duplicates:
+            metrics.append(f'dup;desc="{len(duplicates)} repeated queries"')
+        return ', '.join(metrics)
+
+    @staticmethod
+    def log(request, response, timings, duplicates, total):
+        match = request.resolver_match
+        logger.log(
+            logging.WARNING if duplicates else logging.INFO,
+            '%s %s %s: %d queries, %.1f ms db, %.1f ms total%s',
+            request.method, request.path, response.status_code, timings.queries, timings.db * 1000,
+            total * 1000, f', {len(duplicates)} repeated queries' if duplicates else '',
+            extra={
+                'method': request.method,
+                'path': request.path,
+                'route': match.view_name if match else None,
+                'status': response.status_code,
+                'queries': timings.queries,
+                'db_ms': round(timings.db * 1000, 2),
+                'serialize_ms': round(timings.serialize * 1000, 2),
+                'render_ms': round(timings.render * 1000, 2),
+                'total_ms': round(total * 1000, 2),
+                'duplicate_queries': duplicates,
+            },
+        )
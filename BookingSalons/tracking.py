@@ -0,0 +1,55 @@
+import copy
+
+
+class TrackedFieldsMixin:
+    """
+    Model mixin remembering the values of `tracked_fields` (attribute names)
+    as last loaded from or saved to the database, so signal handlers can tell
+    whether a save changed them without querying the previous row.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_tracked_fields()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # post_save receivers ran inside save() and saw the previous values
+        self.remember_tracked_fields(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self.remember_tracked_fields(fields)
+
+    def remember_tracked_fields(self, fields=None):
+        names = self._tracked_names(fields)
+        saved = self.__dict__.setdefault('_tracked_values', {})
+        for name in names:
+            if name in self.__dict__:
+                # Copied: JSON fields may be changed in place
+                saved[name] = copy.deepcopy(self.__dict__[name])
+
+    def tracked_fields_changed(self, update_fields=None):
+        """
+        Whether a save with `update_fields` stored new values in tracked fields.
+        Deferred fields that were never set are not saved, so they never count.
+        """
+        saved = self.__dict__.get('_tracked_values', {})
+        return any(
+            name in self.__dict__ and (name not in saved or saved[name] != self.__dict__[name])
+            for name in self._tracked_names(update_fields)
+        )
+
+    def tracked_value(self, name):
+        """The value of tracked field `name` as last loaded or saved, None when unknown."""
+        return self.__dict__.get('_tracked_values', {}).get(name)
+
+    def _tracked_names(self, fields):
+        if fields is None:
+            return self.tracked_fields
+        # update_fields may use field names ("salon") or attribute names ("salon_id")
+        attnames = {self._meta.get_field(name).attname for name in fields}
+        return [name for name in self.tracked_fields if name in attnames]
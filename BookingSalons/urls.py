@@ -20,7 +20,9 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
 from rest_framework import routers
+from BookingSalons.metrics import metrics_view
 from salons.views import SalonViewSet, StaffViewSet, BookingViewSet
+from salons import async_views
 from users.views import SendOTPView, VerifyOTPView, UpdateProfileView
 
 # Create a router and register our viewsets with it
@@ -65,7 +67,16 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/users/', include('users.urls')),
+
+    # Async read endpoints (same responses as /api/salons/...), for ASGI servers
+    path('api/async/salons/', async_views.salon_list, name='async-salon-list'),
+    path('api/async/salons/nearby/', async_views.salon_nearby, name='async-salon-nearby'),
+    path('api/async/salons/<int:pk>/', async_views.salon_detail, name='async-salon-detail'),
+    path('api/async/salons/<int:pk>/availability/', async_views.salon_availability_view,
+         name='async-salon-availability'),
     
+    path('metrics', metrics_view, name='metrics'),
+
     # Swagger URLs
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
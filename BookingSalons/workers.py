@@ -0,0 +1,120 @@
+import atexit
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerQueue:
+    """
+    Jobs handed from requests to daemon worker threads, started on first use.
+
+    Subclasses implement handle(job), which runs in a worker thread and calls
+    done() once the job is finished (possibly later, e.g. after retries).
+    done() counts jobs in `processed` or `failed` and wakes up flush(). stop()
+    lets the workers finish the jobs queued before it; jobs queued after it
+    are passed to drop(). It is registered with atexit on start, so jobs
+    still queued when the process exits are finished or logged as dropped
+    rather than lost silently with the daemon threads.
+    """
+    thread_name = 'worker'
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._at_exit = False
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        with self._lock:
+            if not self._at_exit:
+                atexit.register(self.stop)
+                self._at_exit = True
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'{self.thread_name}-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, job):
+        self.start()
+        with self._lock:
+            self._pending += 1
+        self._queue.put(job)
+
+    def flush(self, timeout=None):
+        """Wait until every enqueued job is finished, returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def stop(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+            if self._at_exit:
+                atexit.unregister(self.stop)
+                self._at_exit = False
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+        # Jobs queued behind the stop signals
+        left = []
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                left.append(job)
+        if left:
+            self.drop(left, 'it was still queued')
+
+    def take(self, limit):
+        """Up to `limit` more waiting jobs without blocking, for handle() to batch."""
+        jobs = []
+        while len(jobs) < limit:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Keep the stop signal for this or another worker
+                self._queue.put(None)
+                break
+            jobs.append(job)
+        return jobs
+
+    def handle(self, job):
+        raise NotImplementedError('subclasses of WorkerQueue must implement handle()')
+
+    def worker_stopped(self):
+        """Called in each worker thread before it exits."""
+
+    def drop(self, jobs, reason):
+        """Jobs that will not run: logged and counted as failed."""
+        logger.error('%s: %d jobs dropped on shutdown, %s', self.thread_name, len(jobs), reason)
+        self.done(len(jobs), ok=False)
+
+    def done(self, count, ok):
+        with self._idle:
+            if ok:
+                self.processed += count
+            else:
+                self.failed += count
+            self._pending -= count
+            self._idle.notify_all()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self.worker_stopped()
+                return
+            self.handle(job)
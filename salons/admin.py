@@ -1,7 +1,65 @@
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
 from django import forms
+from django.db.models import Count
 from django.utils.html import format_html
 from .models import Salon, Staff, Booking, SalonPhoto
+from .photos import rendition_url, smallest_rendition
+
+def preview_url(photo):
+    # The smallest rendition once processed, the original until then
+    rendition = smallest_rendition(photo)
+    return rendition_url(rendition) if rendition else photo.image.url
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """
+    Foreign key filter with an autocomplete select instead of a link per related
+    row, so the sidebar does not load every salon or staff member. The related
+    model admin needs search_fields, like for autocomplete_fields.
+    """
+    template = 'admin/salons/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = '%s__%s__exact' % (field_path, field.target_field.name)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        values = self.used_parameters.get(self.lookup_kwarg)
+        self.value = values[-1] if values else None
+        related_admin = model_admin.admin_site.get_model_admin(field.remote_field.model)
+        # Only the selected object is loaded to render its label
+        self.form_field = forms.ModelChoiceField(
+            queryset=related_admin.get_queryset(request),
+            required=False,
+            widget=AutocompleteSelect(field, model_admin.admin_site, attrs={'style': 'width: 100%'}),
+        )
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def has_output(self):
+        return True
+
+    def get_facet_queryset(self, changelist):
+        # Counting per related object is what this filter avoids
+        return {}
+
+    def widget(self):
+        return self.form_field.widget.render(self.lookup_kwarg, self.value)
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value is None,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg]),
+            'display': 'Все',
+        }
+
+class AutocompleteFilterMixin:
+    """Scripts of AutocompleteFilter on the changelist."""
+
+    @property
+    def media(self):
+        # The widget media is the same for every field
+        widget_media = AutocompleteSelect(Staff._meta.get_field('salon'), self.admin_site).media
+        return super().media + widget_media + forms.Media(js=['salons/js/autocomplete_filter.js'])
 
 class SalonPhotoInline(admin.TabularInline):
     model = SalonPhoto
@@ -11,7 +69,7 @@ class SalonPhotoInline(admin.TabularInline):
 
     def preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 50px;"/>', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 50px;"/>', preview_url(obj))
         return "Нет изображения"
     preview.short_description = 'Предпросмотр'
 
@@ -19,40 +77,58 @@ class SalonPhotoInline(admin.TabularInline):
 class SalonAdmin(admin.ModelAdmin):
     inlines = [SalonPhotoInline]
     list_display = ('title', 'owner', 'created_at', 'display_photos_count')
+    list_select_related = ('owner',)
     search_fields = ('title', 'description', 'owner__phone_number')
     list_filter = ('created_at',)
     ordering = ('title',)
-    
+    autocomplete_fields = ('owner',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(photos_count=Count('photos'))
+
     def display_photos_count(self, obj):
-        return f"{obj.photos.count()} фото"
+        return f"{obj.photos_count} фото"
     display_photos_count.short_description = 'Количество фото'
+    display_photos_count.admin_order_field = 'photos_count'
 
 @admin.register(SalonPhoto)
-class SalonPhotoAdmin(admin.ModelAdmin):
+class SalonPhotoAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('salon', 'preview', 'order', 'is_main', 'created_at')
-    list_filter = ('salon', 'is_main', 'created_at')
+    list_select_related = ('salon',)
+    list_filter = (('salon', AutocompleteFilter), 'is_main', 'created_at')
     search_fields = ('salon__title',)
     ordering = ('salon', 'order')
     readonly_fields = ('preview',)
+    autocomplete_fields = ('salon',)
 
     def preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 50px;"/>', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 50px;"/>', preview_url(obj))
         return "Нет изображения"
     preview.short_description = 'Предпросмотр'
 
 @admin.register(Staff)
-class StaffAdmin(admin.ModelAdmin):
+class StaffAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('full_name', 'salon', 'created_at')
-    list_filter = ('salon', 'created_at')
+    list_filter = (('salon', AutocompleteFilter), 'created_at')
     search_fields = ('full_name', 'salon__title')
     ordering = ('salon', 'full_name')
+    autocomplete_fields = ('salon',)
+
+    def get_queryset(self, request):
+        # Staff.__str__ shows the salon title: changelist, autocomplete results and filter labels
+        return super().get_queryset(request).select_related('salon')
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     list_display = ('client', 'salon', 'staff', 'booking_date', 'booking_time', 'status')
-    list_filter = ('status', 'booking_date', 'salon', 'staff')
-    search_fields = ('client__phone_number', 'client__first_name', 'client__last_name', 
+    # Staff.__str__ shows the salon title
+    list_select_related = ('client', 'salon', 'staff__salon')
+    list_filter = ('status', 'booking_date', ('salon', AutocompleteFilter), ('staff', AutocompleteFilter))
+    search_fields = ('client__phone_number', 'client__first_name', 'client__last_name',
                     'salon__title', 'staff__full_name')
     date_hierarchy = 'booking_date'
     ordering = ('-booking_date', '-booking_time')
+    autocomplete_fields = ('client', 'salon', 'staff')
+    # Skip the second COUNT(*) over the whole table when a filter is applied
+    show_full_result_count = False
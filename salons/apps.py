@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SalonsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'salons'
+
+    def ready(self):
+        from . import signals  # noqa: F401
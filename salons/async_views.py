@@ -0,0 +1,204 @@
+"""
+Async versions of the hot salon read endpoints for ASGI deployments.
+
+Responses match the SalonViewSet ones (and share the salon cache). Single queries
+use the async ORM; independent queries go through gather_queries() so they run
+at the same time instead of one after another.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, MethodNotAllowed, NotFound
+from rest_framework.renderers import JSONRenderer
+
+from .availability import load_day_bookings, salon_availability
+from .cache import get_salons_data
+from .conditional import collection_validators, object_validators
+from .geo import bounding_box_filter, rank_by_distance
+from .models import Salon, SalonPhoto, Staff
+from .serializers import (
+    AvailabilityQuerySerializer,
+    NearbyQuerySerializer,
+    SalonListSerializer,
+    SalonSerializer,
+)
+from .views import filter_salons
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def query_executor():
+    """
+    Thread pool for concurrent queries, ASYNC_QUERY_WORKERS threads. The default
+    executor is sized for CPU work (cpu count + 4) and would cap how many
+    requests can wait on the database at the same time.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_QUERY_WORKERS, thread_name_prefix='async-query',
+                )
+    return _executor
+
+
+def _run_query(query):
+    try:
+        return query()
+    finally:
+        # Pool threads are not covered by request_finished, release their connection
+        close_old_connections()
+
+
+async def gather_queries(*queries):
+    """
+    Run sync ORM callables concurrently and return their results in order.
+
+    The async ORM runs every query of a request on one thread, so each query
+    gets its own pool thread (and database connection) here instead.
+    """
+    return await asyncio.gather(*(
+        sync_to_async(_run_query, thread_sensitive=False, executor=query_executor())(query)
+        for query in queries
+    ))
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def async_api(view):
+    """GET-only async view answering API errors like DRF does."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            if request.method not in ('GET', 'HEAD'):
+                raise MethodNotAllowed(request.method)
+            return await view(request, *args, **kwargs)
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return json_response(data, status=exc.status_code)
+    return wrapper
+
+
+def query_params(serializer_class, request):
+    params = serializer_class(data=request.GET)
+    params.is_valid(raise_exception=True)
+    return params.validated_data
+
+
+def _by_salon(rows):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row.salon_id].append(row)
+    return groups
+
+
+async def build_salons(request, pks, detail):
+    """
+    Serialized salons for `pks` as {pk: data}. Salons, their photos and (for
+    details) staff are loaded concurrently, the related rows filtered by salon
+    id, and attached as `loaded_photos`/`loaded_staff` (see Salon.get_photos).
+    Orders match salon_queryset().
+    """
+    salons = Salon.objects.filter(pk__in=pks)
+    if detail:
+        salons = salons.select_related('owner')
+    photo_order = ('order', 'created_at') if detail else ('-is_main', 'order', 'created_at')
+    queries = [
+        partial(list, salons),
+        partial(list, SalonPhoto.objects.filter(salon_id__in=pks).order_by(*photo_order)),
+    ]
+    if detail:
+        queries.append(partial(list, Staff.objects.filter(salon_id__in=pks).order_by('id')))
+    salons, photos, *staff = await gather_queries(*queries)
+
+    photos = _by_salon(photos)
+    staff = _by_salon(staff[0]) if detail else {}
+    for salon in salons:
+        salon.loaded_photos = photos.get(salon.pk, [])
+        if detail:
+            salon.loaded_staff = staff.get(salon.pk, [])
+    serializer_class = SalonSerializer if detail else SalonListSerializer
+    data = serializer_class(salons, many=True, context={'request': request}).data
+    return {salon.pk: item for salon, item in zip(salons, data)}
+
+
+async def salons_data(request, pks, detail):
+    """Async counterpart of SalonViewSet.salon_data, through the same cache entries."""
+    build = async_to_sync(partial(build_salons, request, detail=detail))
+    return await sync_to_async(get_salons_data)(
+        pks, 'detail' if detail else 'list', build, host=request.get_host(),
+    )
+
+
+@async_api
+async def salon_list(request):
+    queryset = filter_salons(Salon.objects.order_by('pk'), request.GET)
+    rows = [row async for row in queryset.values_list('pk', 'updated_at')]
+    validators = collection_validators(request, Salon, rows)
+    response = validators.precondition_response(request)
+    if response is None:
+        data = await salons_data(request, [pk for pk, updated_at in rows], detail=False)
+        response = validators.apply(json_response(data))
+    return response
+
+
+@async_api
+async def salon_detail(request, pk):
+    updated_at = await Salon.objects.filter(pk=pk).values_list('updated_at', flat=True).afirst()
+    if updated_at is None:
+        raise NotFound()
+    validators = object_validators(request, Salon, pk, updated_at)
+    response = validators.precondition_response(request)
+    if response is None:
+        data = await salons_data(request, [pk], detail=True)
+        if not data:
+            raise NotFound()
+        response = validators.apply(json_response(data[0]))
+    return response
+
+
+@async_api
+async def salon_nearby(request):
+    params = query_params(NearbyQuerySerializer, request)
+    lat, lon, radius = params['lat'], params['lon'], params['radius']
+    queryset = filter_salons(Salon.objects.only('pk', 'location_lat', 'location_lon'), request.GET)
+    candidates = [salon async for salon in queryset.filter(bounding_box_filter(lat, lon, radius))]
+    distances = {
+        salon.pk: salon.distance
+        for salon in rank_by_distance(candidates, lat, lon, radius, params['limit'])
+    }
+    data = await salons_data(request, list(distances), detail=False)
+    for item in data:
+        item['distance'] = round(distances[item['id']], 3)
+    return json_response(data)
+
+
+@async_api
+async def salon_availability_view(request, pk):
+    params = query_params(AvailabilityQuerySerializer, request)
+    day = params['date']
+    service = params.get('service')
+    exists, staff, busy_by_staff = await gather_queries(
+        Salon.objects.filter(pk=pk).exists,
+        partial(list, Staff.objects.filter(salon_id=pk).order_by('id')),
+        partial(load_day_bookings, pk, day),
+    )
+    if not exists:
+        raise NotFound()
+    return json_response({
+        'date': day,
+        'service': service,
+        'staff': salon_availability(pk, day, service=service, staff=staff, busy_by_staff=busy_by_staff),
+    })
@@ -0,0 +1,269 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections
+
+from .models import Salon, Staff
+from .search import normalize, tokenize
+
+logger = logging.getLogger(__name__)
+
+SALON = 'salon'
+SERVICE = 'service'
+
+
+def _keys(text):
+    """
+    Lookup keys of a text: the whole normalized text and its tail from every
+    following word, so "окр" finds "Студия окрашивания".
+    """
+    text = ' '.join(tokenize(text))
+    keys = []
+    position = 0
+    while True:
+        keys.append(text[position:])
+        position = text.find(' ', position) + 1
+        if position == 0:
+            return keys
+
+
+class PrefixIndex:
+    """
+    In-process prefix index over salon titles and service names.
+
+    Keys are kept in a sorted list and looked up with bisect; entries are
+    (key, kind, ref) tuples where ref is the salon id or the service name.
+    Services are reference counted per staff member so incremental updates
+    only drop a name once no staff offers it anymore.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = []
+        self._titles = {}
+        self._staff_services = {}
+        self._service_refs = {}
+        self._service_names = {}
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def build(cls, salons=(), staff=()):
+        """
+        Index from `salons` as (id, title) and `staff` as (id, [service names]).
+        The sorted list is built in one pass instead of one insort per entry.
+        """
+        index = cls()
+        entries = []
+        for salon_id, title in salons:
+            index._titles[salon_id] = title
+            entries.extend((key, SALON, salon_id) for key in _keys(title))
+        for staff_id, names in staff:
+            keys = index._remember_staff(staff_id, names)
+            for name_key in keys:
+                if index._service_refs[name_key] == 1:
+                    entries.extend((key, SERVICE, name_key) for key in _keys(name_key))
+        entries.sort()
+        index._entries = entries
+        index.loaded_at = time.monotonic()
+        return index
+
+    def _remember_staff(self, staff_id, names):
+        """Record the services of a staff member, returns the keys that are new for it."""
+        keys = set()
+        for name in names:
+            name_key = normalize(name).strip()
+            if name_key:
+                keys.add(name_key)
+                self._service_names.setdefault(name_key, str(name).strip())
+        self._staff_services[staff_id] = keys
+        for name_key in keys:
+            self._service_refs[name_key] = self._service_refs.get(name_key, 0) + 1
+        return keys
+
+    def _insert(self, kind, ref, text):
+        for key in _keys(text):
+            insort(self._entries, (key, kind, ref))
+
+    def _delete(self, kind, ref, text):
+        for key in _keys(text):
+            position = bisect_left(self._entries, (key, kind, ref))
+            if position < len(self._entries) and self._entries[position] == (key, kind, ref):
+                del self._entries[position]
+
+    def set_salon(self, salon_id, title):
+        with self._lock:
+            self.remove_salon(salon_id)
+            self._titles[salon_id] = title
+            self._insert(SALON, salon_id, title)
+
+    def remove_salon(self, salon_id):
+        with self._lock:
+            title = self._titles.pop(salon_id, None)
+            if title is not None:
+                self._delete(SALON, salon_id, title)
+
+    def set_staff(self, staff_id, names):
+        with self._lock:
+            self.remove_staff(staff_id)
+            for name_key in self._remember_staff(staff_id, names):
+                if self._service_refs[name_key] == 1:
+                    self._insert(SERVICE, name_key, name_key)
+
+    def remove_staff(self, staff_id):
+        with self._lock:
+            for name_key in self._staff_services.pop(staff_id, ()):
+                self._service_refs[name_key] -= 1
+                if not self._service_refs[name_key]:
+                    del self._service_refs[name_key]
+                    del self._service_names[name_key]
+                    self._delete(SERVICE, name_key, name_key)
+
+    def lookup(self, prefix, limit=10):
+        """Salons and services whose title/name or one of its words starts with `prefix`."""
+        prefix = ' '.join(tokenize(prefix))
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self._entries, (prefix,))
+            while position < len(self._entries) and len(results) < limit:
+                key, kind, ref = self._entries[position]
+                if not key.startswith(prefix):
+                    break
+                position += 1
+                if (kind, ref) in seen:
+                    continue
+                seen.add((kind, ref))
+                if kind == SALON:
+                    results.append({'type': SALON, 'id': ref, 'text': self._titles[ref]})
+                else:
+                    results.append({'type': SERVICE, 'text': self._service_names[ref]})
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+_refresher = None
+# Set by start_index(): keep the index fresh from a background thread
+_refresh = False
+
+
+def load_index():
+    salons = Salon.objects.values_list('pk', 'title').iterator(chunk_size=2000)
+    staff = (
+        (member.pk, [service.get('name', '') for service in member.get_services()])
+        for member in Staff.objects.only('pk', 'services').iterator(chunk_size=2000)
+    )
+    return PrefixIndex.build(salons, staff)
+
+
+def refresh_index():
+    """Build a new index and swap it in; requests use the previous one meanwhile."""
+    global _index
+    index = load_index()
+    _index = index
+    return index
+
+
+class IndexRefresher:
+    """
+    Daemon thread rebuilding the index every `interval` seconds to pick up
+    changes made by other workers (signals only update this process's index).
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pid = os.getpid()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='autocomplete-refresh', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            close_old_connections()
+            try:
+                refresh_index()
+            except Exception:
+                logger.exception('Autocomplete index refresh failed, serving the previous one')
+
+
+def start_index():
+    """
+    Load the index when a worker starts (BookingSalons.wsgi/asgi) and keep it
+    fresh in the background, so no request waits for a build. With gunicorn
+    --preload the index is inherited by the forked workers, which start their
+    own refresher on first use.
+    """
+    global _index, _refresh
+    try:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+    except DatabaseError:
+        # E.g. the tables are not migrated yet: the first lookup loads it
+        logger.exception('Autocomplete index not loaded at startup')
+    # Forked workers must not inherit (and share) the connection the index was
+    # loaded with. Connections in a transaction, only seen in tests, stay open.
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+    _refresh = True
+    _ensure_refresher()
+
+
+def _ensure_refresher():
+    # Commands and tests do not call start_index() and keep the index as loaded
+    global _refresher
+    if not _refresh or settings.AUTOCOMPLETE_REFRESH_SECONDS <= 0:
+        return
+    refresher = _refresher
+    if refresher is None or refresher.pid != os.getpid():
+        with _index_lock:
+            if _refresher is refresher:
+                _refresher = IndexRefresher(settings.AUTOCOMPLETE_REFRESH_SECONDS).start()
+
+
+def get_index():
+    """
+    The process-wide index. Loaded by start_index() when the worker starts,
+    or here on first use when that did not run.
+    """
+    global _index
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+            index = _index
+    _ensure_refresher()
+    return index
+
+
+def loaded_index():
+    """The index if this process has loaded it, for incremental updates from signals."""
+    return _index
+
+
+def reset_index():
+    global _index, _refresher, _refresh
+    with _index_lock:
+        if _refresher is not None and _refresher.pid == os.getpid():
+            _refresher.stop()
+        _index = _refresher = None
+        _refresh = False
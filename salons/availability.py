@@ -0,0 +1,152 @@
+from datetime import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Booking
+
+
+def _to_minutes(value):
+    if isinstance(value, str):
+        value = time.fromisoformat(value)
+    return value.hour * 60 + value.minute
+
+
+def _format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def service_duration(service):
+    """Service duration in minutes, BOOKING_DEFAULT_DURATION when not specified."""
+    if isinstance(service, dict):
+        try:
+            duration = int(service.get('duration') or 0)
+        except (TypeError, ValueError):
+            duration = 0
+        if duration > 0:
+            return duration
+    return settings.BOOKING_DEFAULT_DURATION
+
+
+def merge_intervals(intervals):
+    """Merge overlapping (start, end) minute intervals into a sorted list."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def free_slots(busy, duration, day_start, day_end, step, not_before=None):
+    """
+    Return start minutes of every slot of `duration` minutes that fits between
+    `day_start` and `day_end` without touching a busy interval.
+    Slots are aligned to `step` minutes from the start of the working day.
+    """
+    slots = []
+    cursor = day_start
+    for busy_start, busy_end in list(busy) + [(day_end, day_end)]:
+        gap_end = min(busy_start, day_end)
+        while cursor + duration <= gap_end:
+            if not_before is None or cursor >= not_before:
+                slots.append(cursor)
+            cursor += step
+        if busy_end > cursor:
+            # Jump past the busy interval, keeping the step alignment
+            cursor = day_start + -(-(busy_end - day_start) // step) * step
+    return slots
+
+
+def load_day_bookings(salon, day):
+    """
+    Load every active booking of the salon for the given day in a single query
+    (served by booking_salon_date_idx) and group them into busy intervals per staff.
+    """
+    rows = Booking.objects.filter(
+        salon=salon,
+        booking_date=day,
+        status__in=Booking.ACTIVE_STATUSES,
+    ).order_by().values_list('staff_id', 'booking_time', 'service')
+
+    intervals = {}
+    for staff_id, booking_time, service in rows:
+        start = _to_minutes(booking_time)
+        intervals.setdefault(staff_id, []).append((start, start + service_duration(service)))
+    return {staff_id: merge_intervals(items) for staff_id, items in intervals.items()}
+
+
+def salon_availability(salon, day, service=None, staff=None, busy_by_staff=None):
+    """
+    Free slots of the salon staff for `day`.
+
+    If `service` is given only staff offering it are returned and the slot length
+    is taken from that staff member's service entry. `staff` narrows the result to
+    the given Staff queryset or list. `busy_by_staff` is the load_day_bookings()
+    result when the caller has loaded it already.
+    """
+    if staff is None:
+        staff = salon.staff.all()
+
+    day_start = _to_minutes(settings.SALON_OPENING_TIME)
+    day_end = _to_minutes(settings.SALON_CLOSING_TIME)
+    step = settings.BOOKING_SLOT_STEP
+
+    not_before = None
+    now = timezone.localtime()
+    if day < now.date():
+        return []
+    if day == now.date():
+        not_before = now.hour * 60 + now.minute
+
+    if busy_by_staff is None:
+        busy_by_staff = load_day_bookings(salon, day)
+
+    result = []
+    for member in staff:
+        if service:
+            offered = member.get_service(service)
+            if offered is None:
+                continue
+            duration = service_duration(offered)
+        else:
+            duration = settings.BOOKING_DEFAULT_DURATION
+
+        slots = free_slots(
+            busy_by_staff.get(member.id, []),
+            duration,
+            day_start,
+            day_end,
+            step,
+            not_before=not_before,
+        )
+        result.append({
+            'staff_id': member.id,
+            'full_name': member.full_name,
+            'duration': duration,
+            'slots': [_format_minutes(slot) for slot in slots],
+        })
+    return result
+
+
+def is_slot_free(staff, day, booking_time, service, exclude_pk=None):
+    """
+    Check that a booking of `service` at `booking_time` overlaps no other active booking.
+    `service` is the staff member's entry (BookingSerializer.canonical_service), never
+    the client's payload.
+    """
+    start = _to_minutes(booking_time)
+    end = start + service_duration(service)
+    rows = Booking.objects.filter(
+        staff=staff,
+        booking_date=day,
+        status__in=Booking.ACTIVE_STATUSES,
+    )
+    if exclude_pk is not None:
+        rows = rows.exclude(pk=exclude_pk)
+    for other_time, other_service in rows.order_by().values_list('booking_time', 'service'):
+        other_start = _to_minutes(other_time)
+        if other_start < end and start < other_start + service_duration(other_service):
+            return False
+    return True
@@ -0,0 +1,97 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import transaction
+
+from BookingSalons import metrics
+from BookingSalons.checks import require_shared_cache
+
+VERSION_KEY = 'salon:{pk}:version'
+DATA_KEY = 'salon:{pk}:v{version}:{variant}:{host}'
+
+
+def get_cache():
+    return caches[settings.SALON_CACHE_ALIAS]
+
+
+def _versions(cache, pks):
+    keys = {VERSION_KEY.format(pk=pk): pk for pk in pks}
+    found = cache.get_many(keys)
+    return {pk: found.get(key, 0) for key, pk in keys.items()}
+
+
+def get_salons_data(pks, variant, build, host=''):
+    """
+    Serialized salons for `pks` in the same order, served from the cache.
+
+    `build(missing_pks)` must return {pk: data} for the salons that are not cached;
+    salons it does not return (e.g. deleted) are skipped. Entries are keyed per salon,
+    representation variant and host (serialized photo URLs are absolute), and carry
+    the salon's version so invalidate_salon() drops every variant at once. Only
+    requests for SALON_CACHE_HOST are cached: with ALLOWED_HOSTS = ['*'] any Host
+    header would otherwise get entries of its own.
+    """
+    pks = list(pks)
+    if not settings.SALON_CACHE_ENABLED or host != settings.SALON_CACHE_HOST:
+        data = build(pks)
+        return [data[pk] for pk in pks if pk in data]
+
+    cache = get_cache()
+    versions = _versions(cache, pks)
+    keys = {
+        pk: DATA_KEY.format(pk=pk, version=versions[pk], variant=variant, host=host)
+        for pk in pks
+    }
+    found = cache.get_many(keys.values())
+    result = {pk: found[key] for pk, key in keys.items() if key in found}
+
+    missing = [pk for pk in pks if pk not in result]
+    if result:
+        metrics.CACHE_REQUESTS.inc(len(result), cache='salon', result='hit')
+    if missing:
+        metrics.CACHE_REQUESTS.inc(len(missing), cache='salon', result='miss')
+        built = build(missing)
+        cache.set_many({keys[pk]: data for pk, data in built.items()}, settings.SALON_CACHE_TIMEOUT)
+        result.update(built)
+    return [result[pk] for pk in pks if pk in result]
+
+
+def invalidate_salon(pk):
+    """Drop every cached representation of the salon."""
+    if pk is None:
+        return
+    cache = get_cache()
+    key = VERSION_KEY.format(pk=pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # No version stored yet (or evicted): start from a value no entry was written with
+        cache.set(key, time.time_ns(), None)
+    metrics.CACHE_INVALIDATIONS.inc(cache='salon')
+
+
+def invalidate_salon_on_commit(pk):
+    """
+    invalidate_salon() once the current transaction commits (right away outside
+    one): bumped earlier, a concurrent request could cache the old row again
+    under the new version.
+    """
+    transaction.on_commit(partial(invalidate_salon, pk))
+
+
+@checks.register(checks.Tags.caches)
+def check_salon_cache(app_configs, **kwargs):
+    # Versions bumped by one worker must reach all of them
+    if not settings.SALON_CACHE_ENABLED:
+        return []
+    errors = require_shared_cache('SALON_CACHE_ALIAS', 'salons.E001')
+    if not settings.DEBUG and not settings.SALON_CACHE_HOST:
+        errors.append(checks.Warning(
+            'SALON_CACHE_HOST is not set: salons are served without the salon cache.',
+            hint='Set SALON_CACHE_HOST to the public host name of the API, as sent in the Host header.',
+            id='salons.W001',
+        ))
+    return errors
@@ -0,0 +1,102 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .models import Staff, StaffService
+
+
+def service_key(name):
+    return str(name).strip().casefold()
+
+
+_price_field = StaffService._meta.get_field('price')
+# Largest price StaffService.price holds (max_digits=12, decimal_places=2)
+MAX_PRICE = Decimal(10) ** (_price_field.max_digits - _price_field.decimal_places) - Decimal('0.01')
+MAX_DURATION = 24 * 60  # minutes
+
+
+def _parse_price(value):
+    """Price rounded to cents, None when missing, malformed or outside 0..MAX_PRICE."""
+    if value in (None, ''):
+        return None
+    try:
+        price = Decimal(str(value)).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None
+    # NaN survives quantize(); out of range values would fail the insert on PostgreSQL
+    if not price.is_finite() or not 0 <= price <= MAX_PRICE:
+        return None
+    return price
+
+
+def _parse_duration(value):
+    try:
+        duration = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return duration if 0 < duration <= MAX_DURATION else None
+
+
+def service_errors(services):
+    """
+    Problems of a Staff.services value sent by a client: a list of names or of
+    {'name', 'price', 'duration'} dicts, with prices and durations in range.
+    """
+    if not isinstance(services, list):
+        return ['Expected a list of services.']
+    errors = []
+    for index, service in enumerate(services):
+        if isinstance(service, str):
+            service = {'name': service}
+        if not isinstance(service, dict) or not str(service.get('name') or '').strip():
+            errors.append(f'Service {index}: a name is required.')
+            continue
+        if service.get('price') not in (None, '') and _parse_price(service['price']) is None:
+            errors.append(f'Service {index}: price must be a number from 0 to {MAX_PRICE}.')
+        if service.get('duration') not in (None, '') and _parse_duration(service['duration']) is None:
+            errors.append(f'Service {index}: duration must be a whole number of minutes from 1 to {MAX_DURATION}.')
+    return errors
+
+
+def service_rows(staff):
+    """StaffService rows (unsaved) for the services of a staff member."""
+    rows = []
+    for service in staff.get_services():
+        name = str(service.get('name', '')).strip()
+        if not name:
+            continue
+        rows.append(StaffService(
+            staff_id=staff.pk,
+            salon_id=staff.salon_id,
+            name=name[:200],
+            name_key=service_key(name)[:200],
+            price=_parse_price(service.get('price')),
+            duration=_parse_duration(service.get('duration')),
+        ))
+    return rows
+
+
+def sync_staff_services(staff):
+    """Replace the StaffService rows of a staff member with its current services."""
+    with transaction.atomic():
+        StaffService.objects.filter(staff_id=staff.pk).delete()
+        StaffService.objects.bulk_create(service_rows(staff))
+
+
+def rebuild_services(batch_size=1000):
+    """Rebuild StaffService rows for every staff member, returns the number of staff processed."""
+    processed = 0
+    staff_qs = Staff.objects.order_by('pk').only('pk', 'salon_id', 'services')
+    last_pk = 0
+    while True:
+        batch = list(staff_qs.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return processed
+        with transaction.atomic():
+            StaffService.objects.filter(staff_id__in=[staff.pk for staff in batch]).delete()
+            StaffService.objects.bulk_create(
+                [row for staff in batch for row in service_rows(staff)],
+                batch_size=batch_size,
+            )
+        processed += len(batch)
+        last_pk = batch[-1].pk
@@ -0,0 +1,130 @@
+import hashlib
+from http import HTTPStatus
+
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+class Validators:
+    """ETag and Last-Modified of a response, computed without serializing it."""
+
+    def __init__(self, etag, last_modified=None):
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def timestamp(self):
+        return int(self.last_modified.timestamp()) if self.last_modified else None
+
+    def precondition_response(self, request):
+        """
+        304 Not Modified / 412 Precondition Failed response for If-None-Match,
+        If-Modified-Since, If-Match and If-Unmodified-Since, or None to proceed.
+        """
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.timestamp)
+        if response is not None:
+            self.apply(response)
+        return response
+
+    def apply(self, response):
+        if response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            if self.last_modified:
+                response['Last-Modified'] = http_date(self.timestamp)
+        return response
+
+
+def collection_validators(request, model, rows, extra=()):
+    """
+    Validators of a listing from the `(pk, updated_at, ...)` rows it is built from:
+    the ETag covers row count, order and timestamps, Last-Modified is the newest
+    timestamp. Extra timestamps are those of embedded objects (e.g. side-loaded salons);
+    `extra` holds any other values the response depends on.
+    """
+    digest = hashlib.md5()
+    last_modified = None
+    count = 0
+    for row in rows:
+        count += 1
+        digest.update(repr(row).encode())
+        for value in row[1:]:
+            if value is not None and (last_modified is None or value > last_modified):
+                last_modified = value
+    etag = make_etag(
+        model._meta.label, request.get_host(), request.get_full_path(),
+        count, digest.hexdigest(), *extra,
+    )
+    return Validators(etag, last_modified)
+
+
+def object_validators(request, model, pk, updated_at):
+    return Validators(make_etag(model._meta.label, request.get_host(), pk, updated_at), updated_at)
+
+
+class ConditionalMixin:
+    """
+    ETag/Last-Modified for retrieve and If-Match optimistic concurrency for
+    update/partial_update of a ModelViewSet whose model has `updated_at`.
+    """
+
+    def get_object_validators(self, pk):
+        try:
+            updated_at = (
+                self.get_queryset().prefetch_related(None).filter(pk=pk)
+                .order_by().values_list('updated_at', flat=True).first()
+            )
+        except (TypeError, ValueError):
+            return None
+        if updated_at is None:
+            return None
+        return object_validators(self.request, self.get_queryset().model, pk, updated_at)
+
+    def conditional_response(self, validators, render):
+        """Answer preconditions from `validators`, otherwise return render() with validators set."""
+        if validators is None:
+            return render()
+        response = validators.precondition_response(self.request)
+        if response is None:
+            response = validators.apply(render())
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        parent = super()
+        return self.conditional_response(
+            self.get_object_validators(pk),
+            lambda: parent.retrieve(request, *args, **kwargs),
+        )
+
+    def update(self, request, *args, **kwargs):
+        instance = self.get_object()
+        validators = object_validators(request, type(instance), instance.pk, instance.updated_at)
+        response = validators.precondition_response(request)
+        if response is not None:
+            return response
+        if 'HTTP_IF_MATCH' in request.META or 'HTTP_IF_UNMODIFIED_SINCE' in request.META:
+            with transaction.atomic():
+                # Compare and set: claim the row only if it is still the version the
+                # precondition was checked against. The row stays locked until the
+                # write commits, so a second client holding the same ETag gets 412
+                # instead of overwriting this update.
+                claimed = type(instance).objects.filter(
+                    pk=instance.pk, updated_at=instance.updated_at,
+                ).update(updated_at=timezone.now())
+                if not claimed:
+                    return HttpResponse(status=HTTPStatus.PRECONDITION_FAILED)
+                response = super().update(request, *args, **kwargs)
+        else:
+            response = super().update(request, *args, **kwargs)
+        if response.status_code == 200:
+            new_validators = self.get_object_validators(instance.pk)
+            if new_validators is not None:
+                new_validators.apply(response)
+        return response
@@ -0,0 +1,8 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class SlotConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This time slot is already booked.'
+    default_code = 'slot_conflict'
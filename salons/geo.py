@@ -0,0 +1,60 @@
+import math
+
+from django.db.models import Q
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box_filter(lat, lon, radius_km):
+    """
+    Q object selecting salons inside the bounding box around the point.
+
+    It only uses range conditions on location_lat/location_lon, so the database
+    answers it from the salon_location_idx index.
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - lat_delta, lat + lat_delta
+    if min_lat <= -90 or max_lat >= 90:
+        # The box covers a pole, every longitude is a candidate
+        return Q(location_lat__gte=max(min_lat, -90), location_lat__lte=min(max_lat, 90))
+
+    lon_delta = math.degrees(radius_km / EARTH_RADIUS_KM / math.cos(math.radians(lat)))
+    min_lon, max_lon = lon - lon_delta, lon + lon_delta
+    lat_range = Q(location_lat__gte=min_lat, location_lat__lte=max_lat)
+    if lon_delta >= 180:
+        return lat_range
+    if min_lon < -180:
+        return lat_range & (Q(location_lon__gte=min_lon + 360) | Q(location_lon__lte=max_lon))
+    if max_lon > 180:
+        return lat_range & (Q(location_lon__gte=min_lon) | Q(location_lon__lte=max_lon - 360))
+    return lat_range & Q(location_lon__gte=min_lon, location_lon__lte=max_lon)
+
+
+def nearby(queryset, lat, lon, radius_km, limit):
+    """
+    Salons within `radius_km` of the point sorted by distance.
+
+    The bounding box prefilter runs in SQL; haversine is computed only for the
+    candidates it returns. Every salon gets a `distance` attribute in km.
+    """
+    candidates = queryset.filter(bounding_box_filter(lat, lon, radius_km))
+    return rank_by_distance(candidates, lat, lon, radius_km, limit)
+
+
+def rank_by_distance(candidates, lat, lon, radius_km, limit):
+    """The `limit` nearest of the bounding box `candidates` that are within `radius_km`."""
+    result = []
+    for salon in candidates:
+        salon.distance = haversine(lat, lon, float(salon.location_lat), float(salon.location_lon))
+        if salon.distance <= radius_km:
+            result.append(salon)
+    result.sort(key=lambda salon: salon.distance)
+    return result[:limit]
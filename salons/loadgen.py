@@ -0,0 +1,286 @@
+"""
+Synthetic load data for reproducing scaling issues locally (manage.py seed_load).
+
+Rows are generated in fixed-size chunks, each from its own random generator
+seeded with (seed, kind, chunk), so the data only depends on the seed and the
+volumes, not on the number of processes. Users, salons and staff get explicit
+primary keys allocated up front, which lets workers build relations without
+reading rows back.
+"""
+import itertools
+import random
+from contextlib import contextmanager
+from bisect import bisect_right
+from datetime import date, timedelta
+from datetime import time as day_time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Max
+
+from users.models import User
+
+from .models import Booking, Salon, SalonPhoto, Staff
+
+# Reserved prefix so load users never collide with real numbers (15 characters in total)
+PHONE_PREFIX = '+99800'
+
+# City centers with their share of salons; salons scatter around them
+CITIES = [
+    ('Ташкент', 41.311, 69.240, 0.45),
+    ('Самарканд', 39.654, 66.975, 0.12),
+    ('Бухара', 39.767, 64.421, 0.08),
+    ('Наманган', 40.998, 71.672, 0.08),
+    ('Андижан', 40.783, 72.344, 0.08),
+    ('Фергана', 40.384, 71.789, 0.07),
+    ('Карши', 38.861, 65.789, 0.06),
+    ('Нукус', 42.460, 59.610, 0.06),
+]
+CITY_SPREAD = 0.04  # degrees, about 4 km
+
+SERVICES = [
+    ('Стрижка', 1500, 60), ('Мужская стрижка', 1000, 30), ('Окрашивание', 3000, 120),
+    ('Укладка', 1200, 45), ('Маникюр', 1000, 60), ('Педикюр', 1300, 60), ('Брови', 600, 30),
+    ('Ресницы', 1800, 90), ('Массаж', 2500, 60), ('Чистка лица', 2200, 60), ('Бритьё', 800, 30),
+]
+TITLE_WORDS = [
+    'Студия', 'Салон', 'Барбершоп', 'Beauty', 'Lux', 'Style', 'Nails', 'Hair', 'Spa', 'Lab',
+    'Красота', 'Шарм', 'Elegant', 'Premium', 'Точка', 'Мастер', 'Art', 'Glow',
+]
+FIRST_NAMES = ['Анна', 'Мария', 'Дилноза', 'Камила', 'Олег', 'Тимур', 'Азиз', 'Елена', 'Нигора', 'Рустам']
+LAST_NAMES = ['Иванова', 'Каримова', 'Юсупова', 'Ким', 'Петров', 'Алиев', 'Рахимова', 'Ли', 'Сидорова', 'Усманов']
+
+OPENING_HOUR = 9
+SLOTS_PER_DAY = 12
+
+
+def plan(salons, clients, bookings, staff=(3, 15), photos=(1, 8), days_back=365, days_ahead=30,
+         seed=42, batch_size=5000, chunk_size=50000, today=None):
+    """
+    Everything the workers need, as plain data: volumes, the first free primary
+    keys and the staff count of every salon (their prefix sums give staff ids).
+    `staff` and `photos` are (min, max) per salon.
+    """
+    rng = random.Random(f'{seed}:staff-counts')
+    staff_counts = [rng.randint(*staff) for _ in range(salons)]
+    staff_offsets = list(itertools.accumulate(staff_counts, initial=0))
+    return {
+        'database': connection.settings_dict['NAME'],
+        'seed': seed,
+        'salons': salons,
+        'clients': clients,
+        'owners': max(1, salons // 5),
+        'bookings': bookings,
+        'staff': staff_offsets[-1],
+        'staff_offsets': staff_offsets,
+        'photos': photos,
+        'days_back': days_back,
+        'days_ahead': days_ahead,
+        'today': (today or date.today()).isoformat(),
+        'batch_size': batch_size,
+        'chunk_size': chunk_size,
+        'user_base': (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1,
+        'salon_base': (Salon.objects.aggregate(last=Max('pk'))['last'] or 0) + 1,
+        'staff_base': (Staff.objects.aggregate(last=Max('pk'))['last'] or 0) + 1,
+        'password': make_password(None),
+    }
+
+
+def tasks(plan, kind):
+    """
+    (kind, start, stop) chunks of about chunk_size rows. Staff and photos are
+    chunked by salon, bookings by staff member.
+    """
+    total, rows_each = {
+        'users': (plan['clients'] + plan['owners'], 1),
+        'salons': (plan['salons'], 1),
+        'staff': (plan['salons'], plan['staff'] / max(1, plan['salons']) + sum(plan['photos']) / 2),
+        'bookings': (plan['staff'], plan['bookings'] / max(1, plan['staff'])),
+    }[kind]
+    size = max(1, int(plan['chunk_size'] / max(1, rows_each)))
+    return [(kind, start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def _rng(plan, kind, start):
+    return random.Random(f"{plan['seed']}:{kind}:{start}")
+
+
+def _users(plan, start, stop):
+    rng = _rng(plan, 'users', start)
+    for n in range(start, stop):
+        phone = f'{PHONE_PREFIX}{n:09d}'
+        yield User(
+            pk=plan['user_base'] + n, phone_number=phone, username=phone, password=plan['password'],
+            first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+        )
+
+
+def _city(rng):
+    return rng.choices(CITIES, weights=[city[3] for city in CITIES])[0]
+
+
+def _salons(plan, start, stop):
+    rng = _rng(plan, 'salons', start)
+    owner_base = plan['user_base'] + plan['clients']
+    for n in range(start, stop):
+        city, lat, lon, _ = _city(rng)
+        words = rng.sample(TITLE_WORDS, 2)
+        yield Salon(
+            pk=plan['salon_base'] + n,
+            title=f'{words[0]} {words[1]} {n}',
+            description=f'{city}. ' + ' '.join(rng.choices(TITLE_WORDS, k=rng.randint(10, 40))),
+            location_lat=round(rng.gauss(lat, CITY_SPREAD), 6),
+            location_lon=round(rng.gauss(lon, CITY_SPREAD), 6),
+            yandex_link='https://yandex.ru/maps/',
+            owner_id=owner_base + n % plan['owners'],
+        )
+
+
+def _staff(plan, start, stop):
+    rng = _rng(plan, 'staff', start)
+    offsets = plan['staff_offsets']
+    for salon in range(start, stop):
+        for index in range(offsets[salon], offsets[salon + 1]):
+            yield Staff(
+                pk=plan['staff_base'] + index,
+                salon_id=plan['salon_base'] + salon,
+                full_name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                services=[
+                    {'name': name, 'price': price + rng.randrange(0, 1500, 100), 'duration': duration}
+                    for name, price, duration in rng.sample(SERVICES, rng.randint(2, 5))
+                ],
+            )
+
+
+def _photos(plan, start, stop):
+    rng = _rng(plan, 'photos', start)
+    for salon in range(start, stop):
+        salon_id = plan['salon_base'] + salon
+        for order in range(rng.randint(*plan['photos'])):
+            # Rows only, the files are not created
+            yield SalonPhoto(
+                salon_id=salon_id, image=f'salon_photos/load/{salon_id}_{order}.jpg',
+                order=order, is_main=order == 0,
+            )
+
+
+def _bookings(plan, start, stop):
+    """
+    Bookings of the staff members start..stop spread evenly from days_back ago to
+    days_ahead from now. Past ones are completed or cancelled, upcoming ones
+    pending, confirmed or cancelled. At most SLOTS_PER_DAY consecutive slots of
+    a staff member share a day, so active slots never collide.
+    """
+    rng = _rng(plan, 'bookings', start)
+    today = date.fromisoformat(plan['today'])
+    first_day = today - timedelta(days=plan['days_back'])
+    per_staff, extra = divmod(plan['bookings'], plan['staff'])
+    offsets = plan['staff_offsets']
+    clients = plan['clients']
+    # Shared per batch: bulk_create only reads them
+    services = [{'name': name, 'price': price, 'duration': duration} for name, price, duration in SERVICES]
+    times = [day_time(OPENING_HOUR + hour) for hour in range(SLOTS_PER_DAY)]
+    for staff in range(start, stop):
+        salon_id = plan['salon_base'] + bisect_right(offsets, staff) - 1
+        staff_id = plan['staff_base'] + staff
+        count = per_staff + (staff < extra)
+        span = max(plan['days_back'] + plan['days_ahead'], -(-count // SLOTS_PER_DAY))
+        for slot in range(count):
+            day = first_day + timedelta(days=slot * span // count)
+            roll = rng.random()
+            if day < today:
+                status = 'cancelled' if roll < 0.12 else 'completed'
+            else:
+                status = 'cancelled' if roll < 0.05 else ('confirmed' if roll < 0.6 else 'pending')
+            yield Booking(
+                salon_id=salon_id,
+                staff_id=staff_id,
+                # Regulars: a few clients make many of the bookings
+                client_id=plan['user_base'] + int(clients * rng.random() ** 1.5),
+                service=rng.choice(services),
+                booking_date=day,
+                booking_time=times[slot % SLOTS_PER_DAY],
+                status=status,
+            )
+
+
+GENERATORS = {
+    'users': (User, _users),
+    'salons': (Salon, _salons),
+    'staff': (Staff, _staff),
+    'bookings': (Booking, _bookings),
+}
+
+
+def run_task(plan, task):
+    """Insert the rows of one chunk in batches, returns the number of rows."""
+    kind, start, stop = task
+    batches = [GENERATORS[kind]]
+    if kind == 'staff':
+        batches.append((SalonPhoto, _photos))
+    created = 0
+    for model, generator in batches:
+        rows = generator(plan, start, stop)
+        while True:
+            batch = list(itertools.islice(rows, plan['batch_size']))
+            if not batch:
+                break
+            model.objects.bulk_create(batch)
+            created += len(batch)
+    return created
+
+
+def relax_sqlite_sync(sender=None, connection=None, **kwargs):
+    # Synthetic data: skip the fsync per commit, a crash only loses the load
+    if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous = OFF')
+
+
+@contextmanager
+def relaxed_sync(connection):
+    """relax_sqlite_sync on an open connection, restoring the setting afterwards."""
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA synchronous')
+        previous = cursor.fetchone()[0]
+    relax_sqlite_sync(connection=connection)
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA synchronous = {int(previous)}')
+
+
+_worker_plan = None
+
+
+def init_worker(plan):
+    """
+    Process pool initializer of a forked worker: connect to the database the
+    plan was made for, which may be a test or bench database.
+    """
+    global _worker_plan
+    _worker_plan = plan
+    settings_dict = connections['default'].settings_dict
+    settings_dict['NAME'] = plan['database']
+    if connection.vendor == 'sqlite':
+        # Writers take turns on SQLite: wait for the lock instead of failing
+        settings_dict['OPTIONS']['timeout'] = 600
+    connection_created.connect(relax_sqlite_sync)
+
+
+def run_worker_task(task):
+    return run_task(_worker_plan, task)
+
+
+def reset_sequences():
+    """Move primary key sequences past the explicitly assigned ids (PostgreSQL)."""
+    statements = connection.ops.sequence_reset_sql(no_style(), [User, Salon, Staff])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
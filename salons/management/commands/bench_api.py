@@ -0,0 +1,375 @@
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import URLResolver, get_resolver
+from PIL import Image
+
+from salons.availability import service_duration
+from salons.models import Booking, Salon, SalonPhoto, Staff
+from users.authentication import UserRefreshToken
+from users.models import User
+from users.otp import get_otp_store
+from users.sms import reset_queue as reset_sms_queue
+
+# Routes of BookingSalons/urls.py that are not API endpoints; the admin has its own query count tests
+EXCLUDED_NAMESPACES = ('admin',)
+
+BENCH_PASSWORD = 'bench-password'
+
+# method/path/data may be callables of the iteration number, user is a key of the seeded users
+Scenario = namedtuple('Scenario', 'route method path user data format status', defaults=(None, None, 'json', 200))
+
+
+class QueryCounter:
+    """Queries of every connection, including those of the async views' worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every API route on a seeded database: query count, p50/p95 latency and '
+            'payload size per route, compared with a JSON baseline. Fails when a route issues more '
+            'queries, gets slower or returns larger payloads than the baseline allows. '
+            'Runs on a separate bench database that is created (and kept with --keepdb).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salons', type=int, default=2000)
+        parser.add_argument('--staff', type=int, default=10, help='Staff per salon')
+        parser.add_argument('--photos', type=int, default=5, help='Photos per salon')
+        parser.add_argument('--clients', type=int, default=20000)
+        parser.add_argument('--bookings', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Seeding processes')
+        parser.add_argument('--requests', type=int, default=30, help='Measured requests per route')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the seeded bench database for the next run')
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'api_baseline.json'))
+        parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument('--latency-threshold', type=float, default=1.5,
+                            help='Allowed p95 latency ratio to the baseline')
+        parser.add_argument('--latency-slack', type=float, default=2.0,
+                            help='Milliseconds always allowed on top, for noise on fast routes')
+        parser.add_argument('--payload-threshold', type=float, default=1.1,
+                            help='Allowed payload size ratio to the baseline')
+        parser.add_argument('--route', action='append', help='Only run scenarios of these route names')
+
+    def handle(self, *args, **options):
+        self.options = options
+        scenarios = self.scenarios()
+        self.check_coverage(scenarios)
+        self.check_baseline()
+
+        old_name = connection.settings_dict['NAME']
+        connection.settings_dict['TEST']['NAME'] = self.database_name(old_name)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'], serialize=False)
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        counter.install(connection=connection)
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(
+                DATABASE_REPLICAS=[],
+                MEDIA_ROOT=media_root,
+                SMS_BACKEND='users.sms.LocmemBackend',
+                PHOTO_RENDITION_WORKERS=0,
+            ):
+                reset_sms_queue()
+                if Booking.objects.exists():
+                    self.stdout.write('Reusing the seeded bench database')
+                else:
+                    self.seed()
+                volumes = self.volumes()
+                self.stdout.write('volumes: ' + ', '.join(f'{name} {count}' for name, count in volumes.items()))
+                self.data = self.bench_data()
+                results = {
+                    f'{scenario.method} {scenario.path}': self.measure(scenario, counter)
+                    for scenario in scenarios
+                    if not options['route'] or scenario.route in options['route']
+                }
+                reset_sms_queue()
+        finally:
+            connection_created.disconnect(counter.install)
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        self.report(volumes, results)
+
+    def database_name(self, name):
+        if connection.vendor == 'sqlite':
+            return str(Path(settings.BASE_DIR) / 'bench_db.sqlite3')
+        return f'bench_{name}'
+
+    # Scenarios
+
+    def scenarios(self):
+        """One or more requests per route; paths and bodies are filled from bench_data()."""
+        salon = '/api/salons/{salon}/'
+        return [
+            Scenario('api-root', 'GET', '/api/', 'client'),
+            Scenario('salon-list', 'GET', '/api/salons/'),
+            Scenario('salon-list', 'GET', '/api/salons/?service=Стрижка&max_price=2000'),
+            Scenario('salon-list', 'POST', '/api/salons/', 'owner', {
+                'title': 'Bench', 'description': 'Bench', 'location_lat': 41.3, 'location_lon': 69.2,
+                'yandex_link': 'https://yandex.ru/maps/',
+            }, status=201),
+            Scenario('salon-detail', 'GET', salon),
+            Scenario('salon-detail', 'PATCH', salon, 'owner', {'description': 'Обновлено'}),
+            Scenario('salon-nearby', 'GET', '/api/salons/nearby/?lat=41.31&lon=69.24&radius=5'),
+            Scenario('salon-search', 'GET', '/api/salons/search/?q=стрижка'),
+            Scenario('salon-autocomplete', 'GET', '/api/salons/autocomplete/?prefix=сал'),
+            Scenario('salon-staff', 'GET', salon + 'staff/'),
+            Scenario('salon-bookings', 'GET', salon + 'bookings/'),
+            Scenario('salon-availability', 'GET', salon + 'availability/?date={day}'),
+            Scenario('salon-staff-availability', 'GET', salon + 'staff/{staff}/availability/?date={day}'),
+            Scenario('salon-bulk-photos', 'POST', salon + 'photos/bulk/', 'owner',
+                     lambda data, iteration: {'images': [self.image(f'{iteration}_{n}.jpg') for n in range(3)]},
+                     format='multipart', status=201),
+            Scenario('salon-reorder-photos', 'PATCH', salon + 'photos/reorder/', 'owner',
+                     lambda data, iteration: {'photos': data['photos'][::-1]}),
+            Scenario('staff-list', 'GET', '/api/staff/', 'owner'),
+            Scenario('staff-detail', 'GET', '/api/staff/{staff}/', 'owner'),
+            Scenario('booking-list', 'GET', '/api/bookings/', 'client'),
+            Scenario('booking-list', 'GET', '/api/bookings/?expand=salon,staff', 'client'),
+            Scenario('booking-list', 'POST', '/api/bookings/', 'client', lambda data, iteration: {
+                'salon': data['salon'], 'staff': data['staff'], 'service': {'name': data['service']},
+                'booking_date': data['free_day'], 'booking_time': '12:00',
+            }, status=201),
+            Scenario('booking-detail', 'GET', '/api/bookings/{booking}/', 'client'),
+            Scenario('booking-detail', 'PATCH', '/api/bookings/{booking}/', 'client', lambda data, iteration: {
+                'service': {'name': data['booking_service']},
+            }),
+            Scenario('booking-confirm', 'POST', '/api/bookings/{booking}/confirm/', 'client'),
+            Scenario('booking-cancel', 'POST', '/api/bookings/{booking}/cancel/', 'client'),
+            Scenario('async-salon-list', 'GET', '/api/async/salons/'),
+            Scenario('async-salon-nearby', 'GET', '/api/async/salons/nearby/?lat=41.31&lon=69.24&radius=5'),
+            Scenario('async-salon-detail', 'GET', '/api/async' + salon[4:]),
+            Scenario('async-salon-availability', 'GET', '/api/async' + salon[4:] + 'availability/?date={day}'),
+            Scenario('send-otp', 'POST', '/api/users/auth/', None,
+                     lambda data, iteration: {'phone_number': f'+99899{iteration:07d}'}),
+            Scenario('verify-otp', 'POST', '/api/users/auth/verify-otp/', None, self.verify_otp_data),
+            Scenario('update-profile', 'POST', '/api/users/auth/update-profile/', 'client', {'first_name': 'Bench'}),
+            Scenario('token_obtain_pair', 'POST', '/api/users/auth/token/', None, lambda data, iteration: {
+                'phone_number': data['users']['client'].phone_number, 'password': BENCH_PASSWORD,
+            }),
+            Scenario('token_refresh', 'POST', '/api/users/auth/token/refresh/', None, lambda data, iteration: {
+                'refresh': data['refresh'],
+            }),
+            Scenario('metrics', 'GET', '/metrics'),
+            Scenario('schema-json', 'GET', '/swagger.json/'),
+            Scenario('schema-swagger-ui', 'GET', '/swagger/'),
+            Scenario('schema-redoc', 'GET', '/redoc/'),
+        ]
+
+    def check_coverage(self, scenarios):
+        """Every named route must have a scenario, so new endpoints cannot slip past the suite."""
+        covered = {scenario.route for scenario in scenarios}
+        missing = sorted(set(self.route_names(get_resolver())) - covered)
+        if missing:
+            raise CommandError(f"No benchmark scenario for routes: {', '.join(missing)}")
+
+    def route_names(self, resolver):
+        for pattern in resolver.url_patterns:
+            if isinstance(pattern, URLResolver):
+                if pattern.namespace not in EXCLUDED_NAMESPACES:
+                    yield from self.route_names(pattern)
+            elif pattern.name:
+                yield pattern.name
+
+    def verify_otp_data(self, data, iteration):
+        phone_number = f'+99898{iteration:07d}'
+        get_otp_store().issue(phone_number, '11111')
+        return {'phone_number': phone_number, 'otp': '11111'}
+
+    @staticmethod
+    def image(name):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), (200, 120, 80)).save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    # Seeding
+
+    def seed(self):
+        options = self.options
+        started = time.perf_counter()
+        call_command(
+            'seed_load', clients=options['clients'], salons=options['salons'], bookings=options['bookings'],
+            staff_min=options['staff'], staff_max=options['staff'],
+            photos_min=options['photos'], photos_max=options['photos'],
+            seed=options['seed'], batch_size=options['batch_size'], processes=options['processes'],
+            stdout=StringIO(),
+        )
+        self.stdout.write(f'Seeded in {time.perf_counter() - started:.0f} s')
+
+    def volumes(self):
+        return {
+            'users': User.objects.count(),
+            'salons': Salon.objects.count(),
+            'staff': Staff.objects.count(),
+            'photos': SalonPhoto.objects.count(),
+            'bookings': Booking.objects.count(),
+        }
+
+    def bench_data(self):
+        """Objects the scenarios use: the busiest salon, its owner and staff, and a client with bookings."""
+        salon = Salon.objects.order_by('pk').first()
+        staff = Staff.objects.filter(salon=salon).order_by('pk').first()
+        booking = Booking.objects.filter(salon=salon, status='pending').order_by('pk').first()
+        if booking is None:
+            raise CommandError('The bench database has no pending bookings to confirm or cancel')
+        last_day = Booking.objects.filter(staff=staff).aggregate(last_day=Max('booking_date'))['last_day']
+        client = User.objects.get(pk=booking.client_id)
+        client.set_password(BENCH_PASSWORD)
+        client.save(update_fields=['password'])
+        users = {'owner': User.objects.get(pk=salon.owner_id), 'client': client}
+        # Bookings only accept services the staff member offers; the shortest one
+        # keeps the updated booking clear of the next seeded slot
+        booking_services = sorted(booking.staff.get_services(), key=service_duration)
+        return {
+            'users': users,
+            'tokens': {name: str(UserRefreshToken.for_user(user).access_token) for name, user in users.items()},
+            'refresh': str(UserRefreshToken.for_user(client)),
+            'salon': salon.pk,
+            'staff': staff.pk,
+            'service': staff.get_services()[0]['name'],
+            'booking': booking.pk,
+            'booking_service': booking_services[0]['name'],
+            'photos': list(salon.photos.values_list('pk', flat=True)),
+            'day': (date.today() + timedelta(days=1)).isoformat(),
+            # After the seeded bookings of the staff member
+            'free_day': (max(last_day or date.today(), date.today()) + timedelta(days=1)).isoformat(),
+        }
+
+    # Measuring
+
+    def measure(self, scenario, counter):
+        data = self.data
+        path = scenario.path.format(**data)
+        client = Client()
+        headers = {}
+        if scenario.user:
+            headers['HTTP_AUTHORIZATION'] = f"Bearer {data['tokens'][scenario.user]}"
+        write = scenario.method != 'GET'
+        timings = []
+        queries = []
+        size = 0
+        # The first request warms up caches and is not measured
+        for iteration in range(self.options['requests'] + 1):
+            body = scenario.data(data, iteration) if callable(scenario.data) else scenario.data
+            kwargs = dict(headers, REMOTE_ADDR=f'10.{iteration // 65536 % 256}.{iteration // 256 % 256}.{iteration % 256}')
+            if body is not None:
+                if scenario.format == 'json':
+                    kwargs.update(data=json.dumps(body), content_type='application/json')
+                else:
+                    kwargs['data'] = body
+            # Writes are rolled back so every iteration sees the same database
+            with transaction.atomic():
+                before = counter.count
+                started = time.perf_counter()
+                response = getattr(client, scenario.method.lower())(path, **kwargs)
+                elapsed = (time.perf_counter() - started) * 1000
+                executed = counter.count - before
+                if write:
+                    transaction.set_rollback(True)
+            if response.status_code != scenario.status:
+                raise CommandError(
+                    f'{scenario.method} {path} returned {response.status_code}, expected {scenario.status}: '
+                    f'{response.content[:300]!r}'
+                )
+            if iteration:
+                timings.append(elapsed)
+                queries.append(executed)
+                size = len(response.content)
+        return {
+            'queries': max(queries),
+            'p50_ms': round(self.percentile(timings, 50), 2),
+            'p95_ms': round(self.percentile(timings, 95), 2),
+            'mean_ms': round(statistics.mean(timings), 2),
+            'bytes': size,
+        }
+
+    # Reporting
+
+    def check_baseline(self):
+        """Without a baseline there is nothing to compare with: only --update-baseline records one."""
+        path = Path(self.options['baseline'])
+        if not path.exists() and not self.options['update_baseline']:
+            raise CommandError(
+                f'No baseline at {path}; record one with --update-baseline on the machine that runs the checks'
+            )
+
+    def report(self, volumes, results):
+        path = Path(self.options['baseline'])
+        baseline = None
+        if path.exists() and not self.options['update_baseline']:
+            baseline = json.loads(path.read_text())
+            if baseline['volumes'] != volumes:
+                raise CommandError(
+                    f"Baseline {path} was recorded with other volumes ({baseline['volumes']}); "
+                    'run with the same options or --update-baseline'
+                )
+
+        regressions = []
+        self.stdout.write(f"{'route':<58}{'queries':>8}{'p50 ms':>10}{'p95 ms':>10}{'KiB':>10}  baseline")
+        for key, result in results.items():
+            base = baseline['routes'].get(key) if baseline else None
+            problems = self.regressions(result, base) if base else []
+            regressions.extend(f'{key}: {problem}' for problem in problems)
+            note = 'new' if baseline and not base else ('REGRESSED' if problems else ('ok' if base else ''))
+            self.stdout.write(
+                f"{key[:57]:<58}{result['queries']:>8}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                f"{result['bytes'] / 1024:>10.1f}  {note}"
+            )
+
+        if baseline is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            routes = results
+            if path.exists() and self.options['route']:
+                # Partial run: keep the other routes of the existing baseline
+                routes = {**json.loads(path.read_text())['routes'], **results}
+            path.write_text(json.dumps({'volumes': volumes, 'routes': routes}, indent=2, ensure_ascii=False) + '\n')
+            self.stdout.write(f'Baseline written to {path}')
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+
+    def regressions(self, result, base):
+        options = self.options
+        problems = []
+        if result['queries'] > base['queries']:
+            problems.append(f"{result['queries']} queries, baseline {base['queries']}")
+        allowed = base['p95_ms'] * options['latency_threshold'] + options['latency_slack']
+        if result['p95_ms'] > allowed:
+            problems.append(f"p95 {result['p95_ms']:.2f} ms, allowed {allowed:.2f} ms")
+        if result['bytes'] > base['bytes'] * options['payload_threshold']:
+            problems.append(f"{result['bytes']} bytes, baseline {base['bytes']}")
+        return problems
+
+    @staticmethod
+    def percentile(values, percent):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+        return ordered[index]
@@ -0,0 +1,166 @@
+import asyncio
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+from salons.models import Salon, SalonPhoto, Staff
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Compare throughput of the sync endpoints on the WSGI handler (a thread pool like '
+            'gunicorn --threads) with the async endpoints on the ASGI handler, with the same number '
+            'of requests in flight on both. Requests are made in-process; --db-latency adds a delay '
+            'to every query to model a remote database. Runs on a separate bench database that is '
+            'created and destroyed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Requests per endpoint and server')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Requests in flight: WSGI worker threads and concurrent ASGI requests')
+        parser.add_argument('--db-latency', type=float, default=20.0, help='Milliseconds added per query')
+        parser.add_argument('--salons', type=int, default=50)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.settings_dict['TEST']['NAME'] = self.database_name(old_name)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(DATABASE_REPLICAS=[], SALON_CACHE_ENABLED=False):
+                rows = self.run_benchmarks(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"{'endpoint':<14}{'server':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, server, throughput, timings in rows:
+            self.stdout.write(
+                f"{name:<14}{server:<8}{throughput:>10.1f}"
+                f"{self.percentile(timings, 50):>10.2f}{self.percentile(timings, 95):>10.2f}"
+            )
+
+    def database_name(self, name):
+        if connection.vendor == 'sqlite':
+            return str(Path(settings.BASE_DIR) / 'bench_asgi_db.sqlite3')
+        return f'bench_asgi_{name}'
+
+    def run_benchmarks(self, options):
+        salon_ids = self.seed(options['salons'])
+        day = (date.today() + timedelta(days=1)).isoformat()
+        endpoints = [
+            ('detail', lambda i: (f'salons/{salon_ids[i % len(salon_ids)]}/', '')),
+            ('availability', lambda i: (f'salons/{salon_ids[i % len(salon_ids)]}/availability/', f'date={day}')),
+            ('nearby', lambda i: ('salons/nearby/', 'lat=41.31&lon=69.24&radius=10')),
+        ]
+        latency = options['db_latency'] / 1000
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            # Sent on every reconnect of the (per thread) connection object
+            if slow_query not in connection.execute_wrappers:
+                connection.execute_wrappers.append(slow_query)
+
+        rows = []
+        connections.close_all()
+        connection_created.connect(add_latency)
+        try:
+            wsgi, asgi = get_wsgi_application(), get_asgi_application()
+            for name, target in endpoints:
+                rows.append((name, 'wsgi', *self.run_wsgi(wsgi, target, options)))
+                rows.append((name, 'asgi', *asyncio.run(self.run_asgi(asgi, target, options))))
+        finally:
+            connection_created.disconnect(add_latency)
+        return rows
+
+    def seed(self, count):
+        owner = User.objects.create(phone_number='+998900000000', username='+998900000000')
+        salons = Salon.objects.bulk_create(
+            Salon(title=f'ASGI bench {i}', description='Benchmark salon', location_lat=41.3 + i / 1000,
+                  location_lon=69.24, yandex_link='https://yandex.ru/maps/', owner=owner)
+            for i in range(count)
+        )
+        Staff.objects.bulk_create(
+            Staff(salon=salon, full_name=f'Staff {j}', services=[{'name': 'Стрижка', 'price': 1500}])
+            for salon in salons for j in range(5)
+        )
+        SalonPhoto.objects.bulk_create(
+            SalonPhoto(salon=salon, image=f'salon_photos/asgi_{salon.pk}_{j}.jpg', order=j, is_main=j == 0)
+            for salon in salons for j in range(3)
+        )
+        return [salon.pk for salon in salons]
+
+    def run_wsgi(self, application, target, options):
+        def call(i):
+            path, query = target(i)
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': f'/api/{path}', 'QUERY_STRING': query,
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+            }
+            statuses = []
+            started = time.perf_counter()
+            body = b''.join(application(environ, lambda status, headers: statuses.append(status)))
+            elapsed = (time.perf_counter() - started) * 1000
+            assert statuses[0].startswith('200'), (statuses[0], body[:200])
+            return elapsed
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            timings = list(pool.map(call, range(options['requests'])))
+        return options['requests'] / (time.perf_counter() - started), timings
+
+    async def run_asgi(self, application, target, options):
+        limit = asyncio.Semaphore(options['concurrency'])
+
+        async def call(i):
+            path, query = target(i)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': f'/api/async/{path}', 'raw_path': f'/api/async/{path}'.encode(),
+                'query_string': query.encode(), 'root_path': '', 'headers': [(b'host', b'localhost')],
+                'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+            }
+            messages = []
+            body_sent = asyncio.Event()
+
+            async def receive():
+                if body_sent.is_set():
+                    # Client stays connected; Django cancels this wait once the response is sent
+                    await asyncio.Future()
+                body_sent.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            async with limit:
+                started = time.perf_counter()
+                await application(scope, receive, send)
+                elapsed = (time.perf_counter() - started) * 1000
+            assert messages[0]['status'] == 200, messages
+            return elapsed
+
+        started = time.perf_counter()
+        timings = await asyncio.gather(*(call(i) for i in range(options['requests'])))
+        return options['requests'] / (time.perf_counter() - started), timings
+
+    @staticmethod
+    def percentile(values, percent):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+        return ordered[index]
@@ -0,0 +1,62 @@
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from salons.autocomplete import PrefixIndex
+
+WORDS = [
+    'студия', 'салон', 'барбершоп', 'красоты', 'beauty', 'nails', 'hair', 'style', 'lux', 'premium',
+    'маникюр', 'педикюр', 'стрижка', 'окрашивание', 'укладка', 'брови', 'ресницы', 'массаж', 'spa', 'lab',
+]
+
+
+class Command(BaseCommand):
+    help = 'Measure memory footprint, build time and lookup latency of the autocomplete index on synthetic data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=100_000, help='Salon titles plus service names')
+        parser.add_argument('--lookups', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['entries']
+        services = count // 10
+        salons = [
+            (i, ' '.join(rng.sample(WORDS, 3)) + f' {i}')
+            for i in range(count - services)
+        ]
+        staff = [
+            (i, [f'{rng.choice(WORDS)} {i}'])
+            for i in range(services)
+        ]
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = PrefixIndex.build(salons, staff)
+        build_seconds = time.perf_counter() - started
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        prefixes = [rng.choice(WORDS)[:rng.randint(1, 5)] for _ in range(options['lookups'])]
+        timings = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.lookup(prefix)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        self.stdout.write(f'entries: {count} ({len(index)} keys)')
+        self.stdout.write(f'build: {build_seconds:.2f} s, memory: {memory / 1024 / 1024:.1f} MiB')
+        self.stdout.write(
+            f'lookup ms: p50 {self.percentile(timings, 50):.3f}, p95 {self.percentile(timings, 95):.3f}, '
+            f'p99 {self.percentile(timings, 99):.3f}, mean {statistics.mean(timings):.3f}'
+        )
+
+    @staticmethod
+    def percentile(values, percent):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+        return ordered[index]
@@ -0,0 +1,100 @@
+import statistics
+import tempfile
+import time
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from salons.models import Salon, SalonPhoto
+from salons.photos import process_photo
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Bytes transferred for a salon page with original photos vs JPEG and WebP renditions. '
+            'Photos are synthetic camera-sized JPEGs written to a temporary MEDIA_ROOT; '
+            'database rows are created inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--photos', type=int, default=10, help='Photos of the salon')
+        parser.add_argument('--width', type=int, default=4000, help='Width of the uploaded photos')
+        parser.add_argument('--height', type=int, default=3000, help='Height of the uploaded photos')
+        parser.add_argument('--display-width', type=int, default=1080,
+                            help='Device pixels a photo is displayed at on the salon page')
+        parser.add_argument('--card-width', type=int, default=640,
+                            help='Device pixels of the main photo on a salon list card')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            with transaction.atomic():
+                salon = self.seed(options)
+                photos = list(salon.photos.all())
+                build_times = []
+                for photo in photos:
+                    started = time.perf_counter()
+                    process_photo(photo.pk, salon.pk, photo.image.name)
+                    build_times.append((time.perf_counter() - started) * 1000)
+                photos = list(salon.photos.all())
+                originals = [photo.image.size for photo in photos]
+                json_bytes = len(APIClient().get(f'/api/salons/{salon.pk}/').content)
+                transaction.set_rollback(True)
+
+        rows = [('original', sum(originals), originals[0])]
+        for kind in ('jpeg', 'webp'):
+            rows.append((
+                kind,
+                sum(self.pick(photo, kind, options['display_width'])['size'] for photo in photos),
+                self.pick(photos[0], kind, options['card_width'])['size'],
+            ))
+
+        self.stdout.write(
+            f"{len(photos)} photos of {options['width']}x{options['height']}, "
+            f"page at {options['display_width']}px, list card at {options['card_width']}px, "
+            f"salon JSON {json_bytes / 1024:.1f} KiB"
+        )
+        self.stdout.write(f"{'images':<10}{'page KiB':>12}{'card KiB':>12}{'saved':>10}")
+        for name, page, card in rows:
+            saved = 1 - page / rows[0][1]
+            self.stdout.write(f"{name:<10}{page / 1024:>12.1f}{card / 1024:>12.1f}{saved:>10.0%}")
+        self.stdout.write(
+            f"renditions build: mean {statistics.mean(build_times):.0f} ms, "
+            f"max {max(build_times):.0f} ms per photo (background worker)"
+        )
+
+    def seed(self, options):
+        owner = User.objects.create(phone_number='+000bench', username='+000bench')
+        salon = Salon.objects.create(
+            title='Bench salon', description='Benchmark salon', location_lat=41.3, location_lon=69.2,
+            yandex_link='https://yandex.ru/maps/', owner=owner,
+        )
+        content = self.photo(options['width'], options['height'])
+        for order in range(options['photos']):
+            photo = SalonPhoto(salon=salon, order=order, is_main=order == 0)
+            # bulk_create sends no post_save: renditions are built synchronously, not by the queue
+            photo.image.save(f'bench_{order}.jpg', ContentFile(content), save=False)
+            SalonPhoto.objects.bulk_create([photo])
+        return salon
+
+    @staticmethod
+    def photo(width, height):
+        """A camera-like JPEG: gradients and fractal detail with sensor noise, so it compresses like a photo."""
+        gradient = Image.linear_gradient('L').resize((width, height))
+        radial = Image.radial_gradient('L').resize((width, height))
+        detail = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 64)
+        image = Image.merge('RGB', (gradient, detail, radial))
+        noise = Image.effect_noise((width, height), 48).convert('RGB')
+        image = Image.blend(image, noise, 0.1)
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=92)
+        return buffer.getvalue()
+
+    @staticmethod
+    def pick(photo, kind, display_width):
+        """The rendition a browser picks from srcset: the smallest one covering the display width."""
+        renditions = photo.renditions[kind]
+        return next((rendition for rendition in renditions if rendition['width'] >= display_width), renditions[-1])
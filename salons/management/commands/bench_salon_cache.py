@@ -0,0 +1,95 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from BookingSalons.metrics import registry
+from salons.cache import get_cache
+from salons.models import Salon, SalonPhoto, Staff
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Measure salon list/detail latency with the salon cache disabled and enabled. '
+            'Test data is created inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salons', type=int, default=200)
+        parser.add_argument('--staff', type=int, default=5, help='Staff per salon')
+        parser.add_argument('--photos', type=int, default=5, help='Photos per salon')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            salon_ids = self.seed(options)
+            rows = []
+            for enabled in (False, True):
+                # APIClient requests are for "testserver"
+                with override_settings(SALON_CACHE_ENABLED=enabled, SALON_CACHE_HOST='testserver'):
+                    get_cache().clear()
+                    before = self.cache_counts()
+                    rows.append(self.run('list', ['/api/salons/'], enabled, options))
+                    # A few hot salons, like the popular ones in production
+                    detail_urls = [f'/api/salons/{pk}/' for pk in salon_ids[:10]]
+                    rows.append(self.run('detail', detail_urls, enabled, options))
+                    if enabled:
+                        after = self.cache_counts()
+                        hits, misses = (after[result] - before[result] for result in ('hit', 'miss'))
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{'endpoint':<10}{'cache':<8}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+        for name, enabled, timings in rows:
+            self.stdout.write(
+                f"{name:<10}{'on' if enabled else 'off':<8}"
+                f"{self.percentile(timings, 50):>10.2f}{self.percentile(timings, 95):>10.2f}"
+                f"{statistics.mean(timings):>10.2f}"
+            )
+        total = hits + misses
+        self.stdout.write(f"cache hits: {hits:.0f}, misses: {misses:.0f}, "
+                          f"hit ratio: {hits / total if total else 0.0:.2f}")
+
+    @staticmethod
+    def cache_counts():
+        return {
+            result: registry.value('cache_requests_total', cache='salon', result=result)
+            for result in ('hit', 'miss')
+        }
+
+    def seed(self, options):
+        owner = User.objects.create(phone_number='+000bench', username='+000bench')
+        salons = Salon.objects.bulk_create(
+            Salon(title=f'Bench salon {i}', description='Benchmark salon ' * 10,
+                  location_lat=41.3 + i / 1000, location_lon=69.2, yandex_link='https://yandex.ru/maps/',
+                  owner=owner)
+            for i in range(options['salons'])
+        )
+        Staff.objects.bulk_create(
+            Staff(salon=salon, full_name=f'Staff {j}',
+                  services=[{'name': 'Стрижка', 'price': 1500}, {'name': 'Окрашивание', 'price': 3000}])
+            for salon in salons for j in range(options['staff'])
+        )
+        SalonPhoto.objects.bulk_create(
+            SalonPhoto(salon=salon, image=f'salon_photos/bench_{salon.pk}_{j}.jpg', order=j, is_main=j == 0)
+            for salon in salons for j in range(options['photos'])
+        )
+        return [salon.pk for salon in salons]
+
+    def run(self, name, urls, enabled, options):
+        client = APIClient()
+        timings = []
+        for i in range(options['requests']):
+            url = urls[i % len(urls)]
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.status_code
+        return name, enabled, timings
+
+    @staticmethod
+    def percentile(values, percent):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+        return ordered[index]
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from salons.photos import build_missing_renditions
+
+
+class Command(BaseCommand):
+    help = ('Build the renditions of photos that have none for their current image: uploads whose '
+            'queued job was lost with a restarted worker, or whose build failed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild the renditions of every photo')
+
+    def handle(self, *args, **options):
+        built, failed = build_missing_renditions(force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f'Built renditions of {built} photos, {failed} failed.'))
@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from salons.models import Booking
+
+
+class Command(BaseCommand):
+    help = 'Print EXPLAIN output for the Booking hot-path queries to check that indexes are used.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true',
+                            help='Run EXPLAIN ANALYZE (PostgreSQL only, executes the queries).')
+
+    def handle(self, *args, **options):
+        sample = Booking.objects.order_by('-id').first()
+        if sample is None:
+            raise CommandError('No bookings found, seed some data first.')
+
+        month_start = sample.booking_date.replace(day=1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+
+        queries = [
+            ('BookingViewSet.get_queryset (client bookings)',
+             Booking.objects.filter(client_id=sample.client_id)),
+            ('SalonViewSet.bookings (salon bookings)',
+             Booking.objects.filter(salon_id=sample.salon_id)),
+            ('Availability day load (salon + date, active)',
+             Booking.objects.filter(salon_id=sample.salon_id, booking_date=sample.booking_date,
+                                    status__in=Booking.ACTIVE_STATUSES)
+             .order_by().values_list('staff_id', 'booking_time', 'service')),
+            ('Slot overlap check (staff + date, active)',
+             Booking.objects.filter(staff_id=sample.staff_id, booking_date=sample.booking_date,
+                                    status__in=Booking.ACTIVE_STATUSES)
+             .order_by().values_list('booking_time', 'service')),
+            ('Admin date_hierarchy (one month)',
+             Booking.objects.filter(booking_date__gte=month_start, booking_date__lt=next_month)
+             .order_by('-booking_date', '-booking_time')),
+        ]
+
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--analyze is only supported on PostgreSQL.')
+            explain_options = {'analyze': True, 'buffers': True}
+
+        for title, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from salons.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the salon search index (salons, staff names and services).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        processed = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {processed} salons.'))
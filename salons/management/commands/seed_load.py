@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from salons import loadgen
+from users.models import User
+
+PHASES = ('users', 'salons', 'staff', 'bookings')
+
+
+class Command(BaseCommand):
+    help = ('Generate synthetic load data: users, salons spread around Uzbek cities, staff with '
+            'services, photo rows and bookings over the past year and the next month. Rows are '
+            'bulk inserted by several processes and depend only on --seed and the volumes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200_000)
+        parser.add_argument('--salons', type=int, default=20_000)
+        parser.add_argument('--staff-min', type=int, default=3, help='Staff per salon, lower bound')
+        parser.add_argument('--staff-max', type=int, default=15, help='Staff per salon, upper bound')
+        parser.add_argument('--photos-min', type=int, default=1, help='Photos per salon, lower bound')
+        parser.add_argument('--photos-max', type=int, default=8, help='Photos per salon, upper bound')
+        parser.add_argument('--bookings', type=int, default=10_000_000)
+        parser.add_argument('--days-back', type=int, default=365, help='Days of booking history')
+        parser.add_argument('--days-ahead', type=int, default=30, help='Days of upcoming bookings')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create')
+        parser.add_argument('--chunk-size', type=int, default=50_000, help='Rows per worker task')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes (forked); 1 inserts in this process')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Do not rebuild the staff services table and the search index')
+
+    def handle(self, *args, **options):
+        if options['staff_min'] < 1 or options['staff_min'] > options['staff_max']:
+            raise CommandError('--staff-min must be at least 1 and not above --staff-max')
+        if options['photos_min'] < 0 or options['photos_min'] > options['photos_max']:
+            raise CommandError('--photos-min must be at least 0 and not above --photos-max')
+        if options['salons'] < 1 or options['clients'] < 1:
+            raise CommandError('--salons and --clients must be at least 1')
+        if User.objects.filter(phone_number__startswith=loadgen.PHONE_PREFIX).exists():
+            raise CommandError('The database already has load data, seed an empty database')
+        processes = max(1, options['processes'])
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.stderr.write('Worker processes need the fork start method, inserting in this process')
+            processes = 1
+        if processes > 1 and connection.in_atomic_block:
+            raise CommandError('Worker processes cannot see rows of an open transaction, use --processes 1')
+
+        plan = loadgen.plan(
+            salons=options['salons'], clients=options['clients'], bookings=options['bookings'],
+            staff=(options['staff_min'], options['staff_max']),
+            photos=(options['photos_min'], options['photos_max']),
+            days_back=options['days_back'], days_ahead=options['days_ahead'], seed=options['seed'],
+            batch_size=options['batch_size'], chunk_size=options['chunk_size'],
+        )
+        started = time.perf_counter()
+        if processes == 1:
+            with loadgen.relaxed_sync(connection):
+                for phase in PHASES:
+                    self.run_phase(phase, plan, lambda chunks: (loadgen.run_task(plan, task) for task in chunks))
+        else:
+            # Forked workers open their own connections; none may be shared with them
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context('fork'),
+                initializer=loadgen.init_worker, initargs=(plan,),
+            ) as pool:
+                for phase in PHASES:
+                    # Phases run one after another: rows only reference committed rows
+                    self.run_phase(phase, plan, lambda chunks: pool.map(loadgen.run_worker_task, chunks))
+        loadgen.reset_sequences()
+
+        if not options['skip_derived']:
+            # bulk_create sends no signals: build the derived tables in one go
+            self.step('staff services', lambda: call_command('sync_staff_services', stdout=StringIO()))
+            self.step('search index', lambda: call_command('rebuild_search_index', stdout=StringIO()))
+        self.step('analyze', self.analyze)
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {plan['bookings']} bookings with {processes} processes "
+            f'in {time.perf_counter() - started:.0f} s'
+        ))
+
+    def run_phase(self, phase, plan, run):
+        started = time.perf_counter()
+        rows = sum(run(loadgen.tasks(plan, phase)))
+        elapsed = time.perf_counter() - started
+        label = 'staff and photos' if phase == 'staff' else phase
+        self.stdout.write(f'{label}: {rows} rows in {elapsed:.1f} s ({rows / max(elapsed, 1e-6):.0f} rows/s)')
+
+    def step(self, label, run):
+        started = time.perf_counter()
+        run()
+        self.stdout.write(f'{label}: {time.perf_counter() - started:.1f} s')
+
+    @staticmethod
+    def analyze():
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from salons.catalog import rebuild_services
+
+
+class Command(BaseCommand):
+    help = 'Backfill the StaffService table from Staff.services for existing staff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        processed = rebuild_services(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Synced services of {processed} staff members.'))
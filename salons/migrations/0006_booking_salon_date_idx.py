@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salons', '0005_remove_staff_working_shifts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['salon', 'booking_date'], name='booking_salon_date_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def cancel_double_bookings(apps, schema_editor):
+    # Keep the earliest active booking of every staff/date/time and cancel the rest,
+    # otherwise the unique constraint cannot be created on existing data.
+    Booking = apps.get_model('salons', 'Booking')
+    seen = set()
+    duplicates = []
+    active = Booking.objects.filter(status__in=['pending', 'confirmed']).order_by('id')
+    for pk, staff_id, booking_date, booking_time in active.values_list(
+        'id', 'staff_id', 'booking_date', 'booking_time'
+    ):
+        key = (staff_id, booking_date, booking_time)
+        if key in seen:
+            duplicates.append(pk)
+        else:
+            seen.add(key)
+    Booking.objects.filter(pk__in=duplicates).update(status='cancelled')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salons', '0006_booking_salon_date_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_double_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'confirmed'])), fields=('staff', 'booking_date', 'booking_time'), name='booking_unique_active_staff_slot'),
+        ),
+    ]
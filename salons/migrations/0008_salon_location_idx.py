@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salons', '0007_booking_unique_active_staff_slot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='salon',
+            index=models.Index(fields=['location_lat', 'location_lon'], name='salon_location_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salons', '0009_booking_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaffService',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('name_key', models.CharField(max_length=200)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('duration', models.PositiveIntegerField(blank=True, null=True)),
+                ('salon', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='service_rows', to='salons.salon')),
+                ('staff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_rows', to='salons.staff')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['name_key', 'price', 'salon'], name='staffservice_name_price_idx'), models.Index(fields=['salon', 'name_key'], name='staffservice_salon_name_idx')],
+            },
+        ),
+    ]
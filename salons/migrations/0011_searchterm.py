@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 10:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salons', '0010_staffservice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('w', 'Word'), ('t', 'Trigram')], max_length=1)),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.FloatField()),
+                ('salon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='salons.salon')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term', 'salon'], name='searchterm_term_idx')],
+            },
+        ),
+    ]
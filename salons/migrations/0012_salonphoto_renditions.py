@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('salons', '0011_searchterm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salonphoto',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -1,11 +1,18 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 import json
 
+from BookingSalons.tracking import TrackedFieldsMixin
+from .cache import invalidate_salon_on_commit
+
 User = get_user_model()
 
-class Salon(models.Model):
+class Salon(TrackedFieldsMixin, models.Model):
+    # Indexed for search (salons.search)
+    tracked_fields = ('title', 'description')
+
     title = models.CharField(max_length=200)
     description = models.TextField()
     location_lat = models.DecimalField(max_digits=9, decimal_places=6)
@@ -15,14 +22,41 @@ class Salon(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Bounding box prefilter for the nearby search
+            models.Index(fields=['location_lat', 'location_lon'], name='salon_location_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+    def get_photos(self):
+        """Photos attached as `loaded_photos` (salons.async_views), else the (prefetched) relation."""
+        photos = getattr(self, 'loaded_photos', None)
+        return self.photos.all() if photos is None else photos
+
+    def get_staff(self):
+        """Staff attached as `loaded_staff` (salons.async_views), else the (prefetched) relation."""
+        staff = getattr(self, 'loaded_staff', None)
+        return self.staff.all() if staff is None else staff
+
+def touch_salon(salon_id):
+    """
+    Bump the salon's updated_at and drop its cached representations after a
+    change to its parts, so ETags and cached details change too. The cache is
+    invalidated when the transaction commits.
+    """
+    Salon.objects.filter(pk=salon_id).update(updated_at=timezone.now())
+    invalidate_salon_on_commit(salon_id)
+
 class SalonPhoto(models.Model):
     salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='photos')
     image = models.ImageField(upload_to='salon_photos/')
     order = models.PositiveIntegerField(default=0)
     is_main = models.BooleanField(default=False)
+    # Resized copies built by salons.photos: {'source': image name, 'webp': [...], 'jpeg': [...]}
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -35,10 +69,16 @@ class SalonPhoto(models.Model):
 
     def save(self, *args, **kwargs):
         if self.is_main:
-            SalonPhoto.objects.filter(salon=self.salon, is_main=True).exclude(pk=self.pk).update(is_main=False)
+            updated = SalonPhoto.objects.filter(salon=self.salon, is_main=True).exclude(pk=self.pk).update(is_main=False)
+            if updated:
+                # update() sends no signals
+                invalidate_salon_on_commit(self.salon_id)
         super().save(*args, **kwargs)
 
-class Staff(models.Model):
+class Staff(TrackedFieldsMixin, models.Model):
+    # Indexed for search (salons.search)
+    tracked_fields = ('salon_id', 'full_name', 'services')
+
     salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='staff')
     full_name = models.CharField(max_length=200)
     services = models.JSONField()  # List of services with prices
@@ -49,7 +89,68 @@ class Staff(models.Model):
         return f"{self.full_name} - {self.salon.title}"
 
     def get_services(self):
-        return json.loads(self.services)
+        services = self.services
+        if isinstance(services, str):
+            services = json.loads(services)
+        # Services may be stored as plain names or as dicts with price/duration
+        return [
+            service if isinstance(service, dict) else {'name': service}
+            for service in services or []
+        ]
+
+    def get_service(self, name):
+        name = name.strip().casefold()
+        for service in self.get_services():
+            if str(service.get('name', '')).strip().casefold() == name:
+                return service
+        return None
+
+class StaffService(models.Model):
+    """
+    Normalized copy of Staff.services, one row per service, kept in sync by
+    salons.signals so salons can be filtered by service and price in SQL.
+    """
+    staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='service_rows')
+    salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='service_rows', db_index=False)
+    name = models.CharField(max_length=200)
+    name_key = models.CharField(max_length=200)  # casefolded name used for lookups
+    price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    duration = models.PositiveIntegerField(null=True, blank=True)  # minutes
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name_key', 'price', 'salon'], name='staffservice_name_price_idx'),
+            models.Index(fields=['salon', 'name_key'], name='staffservice_salon_name_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} - {self.staff_id}"
+
+class SearchTerm(models.Model):
+    """
+    Inverted index of salon texts maintained by salons.search: stemmed words of
+    the title, description, staff names and service names, plus character
+    trigrams of the short fields for fuzzy matching.
+    """
+    WORD = 'w'
+    TRIGRAM = 't'
+    KIND_CHOICES = [
+        (WORD, 'Word'),
+        (TRIGRAM, 'Trigram'),
+    ]
+
+    salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='search_terms')
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    term = models.CharField(max_length=64)
+    weight = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term', 'salon'], name='searchterm_term_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} ({self.salon_id})"
 
 class Booking(models.Model):
     STATUS_CHOICES = [
@@ -58,10 +159,12 @@ class Booking(models.Model):
         ('cancelled', 'Cancelled'),
         ('completed', 'Completed'),
     ]
+    ACTIVE_STATUSES = ('pending', 'confirmed')
 
-    salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='bookings')
-    staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='bookings')
-    client = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
+    # salon/staff/client lookups are served by the composite indexes in Meta
+    salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='bookings', db_index=False)
+    staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='bookings', db_index=False)
+    client = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings', db_index=False)
     service = models.JSONField()  # Selected service with price
     booking_date = models.DateField()
     booking_time = models.TimeField()
@@ -74,3 +177,21 @@ class Booking(models.Model):
 
     class Meta:
         ordering = ['-booking_date', '-booking_time']
+        indexes = [
+            # BookingViewSet.get_queryset: client's bookings in Meta.ordering order
+            models.Index(fields=['client', '-booking_date', '-booking_time'], name='booking_client_date_idx'),
+            # SalonViewSet.bookings and the availability day load (salon + date equality)
+            models.Index(fields=['salon', '-booking_date', '-booking_time'], name='booking_salon_date_idx'),
+            # Slot overlap check and staff schedules
+            models.Index(fields=['staff', 'booking_date', 'booking_time'], name='booking_staff_date_idx'),
+            # Admin date_hierarchy and unfiltered changelist ordering
+            models.Index(fields=['-booking_date', '-booking_time'], name='booking_date_time_idx'),
+        ]
+        constraints = [
+            # One active booking per staff member and start time, enforced by the database
+            models.UniqueConstraint(
+                fields=['staff', 'booking_date', 'booking_time'],
+                condition=models.Q(status__in=['pending', 'confirmed']),
+                name='booking_unique_active_staff_slot',
+            ),
+        ]
@@ -0,0 +1,90 @@
+import base64
+import json
+from datetime import date, time
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class BookingCursorPagination(BasePagination):
+    """
+    Keyset pagination over (booking_date, booking_time, id).
+
+    The cursor holds the key of the last row of the page and the next page is
+    fetched with a `WHERE key > cursor` condition, so deep pages cost the same
+    as the first one. No COUNT query is issued.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('booking_date', 'booking_time', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        rows = list(queryset.order_by(*self.ordering)[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def after(self, position):
+        booking_date, booking_time, pk = position
+        # The leading booking_date__gte keeps the condition an index range scan
+        return Q(booking_date__gte=booking_date) & (
+            Q(booking_date__gt=booking_date)
+            | Q(booking_date=booking_date, booking_time__gt=booking_time)
+            | Q(booking_date=booking_date, booking_time=booking_time, id__gt=pk)
+        )
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            booking_date, booking_time, pk = json.loads(raw)
+            return date.fromisoformat(booking_date), time.fromisoformat(booking_time), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, booking):
+        raw = json.dumps([booking.booking_date.isoformat(), booking.booking_time.isoformat(), booking.pk])
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParser as DjangoMultiPartParser, MultiPartParserError
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+
+class TemporaryFileMultiPartParser(MultiPartParser):
+    """
+    Multipart parser that streams every file to a temporary file instead of
+    keeping small ones in memory (FILE_UPLOAD_HANDLERS is not consulted); the
+    storage then moves them into place.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        request = parser_context['request']
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        meta = request.META.copy()
+        meta['CONTENT_TYPE'] = media_type
+        upload_handlers = [TemporaryFileUploadHandler(request)]
+        try:
+            data, files = DjangoMultiPartParser(meta, stream, upload_handlers, encoding).parse()
+        except MultiPartParserError as exc:
+            raise ParseError(f'Multipart form parse error - {exc}')
+        return DataAndFiles(data, files)
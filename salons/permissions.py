@@ -0,0 +1,9 @@
+from rest_framework.permissions import BasePermission
+
+
+class IsSalonOwner(BasePermission):
+    """Object permission for salons: only the owner may change them."""
+    message = 'Only the salon owner can do this.'
+
+    def has_object_permission(self, request, view, obj):
+        return obj.owner_id == request.user.id
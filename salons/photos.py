@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from BookingSalons.workers import WorkerQueue
+
+from .models import SalonPhoto, touch_salon
+
+logger = logging.getLogger(__name__)
+
+# Pillow format and save options per rendition format, in srcset preference order
+FORMATS = {
+    'webp': ('WEBP', {'method': 4}),
+    'jpeg': ('JPEG', {'optimize': True, 'progressive': True}),
+}
+RENDITIONS_DIR = 'salon_photos/renditions'
+
+
+def _target_widths(width):
+    """Configured widths not larger than the original; a smaller original gets one rendition of its own size."""
+    widths = [target for target in sorted(settings.PHOTO_RENDITION_WIDTHS) if target <= width]
+    return widths or [width]
+
+
+def build_renditions(name, storage=None):
+    """
+    Resize the image stored under `name` into PHOTO_RENDITION_WIDTHS in every
+    format of FORMATS, save them next to it and return the renditions dict
+    stored on SalonPhoto.renditions: per format a list of
+    {'name', 'width', 'height', 'size'} ordered by width.
+    """
+    storage = storage or default_storage
+    with storage.open(name) as file:
+        with Image.open(file) as original:
+            # Phones store the orientation in EXIF: apply it, renditions carry no EXIF
+            image = ImageOps.exif_transpose(original)
+            image = image.convert('RGB')
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    renditions = {'source': name}
+    for kind in FORMATS:
+        renditions[kind] = []
+    for width in _target_widths(image.width):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for kind, (pillow_format, options) in FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, pillow_format, quality=settings.PHOTO_RENDITION_QUALITY[kind], **options)
+            saved = storage.save(f'{RENDITIONS_DIR}/{stem}_{width}.{kind}', ContentFile(buffer.getvalue()))
+            renditions[kind].append({
+                'name': saved, 'width': width, 'height': height, 'size': buffer.tell(),
+            })
+    return renditions
+
+
+def delete_renditions(renditions, storage=None):
+    storage = storage or default_storage
+    for kind in FORMATS:
+        for rendition in renditions.get(kind, ()):
+            storage.delete(rendition['name'])
+
+
+def process_photo(photo_id, salon_id, name):
+    """
+    Build the renditions of a photo and store them on it, deleting the files of
+    the renditions they replace (of this image or of a previous one). The update
+    only applies while the photo still has the image `name`, so a job for a
+    replaced image does not overwrite the renditions of the new one.
+    """
+    try:
+        renditions = build_renditions(name)
+    except FileNotFoundError:
+        logger.warning('Photo %s is missing from storage, no renditions built', name)
+        return False
+    except Exception:
+        logger.exception('Renditions of %s failed', name)
+        return False
+    photo = SalonPhoto.objects.filter(pk=photo_id, image=name)
+    with transaction.atomic():
+        previous = photo.select_for_update().values_list('renditions', flat=True).first()
+        updated = photo.update(renditions=renditions)
+    if not updated:
+        delete_renditions(renditions)
+        return False
+    if previous:
+        delete_renditions(previous)
+    # update() sends no signals
+    touch_salon(salon_id)
+    return True
+
+
+def needs_renditions(photo):
+    return bool(photo.image) and not current_renditions(photo)
+
+
+def build_missing_renditions(force=False):
+    """
+    Build the renditions of photos that have none for their current image, or
+    of every photo with `force`. Picks up jobs lost with a restarted worker and
+    failed builds. Returns (built, failed).
+    """
+    photos = SalonPhoto.objects.exclude(image='').only('salon', 'image', 'renditions').order_by('pk')
+    # Collected first: SQLite does not isolate a running SELECT from the updates
+    jobs = [
+        (photo.pk, photo.salon_id, photo.image.name)
+        for photo in photos.iterator() if force or needs_renditions(photo)
+    ]
+    built = sum(process_photo(*job) for job in jobs)
+    return built, len(jobs) - built
+
+
+class RenditionQueue(WorkerQueue):
+    """
+    Background rendition builder so photo uploads return before resizing.
+
+    Jobs are (photo_id, salon_id, image name) tuples processed by worker
+    threads; Pillow releases the GIL while resizing and encoding. With no
+    workers, jobs run inline in enqueue().
+    """
+    thread_name = 'renditions'
+
+    def enqueue(self, photo_id, salon_id, name):
+        job = (photo_id, salon_id, name)
+        if self.workers:
+            super().enqueue(job)
+            return
+        with self._lock:
+            self._pending += 1
+        self.done(1, ok=self.build(job))
+
+    def handle(self, job):
+        close_old_connections()
+        self.done(1, ok=self.build(job))
+
+    def worker_stopped(self):
+        close_old_connections()
+
+    @staticmethod
+    def build(job):
+        try:
+            return process_photo(*job)
+        except Exception:
+            logger.exception('Renditions of photo %s failed', job[0])
+            return False
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """The process-wide rendition queue, created on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = RenditionQueue(workers=settings.PHOTO_RENDITION_WORKERS)
+    return _queue
+
+
+def reset_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.stop()
+        _queue = None
+
+
+def schedule_renditions(photo):
+    get_queue().enqueue(photo.pk, photo.salon_id, photo.image.name)
+
+
+def rendition_url(rendition, request=None):
+    url = default_storage.url(rendition['name'])
+    return request.build_absolute_uri(url) if request else url
+
+
+def current_renditions(photo):
+    """Renditions of the photo's current image, {} until they are built."""
+    renditions = photo.renditions or {}
+    return renditions if photo.image and renditions.get('source') == photo.image.name else {}
+
+
+def srcset(photo, request=None):
+    """{'webp': 'url 320w, url 640w', 'jpeg': ...} of a processed photo, {} until processed."""
+    renditions = current_renditions(photo)
+    return {
+        kind: ', '.join(f"{rendition_url(rendition, request)} {rendition['width']}w" for rendition in renditions[kind])
+        for kind in FORMATS if renditions.get(kind)
+    }
+
+
+def smallest_rendition(photo, kind='jpeg'):
+    renditions = current_renditions(photo).get(kind)
+    return renditions[0] if renditions else None
@@ -0,0 +1,193 @@
+import math
+import re
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+
+from .models import Salon, SearchTerm
+
+# Relevance of a match depending on the field it comes from
+TITLE_WEIGHT = 3.0
+SERVICE_WEIGHT = 2.0
+STAFF_WEIGHT = 1.5
+DESCRIPTION_WEIGHT = 1.0
+
+MAX_QUERY_TERMS = 10
+TRIGRAM_THRESHOLD = 0.3
+MIN_STEM_LENGTH = 3
+# Seconds the salon count used for idf is reused. It is forgotten when this
+# process creates or deletes a salon; idf barely moves with a few salons more.
+SALON_COUNT_TTL = 300
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Russian inflectional endings, longest first. This is a light stemmer: it only
+# needs to map the word forms people type to the same key as the indexed text.
+RUSSIAN_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ией', 'ием', 'иям', 'иях',
+    'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их',
+    'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ий', 'ый', 'ой', 'ей', 'ую', 'юю',
+    'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ов', 'ев', 'ию', 'ью', 'ия', 'ья',
+    'ать', 'ять', 'ить', 'еть', 'ть',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+ENGLISH_ENDINGS = ['ing', 'es', 's']
+CYRILLIC_RE = re.compile('[а-я]')
+
+
+def normalize(text):
+    return str(text).casefold().replace('ё', 'е')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+def stem(word):
+    endings = RUSSIAN_ENDINGS if CYRILLIC_RE.search(word) else ENGLISH_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def salon_documents(salon):
+    """(text, weight, with_trigrams) pairs describing a salon."""
+    documents = [
+        (salon.title, TITLE_WEIGHT, True),
+        (salon.description, DESCRIPTION_WEIGHT, False),
+    ]
+    for staff in salon.staff.all():
+        documents.append((staff.full_name, STAFF_WEIGHT, True))
+        for service in staff.get_services():
+            documents.append((service.get('name', ''), SERVICE_WEIGHT, True))
+    return documents
+
+
+def build_terms(salon):
+    """Unsaved SearchTerm rows for a salon, one per distinct term and kind."""
+    weights = defaultdict(float)
+    for text, weight, with_trigrams in salon_documents(salon):
+        for word in tokenize(text):
+            weights[(SearchTerm.WORD, stem(word)[:64])] += weight
+            if with_trigrams:
+                for gram in trigrams(word):
+                    # A trigram counts once per field, no matter how often it repeats
+                    weights[(SearchTerm.TRIGRAM, gram)] = max(weights[(SearchTerm.TRIGRAM, gram)], weight)
+    return [
+        SearchTerm(salon_id=salon.pk, kind=kind, term=term, weight=weight)
+        for (kind, term), weight in weights.items()
+    ]
+
+
+def index_salon(salon_id):
+    """Rebuild the search terms of one salon."""
+    salon = Salon.objects.filter(pk=salon_id).prefetch_related('staff').first()
+    with transaction.atomic():
+        SearchTerm.objects.filter(salon_id=salon_id).delete()
+        if salon is not None:
+            SearchTerm.objects.bulk_create(build_terms(salon))
+
+
+def rebuild_index(batch_size=500):
+    """Rebuild the search index of every salon, returns the number of salons indexed."""
+    processed = 0
+    last_pk = 0
+    salons = Salon.objects.order_by('pk').prefetch_related('staff')
+    while True:
+        batch = list(salons.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return processed
+        with transaction.atomic():
+            SearchTerm.objects.filter(salon_id__in=[salon.pk for salon in batch]).delete()
+            SearchTerm.objects.bulk_create(
+                [term for salon in batch for term in build_terms(salon)],
+                batch_size=1000,
+            )
+        processed += len(batch)
+        last_pk = batch[-1].pk
+
+
+_salon_count = (0, -math.inf)  # (count, monotonic expiry)
+
+
+def salon_count():
+    """Number of salons for idf, counted at most once per SALON_COUNT_TTL."""
+    global _salon_count
+    count, expires = _salon_count
+    if time.monotonic() >= expires:
+        count = Salon.objects.count()
+        _salon_count = (count, time.monotonic() + SALON_COUNT_TTL)
+    return count
+
+
+def forget_salon_count():
+    global _salon_count
+    _salon_count = (0, -math.inf)
+
+
+def _ranked_words(idf, limit):
+    """
+    Salon ids with their score, the sum of matched term weights times the term idf.
+    Ranking runs in SQL over the term index.
+    """
+    score = Sum(Case(
+        *(When(term=term, then=F('weight') * Value(factor)) for term, factor in idf.items()),
+        default=Value(0.0),
+        output_field=FloatField(),
+    ))
+    rows = (
+        SearchTerm.objects.filter(kind=SearchTerm.WORD, term__in=list(idf))
+        .values('salon_id')
+        .annotate(score=score)
+        .order_by('-score', 'salon_id')[:limit]
+    )
+    return [(row['salon_id'], row['score']) for row in rows]
+
+
+def _ranked_trigrams(grams, limit):
+    """
+    Salon ids with their trigram similarity to the query (share of the query
+    trigrams found), ties broken by field weight.
+    """
+    rows = (
+        SearchTerm.objects.filter(kind=SearchTerm.TRIGRAM, term__in=list(grams))
+        .values('salon_id')
+        .annotate(matched=Count('id'), weight=Sum('weight'))
+        .filter(matched__gte=math.ceil(TRIGRAM_THRESHOLD * len(grams)))
+        .order_by('-matched', '-weight', 'salon_id')[:limit]
+    )
+    return [(row['salon_id'], row['matched'] / len(grams)) for row in rows]
+
+
+def search(query, limit=20):
+    """
+    Salons matching `query` as [(salon_id, score)], best first.
+
+    Words are stemmed and ranked by field weight times inverse document frequency.
+    When no word matches (typos, partial words), trigram similarity is used instead.
+    """
+    words = tokenize(query)[:MAX_QUERY_TERMS]
+    if not words:
+        return []
+
+    stems = {stem(word)[:64] for word in words}
+    frequencies = dict(
+        SearchTerm.objects.filter(kind=SearchTerm.WORD, term__in=stems)
+        .values_list('term').annotate(df=Count('id')).order_by()
+    )
+    if frequencies:
+        total = max(salon_count(), 1)
+        return _ranked_words({term: math.log(1 + total / df) for term, df in frequencies.items()}, limit)
+
+    grams = set()
+    for word in words:
+        grams |= trigrams(word)
+    return _ranked_trigrams(grams, limit)
@@ -1,5 +1,9 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Salon, Staff, Booking, SalonPhoto
+from .photos import srcset
+from .availability import service_duration
+from .catalog import service_errors
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -21,14 +25,26 @@ class StaffSerializer(serializers.ModelSerializer):
             }
         }
 
+    def validate_services(self, value):
+        errors = service_errors(value)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return value
+
 class SalonPhotoSerializer(serializers.ModelSerializer):
+    # Resized WebP/JPEG copies per format, empty until salons.photos has processed the upload
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = SalonPhoto
-        fields = ['id', 'image', 'order', 'is_main']
+        fields = ['id', 'image', 'order', 'is_main', 'srcset']
+
+    def get_srcset(self, obj):
+        return srcset(obj, self.context.get('request'))
 
 class SalonSerializer(serializers.ModelSerializer):
-    photos = SalonPhotoSerializer(many=True, read_only=True)
-    staff = StaffSerializer(many=True, read_only=True)
+    photos = SalonPhotoSerializer(source='get_photos', many=True, read_only=True)
+    staff = StaffSerializer(source='get_staff', many=True, read_only=True)
     owner = UserSerializer(read_only=True)
 
     class Meta:
@@ -46,14 +62,48 @@ class SalonSerializer(serializers.ModelSerializer):
             }
         }
 
+class SalonListSerializer(serializers.ModelSerializer):
+    """
+    Compact salon representation for collection endpoints.
+    """
+    main_photo = serializers.SerializerMethodField()
+    main_photo_srcset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Salon
+        fields = ['id', 'title', 'location_lat', 'location_lon', 'yandex_link', 'main_photo', 'main_photo_srcset']
+
+    def _main_photo(self, obj):
+        # Photos are prefetched with the main one first
+        photos = obj.get_photos()
+        return photos[0] if photos else None
+
+    def get_main_photo(self, obj):
+        photo = self._main_photo(obj)
+        if photo is None:
+            return None
+        url = photo.image.url
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_main_photo_srcset(self, obj):
+        photo = self._main_photo(obj)
+        return srcset(photo, self.context.get('request')) if photo else {}
+
 class BookingSerializer(serializers.ModelSerializer):
-    salon = SalonSerializer(read_only=True)
-    staff = StaffSerializer(read_only=True)
-    client = UserSerializer(read_only=True)
+    """
+    Compact booking: related objects are referenced by id with a short summary.
+    Full salons and staff are side-loaded with ?expand=salon,staff (see side_load).
+    """
+    salon = serializers.PrimaryKeyRelatedField(queryset=Salon.objects.all())
+    staff = serializers.PrimaryKeyRelatedField(queryset=Staff.objects.all())
+    client = serializers.PrimaryKeyRelatedField(read_only=True)
+    salon_title = serializers.CharField(source='salon.title', read_only=True)
+    staff_full_name = serializers.CharField(source='staff.full_name', read_only=True)
 
     class Meta:
         model = Booking
-        fields = ['id', 'salon', 'staff', 'client', 'service', 
+        fields = ['id', 'salon', 'salon_title', 'staff', 'staff_full_name', 'client', 'service',
                  'booking_date', 'booking_time', 'status']
         read_only_fields = ['client', 'status']
         swagger_schema_fields = {
@@ -67,4 +117,131 @@ class BookingSerializer(serializers.ModelSerializer):
                 "booking_date": "2024-03-20",
                 "booking_time": "14:30"
             }
-        } 
\ No newline at end of file
+        }
+
+    def validate(self, attrs):
+        salon = attrs.get('salon', getattr(self.instance, 'salon', None))
+        staff = attrs.get('staff', getattr(self.instance, 'staff', None))
+        if staff.salon_id != salon.id:
+            raise serializers.ValidationError({'staff': 'Staff member does not work in this salon.'})
+        if 'service' in attrs or 'staff' in attrs:
+            attrs['service'] = self.canonical_service(staff, attrs.get('service', getattr(self.instance, 'service', None)))
+        return attrs
+
+    @staticmethod
+    def canonical_service(staff, service):
+        """
+        The staff member's own entry of the requested service. Price and duration
+        always come from it, so a client cannot shorten a booking to squeeze it
+        into an occupied interval or stretch it over the whole day.
+        """
+        name = service.get('name') if isinstance(service, dict) else service
+        offered = staff.get_service(name) if isinstance(name, str) and name.strip() else None
+        if offered is None:
+            raise serializers.ValidationError({'service': 'Staff member does not offer this service.'})
+        return {**offered, 'duration': service_duration(offered)}
+
+EXPANDABLE = ('salon', 'staff')
+
+def parse_expand(value):
+    """Parse ?expand=salon,staff into a set, rejecting unknown relations."""
+    expand = {item.strip() for item in (value or '').split(',') if item.strip()}
+    unknown = expand - set(EXPANDABLE)
+    if unknown:
+        raise serializers.ValidationError({
+            'expand': f"Unknown relations: {', '.join(sorted(unknown))}. "
+                      f"Allowed: {', '.join(EXPANDABLE)}."
+        })
+    return expand
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    date = serializers.DateField(help_text="Дата в формате YYYY-MM-DD")
+    service = serializers.CharField(required=False, help_text="Название услуги")
+
+class NearbyQuerySerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90, help_text="Широта")
+    lon = serializers.FloatField(min_value=-180, max_value=180, help_text="Долгота")
+    radius = serializers.FloatField(
+        required=False, default=5, min_value=0.1, max_value=50,
+        help_text="Радиус поиска в километрах"
+    )
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+class SalonFilterSerializer(serializers.Serializer):
+    service = serializers.CharField(required=False, help_text="Название услуги, например Окрашивание")
+    max_price = serializers.DecimalField(
+        max_digits=12, decimal_places=2, min_value=0, required=False,
+        help_text="Максимальная цена услуги"
+    )
+
+    def validate(self, attrs):
+        if 'max_price' in attrs and 'service' not in attrs:
+            raise serializers.ValidationError({'max_price': 'Requires service.'})
+        return attrs
+
+class BookingFilterSerializer(serializers.Serializer):
+    """
+    Query filters of booking listings: ?from=&to=&status=&staff=
+    """
+
+    def get_fields(self):
+        # `from` is a Python keyword, so the fields are not declared as attributes
+        return {
+            'from': serializers.DateField(required=False, help_text="Начальная дата (включительно)"),
+            'to': serializers.DateField(required=False, help_text="Конечная дата (включительно)"),
+            'status': serializers.ChoiceField(choices=Booking.STATUS_CHOICES, required=False),
+            'staff': serializers.IntegerField(required=False, min_value=1),
+        }
+
+    def validate(self, attrs):
+        if 'from' in attrs and 'to' in attrs and attrs['from'] > attrs['to']:
+            raise serializers.ValidationError({'to': 'Must not be earlier than from.'})
+        return attrs
+
+    def filter_queryset(self, queryset):
+        data = self.validated_data
+        if 'from' in data:
+            queryset = queryset.filter(booking_date__gte=data['from'])
+        if 'to' in data:
+            queryset = queryset.filter(booking_date__lte=data['to'])
+        if 'status' in data:
+            queryset = queryset.filter(status=data['status'])
+        if 'staff' in data:
+            queryset = queryset.filter(staff_id=data['staff'])
+        return queryset
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200, help_text="Поисковый запрос")
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+class AutocompleteQuerySerializer(serializers.Serializer):
+    prefix = serializers.CharField(max_length=100, help_text="Начало названия салона или услуги")
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=50)
+
+class PhotoBulkUploadSerializer(serializers.Serializer):
+    images = serializers.ListField(
+        child=serializers.ImageField(),
+        allow_empty=False,
+        help_text="Фотографии салона, несколько файлов в поле images",
+    )
+
+    def validate_images(self, images):
+        if len(images) > settings.SALON_PHOTO_BULK_MAX:
+            raise serializers.ValidationError(f'At most {settings.SALON_PHOTO_BULK_MAX} files per request.')
+        return images
+
+class PhotoReorderSerializer(serializers.Serializer):
+    """
+    New order of all photos of a salon: `photos` lists every photo id in order,
+    `main` is the main photo (the first one by default).
+    """
+    photos = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+    main = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, attrs):
+        if len(set(attrs['photos'])) != len(attrs['photos']):
+            raise serializers.ValidationError({'photos': 'Photo ids must be unique.'})
+        attrs.setdefault('main', attrs['photos'][0])
+        if attrs['main'] not in attrs['photos']:
+            raise serializers.ValidationError({'main': 'Must be one of photos.'})
+        return attrs
@@ -0,0 +1,128 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .autocomplete import loaded_index
+from .cache import invalidate_salon_on_commit
+from .catalog import sync_staff_services
+from .models import Salon, SalonPhoto, Staff, touch_salon
+from .photos import delete_renditions, needs_renditions, schedule_renditions
+from .search import forget_salon_count, index_salon
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Salon)
+@receiver(post_delete, sender=Salon)
+def salon_changed(sender, instance, **kwargs):
+    invalidate_salon_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=Staff)
+@receiver(post_delete, sender=Staff)
+@receiver(post_save, sender=SalonPhoto)
+@receiver(post_delete, sender=SalonPhoto)
+def salon_part_changed(sender, instance, **kwargs):
+    # Salon details embed staff and photos
+    touch_salon(instance.salon_id)
+
+
+@receiver(post_save, sender=SalonPhoto)
+def photo_image_changed(sender, instance, raw=False, **kwargs):
+    if not raw and needs_renditions(instance):
+        # After commit: the worker must see the photo row
+        transaction.on_commit(lambda: schedule_renditions(instance))
+
+
+@receiver(post_delete, sender=SalonPhoto)
+def photo_deleted(sender, instance, **kwargs):
+    if instance.renditions:
+        # After commit: a rolled back delete keeps its renditions
+        transaction.on_commit(partial(delete_renditions, instance.renditions))
+
+
+@receiver(post_save, sender=Staff)
+def staff_services_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_staff_services(instance)
+
+
+def index_salon_on_commit(salon_id):
+    # After commit: a rolled back change keeps the index as it was
+    transaction.on_commit(partial(index_salon, salon_id))
+
+
+@receiver(post_save, sender=Salon)
+def salon_search_changed(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if created:
+        forget_salon_count()
+    if not raw and instance.tracked_fields_changed(update_fields):
+        index_salon_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=Salon)
+def salon_search_deleted(sender, instance, **kwargs):
+    forget_salon_count()
+
+
+@receiver(post_save, sender=Staff)
+def staff_search_changed(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not instance.tracked_fields_changed(update_fields):
+        return
+    previous = instance.tracked_value('salon_id')
+    if previous is not None and previous != instance.salon_id:
+        # Moved to another salon
+        index_salon_on_commit(previous)
+    index_salon_on_commit(instance.salon_id)
+
+
+@receiver(post_delete, sender=Staff)
+def staff_search_deleted(sender, instance, **kwargs):
+    # After commit: when the whole salon is being deleted there is nothing to reindex
+    transaction.on_commit(lambda: index_salon(instance.salon_id))
+
+
+def update_autocomplete(method, *args):
+    """Call `method` of the loaded autocomplete index after commit: rolled back changes never reach it."""
+    def update():
+        index = loaded_index()
+        if index is not None:
+            getattr(index, method)(*args)
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Salon)
+def salon_autocomplete_changed(sender, instance, **kwargs):
+    update_autocomplete('set_salon', instance.pk, instance.title)
+
+
+@receiver(post_delete, sender=Salon)
+def salon_autocomplete_deleted(sender, instance, **kwargs):
+    update_autocomplete('remove_salon', instance.pk)
+
+
+@receiver(post_save, sender=Staff)
+def staff_autocomplete_changed(sender, instance, **kwargs):
+    update_autocomplete('set_staff', instance.pk, [service.get('name', '') for service in instance.get_services()])
+
+
+@receiver(post_delete, sender=Staff)
+def staff_autocomplete_deleted(sender, instance, **kwargs):
+    update_autocomplete('remove_staff', instance.pk)
+
+
+@receiver(post_save, sender=User)
+def owner_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Salon details embed the owner: only changes to the embedded fields matter
+    if created or not instance.tracked_fields_changed(update_fields):
+        return
+    salons = Salon.objects.filter(owner=instance)
+    pks = list(salons.values_list('pk', flat=True))
+    if pks:
+        salons.update(updated_at=timezone.now())
+    for pk in pks:
+        invalidate_salon_on_commit(pk)
@@ -0,0 +1,17 @@
+'use strict';
+// Applies the value picked in an autocomplete list filter (salons.admin.AutocompleteFilter)
+{
+    const $ = django.jQuery;
+    $(function() {
+        $('.autocomplete-filter select').on('change', function() {
+            const filter = this.closest('.autocomplete-filter');
+            const query = filter.dataset.query;
+            if (!this.value) {
+                window.location.search = query;
+                return;
+            }
+            const parameter = encodeURIComponent(filter.dataset.parameter) + '=' + encodeURIComponent(this.value);
+            window.location.search = query + (query.length > 1 ? '&' : '') + parameter;
+        });
+    });
+}
@@ -1,3 +1,1605 @@
-from django.test import TestCase
+import multiprocessing
+import os
+import tempfile
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+from datetime import date, time, timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Count
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from BookingSalons import metrics
+from BookingSalons.routers import PrimaryPinMiddleware, PrimaryReplicaRouter
+from BookingSalons.timing import ServerTimingMiddleware
+from users.authentication import UserRefreshToken
+from users.models import User
+from . import autocomplete
+from .autocomplete import loaded_index, refresh_index, reset_index, start_index
+from .availability import free_slots, merge_intervals, service_duration
+from .management.commands.bench_api import Command as BenchApiCommand
+from .cache import check_salon_cache, get_cache
+from .models import Salon, Staff, Booking, SalonPhoto, StaffService, SearchTerm
+from .parsers import TemporaryFileMultiPartParser
+from .photos import get_queue, process_photo, reset_queue
+from .search import search as search_salons
+from .views import BookingViewSet, SalonViewSet, StaffViewSet
+
+
+def create_salon(owner, title='Салон', **kwargs):
+    defaults = {
+        'description': 'Описание',
+        'location_lat': 41.311081,
+        'location_lon': 69.240562,
+        'yandex_link': 'https://yandex.ru/maps/',
+    }
+    defaults.update(kwargs)
+    return Salon.objects.create(title=title, owner=owner, **defaults)
+
+
+def create_user(phone_number):
+    return User.objects.create(phone_number=phone_number, username=phone_number)
+
+
+def token_api(user):
+    api = APIClient()
+    api.credentials(HTTP_AUTHORIZATION=f'Bearer {UserRefreshToken.for_user(user).access_token}')
+    return api
+
+
+def salon_cache_counts():
+    return {
+        'hits': metrics.registry.value('cache_requests_total', cache='salon', result='hit'),
+        'misses': metrics.registry.value('cache_requests_total', cache='salon', result='miss'),
+        'invalidations': metrics.registry.value('cache_invalidations_total', cache='salon'),
+    }
+
+
+# APIClient requests are for "testserver"
+@override_settings(SALON_CACHE_HOST='testserver')
+class SalonTestCase(TestCase):
+    # Replica aliases (DB_REPLICA_NAMES) mirror the test database
+    databases = '__all__'
+
+    def setUp(self):
+        # Primary keys are reused between tests, cached salons must not leak
+        get_cache().clear()
+
+
+class BookingCreateTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client_user = create_user('+998900000001')
+        self.salon = create_salon(create_user('+998900000002'))
+        self.staff = Staff.objects.create(salon=self.salon, full_name='Анна', services=['Стрижка'])
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+        self.day = date.today() + timedelta(days=1)
+
+    def post_booking(self, booking_time, service=None, staff=None):
+        return self.api.post('/api/bookings/', {
+            'salon': self.salon.id,
+            'staff': (staff or self.staff).id,
+            'service': service or {'name': 'Стрижка', 'price': 1500, 'duration': 60},
+            'booking_date': self.day.isoformat(),
+            'booking_time': booking_time,
+        }, format='json')
+
+    def test_same_slot_returns_conflict(self):
+        self.assertEqual(self.post_booking('10:00').status_code, 201)
+        response = self.post_booking('10:00')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_overlapping_slot_returns_conflict(self):
+        self.assertEqual(self.post_booking('10:00').status_code, 201)
+        self.assertEqual(self.post_booking('10:30').status_code, 409)
+        self.assertEqual(self.post_booking('11:00').status_code, 201)
+
+    def test_cancelled_booking_frees_slot(self):
+        Booking.objects.create(
+            salon=self.salon, staff=self.staff, client=self.client_user,
+            service={'name': 'Стрижка'}, booking_date=self.day,
+            booking_time=time(10, 0), status='cancelled',
+        )
+        self.assertEqual(self.post_booking('10:00').status_code, 201)
+
+    def test_staff_from_another_salon_is_rejected(self):
+        other_salon = create_salon(self.salon.owner, title='Другой')
+        other_staff = Staff.objects.create(salon=other_salon, full_name='Мария', services=[])
+        self.assertEqual(self.post_booking('10:00', staff=other_staff).status_code, 400)
+
+    def test_client_duration_cannot_shorten_booking(self):
+        self.assertEqual(self.post_booking('10:00').status_code, 201)
+        # Without a duration of its own Стрижка lasts BOOKING_DEFAULT_DURATION
+        response = self.post_booking('10:30', service={'name': 'Стрижка', 'duration': 1})
+        self.assertEqual(response.status_code, 409)
+
+    def test_client_duration_cannot_block_the_day(self):
+        staff = Staff.objects.create(salon=self.salon, full_name='Мария', services=[
+            {'name': 'Маникюр', 'price': 1000, 'duration': 45},
+        ])
+        response = self.post_booking('10:00', service={'name': 'маникюр ', 'price': 1, 'duration': 720}, staff=staff)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['service'], {'name': 'Маникюр', 'price': 1000, 'duration': 45})
+        self.assertEqual(self.post_booking('10:45', service={'name': 'Маникюр'}, staff=staff).status_code, 201)
+
+    def test_unknown_service_is_rejected(self):
+        response = self.post_booking('10:00', service={'name': 'Педикюр', 'duration': 30})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('service', response.data)
+        self.assertEqual(self.post_booking('10:00', service={'duration': 30}).status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_changing_staff_checks_their_services(self):
+        booking_id = self.post_booking('10:00').data['id']
+        other = Staff.objects.create(salon=self.salon, full_name='Мария', services=['Маникюр'])
+        response = self.api.patch(f'/api/bookings/{booking_id}/', {'staff': other.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_metrics(self):
+        creates = metrics.registry.value('booking_creates_total')
+        conflicts = metrics.registry.value('booking_conflicts_total', action='create')
+        self.post_booking('10:00')
+        self.post_booking('10:00')
+        self.assertEqual(metrics.registry.value('booking_creates_total'), creates + 1)
+        self.assertEqual(metrics.registry.value('booking_conflicts_total', action='create'), conflicts + 1)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    requests_count = 200
+    workers = 32
+
+    def setUp(self):
+        self.client_user = create_user('+998900000001')
+        self.salon = create_salon(create_user('+998900000002'))
+        self.staff = [
+            Staff.objects.create(salon=self.salon, full_name=f'Мастер {i}', services=['Стрижка'])
+            for i in range(4)
+        ]
+        self.day = date.today() + timedelta(days=1)
+
+    def _post(self, index):
+        api = APIClient()
+        api.force_authenticate(self.client_user)
+        staff = self.staff[index % len(self.staff)]
+        try:
+            response = api.post('/api/bookings/', {
+                'salon': self.salon.id,
+                'staff': staff.id,
+                'service': {'name': 'Стрижка', 'duration': 30},
+                'booking_date': self.day.isoformat(),
+                'booking_time': ['10:00', '11:00'][index // len(self.staff) % 2],
+            }, format='json')
+            return response.status_code
+        finally:
+            connection.close()
+
+    def test_parallel_posts_never_double_book(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            statuses = list(pool.map(self._post, range(self.requests_count)))
+
+        self.assertEqual(set(statuses), {201, 409})
+        # 4 staff members x 2 start times
+        self.assertEqual(statuses.count(201), 8)
+        duplicates = (
+            Booking.objects.filter(status__in=Booking.ACTIVE_STATUSES)
+            .values('staff', 'booking_date', 'booking_time')
+            .annotate(total=Count('id'))
+            .filter(total__gt=1)
+        )
+        self.assertFalse(duplicates.exists())
+        self.assertEqual(Booking.objects.count(), 8)
+
+
+class AvailabilityFunctionTests(SimpleTestCase):
+    def test_merge_intervals(self):
+        self.assertEqual(merge_intervals([(660, 720), (540, 600), (590, 630)]), [(540, 630), (660, 720)])
+        # Touching intervals are merged as well
+        self.assertEqual(merge_intervals([(540, 600), (600, 660)]), [(540, 660)])
+        self.assertEqual(merge_intervals([]), [])
+
+    @override_settings(BOOKING_DEFAULT_DURATION=60)
+    def test_service_duration(self):
+        self.assertEqual(service_duration({'name': 'Окрашивание', 'duration': 120}), 120)
+        self.assertEqual(service_duration({'name': 'Стрижка', 'duration': '45'}), 45)
+        self.assertEqual(service_duration({'name': 'Стрижка'}), 60)
+        self.assertEqual(service_duration({'name': 'Стрижка', 'duration': 0}), 60)
+        self.assertEqual(service_duration({'name': 'Стрижка', 'duration': 'долго'}), 60)
+        self.assertEqual(service_duration('Стрижка'), 60)
+
+    def test_free_slots_around_busy_interval(self):
+        # 09:00-12:00, a booking 10:00-11:00
+        self.assertEqual(free_slots([(600, 660)], 60, 540, 720, 30), [540, 660])
+
+    def test_free_slots_end_at_closing_time(self):
+        self.assertEqual(free_slots([], 60, 540, 720, 30), [540, 570, 600, 630, 660])
+        self.assertEqual(free_slots([], 240, 540, 720, 30), [])
+
+    def test_free_slots_booking_across_slot_boundary(self):
+        # 09:15-10:15 blocks the 09:00, 09:30 and 10:00 slots of 30 minutes
+        self.assertEqual(free_slots([(555, 615)], 30, 540, 720, 30), [630, 660, 690])
+
+    def test_free_slots_not_before(self):
+        self.assertEqual(free_slots([], 60, 540, 720, 30, not_before=600), [600, 630, 660])
+
+
+@override_settings(
+    SALON_OPENING_TIME='09:00', SALON_CLOSING_TIME='12:00',
+    BOOKING_SLOT_STEP=30, BOOKING_DEFAULT_DURATION=60,
+)
+class AvailabilityEndpointTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client_user = create_user('+998900000001')
+        self.salon = create_salon(create_user('+998900000002'))
+        self.anna = Staff.objects.create(salon=self.salon, full_name='Анна', services=[
+            {'name': 'Стрижка', 'price': 1500, 'duration': 30},
+            {'name': 'Окрашивание', 'price': 3000, 'duration': 120},
+        ])
+        self.maria = Staff.objects.create(salon=self.salon, full_name='Мария', services=['Маникюр'])
+        self.day = date.today() + timedelta(days=1)
+
+    def book(self, staff, booking_time, service, status='confirmed'):
+        return Booking.objects.create(
+            salon=self.salon, staff=staff, client=self.client_user, service=service,
+            booking_date=self.day, booking_time=booking_time, status=status,
+        )
+
+    def get_slots(self, url, **params):
+        response = APIClient().get(url, {'date': self.day.isoformat(), **params})
+        self.assertEqual(response.status_code, 200)
+        return {item['full_name']: item['slots'] for item in response.data['staff']}
+
+    def test_all_staff_default_duration(self):
+        self.book(self.anna, time(10, 0), {'name': 'Стрижка', 'duration': 60})
+        slots = self.get_slots(f'/api/salons/{self.salon.id}/availability/')
+        self.assertEqual(slots, {
+            'Анна': ['09:00', '11:00'],
+            'Мария': ['09:00', '09:30', '10:00', '10:30', '11:00'],
+        })
+
+    def test_service_filters_staff_and_sets_duration(self):
+        self.book(self.anna, time(11, 0), {'name': 'Стрижка', 'duration': 30})
+        url = f'/api/salons/{self.salon.id}/availability/'
+        self.assertEqual(self.get_slots(url, service='стрижка'), {'Анна': ['09:00', '09:30', '10:00', '10:30', '11:30']})
+        # Two hours only fit before the 11:00 booking
+        self.assertEqual(self.get_slots(url, service='Окрашивание'), {'Анна': ['09:00']})
+        self.assertEqual(self.get_slots(url, service='Педикюр'), {})
+
+    def test_booking_across_slot_boundary(self):
+        self.book(self.anna, time(10, 15), {'name': 'Стрижка', 'duration': 30})
+        slots = self.get_slots(f'/api/salons/{self.salon.id}/availability/', service='Стрижка')
+        self.assertEqual(slots['Анна'], ['09:00', '09:30', '11:00', '11:30'])
+
+    def test_cancelled_bookings_are_ignored(self):
+        self.book(self.anna, time(9, 0), {'name': 'Стрижка', 'duration': 60}, status='cancelled')
+        self.book(self.anna, time(10, 0), {'name': 'Стрижка', 'duration': 60})
+        slots = self.get_slots(f'/api/salons/{self.salon.id}/availability/')
+        self.assertEqual(slots['Анна'], ['09:00', '11:00'])
+
+    def test_staff_availability(self):
+        self.book(self.maria, time(9, 0), {'name': 'Маникюр'})
+        slots = self.get_slots(f'/api/salons/{self.salon.id}/staff/{self.maria.id}/availability/')
+        self.assertEqual(slots, {'Мария': ['10:00', '10:30', '11:00']})
+
+    def test_staff_of_another_salon(self):
+        other = create_salon(self.salon.owner, title='Другой')
+        response = APIClient().get(
+            f'/api/salons/{other.id}/staff/{self.anna.id}/availability/', {'date': self.day.isoformat()}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_past_date_and_missing_date(self):
+        url = f'/api/salons/{self.salon.id}/availability/'
+        response = APIClient().get(url, {'date': (date.today() - timedelta(days=1)).isoformat()})
+        self.assertEqual(response.data['staff'], [])
+        self.assertEqual(APIClient().get(url).status_code, 400)
+
+
+class NearbySalonsTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = create_user('+998900000002')
+        # Tashkent centre and points roughly 1 km, 3 km and 40 km away
+        self.centre = create_salon(owner, title='Центр', location_lat=41.311081, location_lon=69.240562)
+        self.near = create_salon(owner, title='1 км', location_lat=41.320081, location_lon=69.240562)
+        self.middle = create_salon(owner, title='3 км', location_lat=41.311081, location_lon=69.276562)
+        self.far = create_salon(owner, title='40 км', location_lat=41.671081, location_lon=69.240562)
+
+    def test_sorted_by_distance_within_radius(self):
+        response = APIClient().get('/api/salons/nearby/', {'lat': 41.311081, 'lon': 69.240562, 'radius': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['title'] for item in response.data], ['Центр', '1 км', '3 км'])
+        distances = [item['distance'] for item in response.data]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_limit(self):
+        response = APIClient().get('/api/salons/nearby/', {'lat': 41.311081, 'lon': 69.240562, 'limit': 1})
+        self.assertEqual([item['title'] for item in response.data], ['Центр'])
+
+    def test_invalid_coordinates(self):
+        response = APIClient().get('/api/salons/nearby/', {'lat': 100, 'lon': 69})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SALON_CACHE_ENABLED=False)
+class QueryCountTests(SalonTestCase):
+    """
+    Salon and booking endpoints must issue a constant number of queries
+    regardless of how many rows they return.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('+998900000002')
+        self.client_user = create_user('+998900000001')
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+
+    def add_salons(self, count):
+        day = date.today() + timedelta(days=1)
+        for i in range(count):
+            salon = create_salon(self.owner, title=f'Салон {i}')
+            for j in range(2):
+                staff = Staff.objects.create(salon=salon, full_name=f'Мастер {j}', services=['Стрижка'])
+                Booking.objects.create(
+                    salon=salon, staff=staff, client=self.client_user,
+                    service={'name': 'Стрижка'}, booking_date=day, booking_time=time(10 + j, 0),
+                )
+                SalonPhoto.objects.create(salon=salon, image=f'salon_photos/{i}_{j}.jpg', order=j, is_main=j == 0)
+        return salon
+
+    def assert_constant_queries(self, url_factory, expected):
+        for count in (1, 10):
+            salon = self.add_salons(count)
+            with self.assertNumQueries(expected):
+                response = self.api.get(url_factory(salon))
+            self.assertEqual(response.status_code, 200)
+
+    def test_salon_list(self):
+        # salon ids and updated_at + salons + photos
+        self.assert_constant_queries(lambda salon: '/api/salons/', 3)
+
+    def test_salon_detail(self):
+        # updated_at for the ETag + salon with owner + photos + staff
+        self.assert_constant_queries(lambda salon: f'/api/salons/{salon.id}/', 4)
+
+    def test_salon_bookings(self):
+        # salon + bookings with salon/staff
+        self.assert_constant_queries(lambda salon: f'/api/salons/{salon.id}/bookings/', 2)
+
+    def test_booking_list(self):
+        self.assert_constant_queries(lambda salon: '/api/bookings/', 1)
+
+    def test_booking_list_expanded(self):
+        # bookings + salons with owner + photos + staff + expanded staff
+        self.assert_constant_queries(lambda salon: '/api/bookings/?expand=salon,staff', 5)
+
+
+class AdminChangelistTests(SalonTestCase):
+    """Admin changelists issue the same number of queries for 1 and 10 rows per model."""
+
+    def setUp(self):
+        super().setUp()
+        admin_user = User.objects.create_superuser(username='admin', phone_number='+998900000009', password='x')
+        self.client.force_login(admin_user)
+        self.client_user = create_user('+998900000001')
+        self.rows = 0
+
+    def add_rows(self, count):
+        day = date.today() + timedelta(days=1)
+        for i in range(count):
+            self.rows += 1
+            salon = create_salon(create_user(f'+99890100{self.rows:04d}'), title=f'Салон {self.rows}')
+            staff = Staff.objects.create(salon=salon, full_name='Мастер', services=['Стрижка'])
+            SalonPhoto.objects.create(salon=salon, image=f'salon_photos/{self.rows}.jpg', is_main=True)
+            Booking.objects.create(
+                salon=salon, staff=staff, client=self.client_user,
+                service={'name': 'Стрижка'}, booking_date=day, booking_time=time(10, 0),
+            )
+        return salon, staff
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_constant_queries(self):
+        for model in ('salon', 'salonphoto', 'staff', 'booking'):
+            with self.subTest(model=model):
+                self.add_rows(1)
+                url = f'/admin/salons/{model}/'
+                few = self.changelist_queries(url)
+                self.add_rows(9)
+                self.assertEqual(self.changelist_queries(url), few)
+
+    def test_photo_counts_annotated(self):
+        salon, staff = self.add_rows(1)
+        SalonPhoto.objects.create(salon=salon, image='salon_photos/extra.jpg')
+        response = self.client.get('/admin/salons/salon/?o=4')
+        self.assertContains(response, '2 фото')
+
+    def test_autocomplete_filters(self):
+        salon, staff = self.add_rows(3)
+        response = self.client.get('/admin/salons/booking/')
+        self.assertContains(response, 'class="autocomplete-filter"', count=2)
+        self.assertContains(response, 'salons/js/autocomplete_filter.js')
+        # Filter links are no longer rendered per salon
+        self.assertNotContains(response, '?salon__id__exact=')
+
+        response = self.client.get(f'/admin/salons/booking/?staff__id__exact={staff.pk}')
+        self.assertEqual(list(response.context['cl'].result_list), list(Booking.objects.filter(staff=staff)))
+        self.assertContains(response, f'<option value="{staff.pk}" selected>{staff}</option>', html=True)
+
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'salons', 'model_name': 'booking', 'field_name': 'salon', 'term': salon.title,
+        })
+        self.assertEqual([item['id'] for item in response.json()['results']], [str(salon.pk)])
+
+
+class BenchApiTests(TestCase):
+    def test_every_route_has_a_scenario(self):
+        command = BenchApiCommand()
+        # Raises CommandError naming the routes a new endpoint left uncovered
+        command.check_coverage(command.scenarios())
+
+    def test_missing_baseline_fails(self):
+        command = BenchApiCommand()
+        with tempfile.TemporaryDirectory() as directory:
+            command.options = {'baseline': os.path.join(directory, 'api_baseline.json'), 'update_baseline': False}
+            with self.assertRaisesMessage(CommandError, '--update-baseline'):
+                command.check_baseline()
+            command.options['update_baseline'] = True
+            command.check_baseline()
+
+    def test_regressions(self):
+        command = BenchApiCommand()
+        command.options = {'latency_threshold': 1.5, 'latency_slack': 2.0, 'payload_threshold': 1.1}
+        base = {'queries': 3, 'p95_ms': 10.0, 'bytes': 1000}
+        self.assertEqual(command.regressions({'queries': 3, 'p95_ms': 16.9, 'bytes': 1100}, base), [])
+        problems = command.regressions({'queries': 4, 'p95_ms': 17.5, 'bytes': 1200}, base)
+        self.assertEqual(len(problems), 3)
+        self.assertIn('4 queries, baseline 3', problems[0])
+
+
+class SeedLoadTests(TestCase):
+    def seed(self):
+        call_command('seed_load', salons=6, clients=40, bookings=900, days_back=30, days_ahead=10,
+                     batch_size=100, chunk_size=200, processes=1, skip_derived=True, stdout=StringIO())
+
+    def snapshot(self):
+        return (
+            list(Salon.objects.order_by('pk').values_list('title', 'location_lat', 'location_lon')),
+            list(Staff.objects.order_by('pk').values_list('full_name', 'services')),
+            list(Booking.objects.order_by('staff_id', 'booking_date', 'booking_time')
+                 .values_list('status', 'service', 'booking_date', 'booking_time')),
+        )
+
+    def test_volumes_and_distribution(self):
+        self.seed()
+        self.assertEqual(Salon.objects.count(), 6)
+        self.assertEqual(User.objects.count(), 41)
+        self.assertEqual(Booking.objects.count(), 900)
+        staff = Staff.objects.annotate(bookings_count=Count('bookings'))
+        self.assertTrue(all(2 <= len(member.services) <= 5 for member in staff))
+        per_salon = Staff.objects.values('salon').annotate(count=Count('id')).values_list('count', flat=True)
+        self.assertTrue(all(3 <= count <= 15 for count in per_salon))
+        self.assertLessEqual(max(m.bookings_count for m in staff) - min(m.bookings_count for m in staff), 1)
+        self.assertEqual(SalonPhoto.objects.filter(is_main=True).count(), 6)
+        today = date.today()
+        statuses = set(Booking.objects.filter(booking_date__lt=today).values_list('status', flat=True))
+        self.assertLessEqual(statuses, {'completed', 'cancelled'})
+        upcoming = set(Booking.objects.filter(booking_date__gte=today).values_list('status', flat=True))
+        self.assertNotIn('completed', upcoming)
+        # Around the city centers
+        self.assertTrue(all(38 < salon.location_lat < 43.5 for salon in Salon.objects.all()))
+
+    def test_deterministic_from_seed(self):
+        self.seed()
+        first = self.snapshot()
+        with self.assertRaises(CommandError):
+            self.seed()
+        User.objects.all().delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), first)
+
+
+class BookingExpandTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client_user = create_user('+998900000001')
+        self.salon = create_salon(create_user('+998900000002'))
+        self.staff = Staff.objects.create(salon=self.salon, full_name='Анна', services=['Стрижка'])
+        day = date.today() + timedelta(days=1)
+        for hour in (10, 12, 14):
+            Booking.objects.create(
+                salon=self.salon, staff=self.staff, client=self.client_user,
+                service={'name': 'Стрижка'}, booking_date=day, booking_time=time(hour, 0),
+            )
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+
+    def test_compact_by_default(self):
+        response = self.api.get('/api/bookings/')
+        self.assertEqual(len(response.data['results']), 3)
+        booking = response.data['results'][0]
+        self.assertEqual(booking['salon'], self.salon.id)
+        self.assertEqual(booking['salon_title'], self.salon.title)
+        self.assertEqual(booking['staff_full_name'], 'Анна')
+
+    def test_expanded_objects_are_deduplicated(self):
+        response = self.api.get('/api/bookings/', {'expand': 'salon,staff'})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(list(response.data['included']['salons']), [str(self.salon.id)])
+        self.assertEqual(list(response.data['included']['staff']), [str(self.staff.id)])
+        self.assertEqual(response.data['included']['salons'][str(self.salon.id)]['staff'][0]['full_name'], 'Анна')
+
+    def test_unknown_expand(self):
+        self.assertEqual(self.api.get('/api/bookings/', {'expand': 'client'}).status_code, 400)
+
+
+class BookingPaginationTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client_user = create_user('+998900000001')
+        self.salon = create_salon(create_user('+998900000002'))
+        self.anna = Staff.objects.create(salon=self.salon, full_name='Анна', services=['Стрижка'])
+        self.maria = Staff.objects.create(salon=self.salon, full_name='Мария', services=['Стрижка'])
+        self.first_day = date(2030, 1, 1)
+        for offset in range(5):
+            for hour in (10, 12):
+                for staff in (self.anna, self.maria):
+                    Booking.objects.create(
+                        salon=self.salon, staff=staff, client=self.client_user,
+                        service={'name': 'Стрижка'}, booking_date=self.first_day + timedelta(days=offset),
+                        booking_time=time(hour, 0), status='cancelled' if offset == 4 else 'pending',
+                    )
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+
+    def collect(self, url, params):
+        results = []
+        response = self.api.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            results.extend(response.data['results'])
+            if not response.data['next']:
+                return results
+            response = self.api.get(response.data['next'])
+
+    def test_pages_cover_every_booking_in_key_order(self):
+        results = self.collect('/api/bookings/', {'page_size': 3})
+        self.assertEqual(len(results), 20)
+        keys = [(item['booking_date'], item['booking_time'], item['id']) for item in results]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), 20)
+
+    def test_deep_page_uses_single_query(self):
+        response = self.api.get('/api/bookings/', {'page_size': 5})
+        cursor_url = response.data['next']
+        with self.assertNumQueries(1):
+            self.api.get(cursor_url)
+
+    def test_filters(self):
+        results = self.collect(f'/api/salons/{self.salon.id}/bookings/', {
+            'from': '2030-01-02', 'to': '2030-01-03', 'staff': self.anna.id, 'status': 'pending',
+        })
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(item['staff'] == self.anna.id for item in results))
+        cancelled = self.collect('/api/bookings/', {'status': 'cancelled'})
+        self.assertEqual(len(cancelled), 4)
+
+    def test_invalid_filters(self):
+        self.assertEqual(self.api.get('/api/bookings/', {'from': '2030-01-05', 'to': '2030-01-01'}).status_code, 400)
+        self.assertEqual(self.api.get('/api/bookings/', {'status': 'unknown'}).status_code, 400)
+        self.assertEqual(self.api.get('/api/bookings/', {'cursor': 'garbage'}).status_code, 404)
+
+
+class SalonCacheTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('+998900000002')
+        self.salon = create_salon(self.owner)
+        self.staff = Staff.objects.create(salon=self.salon, full_name='Анна', services=['Стрижка'])
+        self.api = APIClient()
+        self.counts = salon_cache_counts()
+
+    def counted(self, name):
+        return salon_cache_counts()[name] - self.counts[name]
+
+    def test_detail_is_served_from_cache(self):
+        self.api.get(f'/api/salons/{self.salon.id}/')
+        # The updated_at lookup for the ETag, then versions and entries from the database cache
+        with self.assertNumQueries(3):
+            response = self.api.get(f'/api/salons/{self.salon.id}/')
+        self.assertEqual(response.data['title'], self.salon.title)
+        self.assertEqual(self.counted('hits'), 1)
+        self.assertEqual(self.counted('misses'), 1)
+
+    def test_other_hosts_are_not_cached(self):
+        for _ in range(2):
+            response = self.api.get(f'/api/salons/{self.salon.id}/', HTTP_HOST='other.example')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.counted('hits'), self.counted('misses')), (0, 0))
+        self.assertEqual(get_cache().get(f'salon:{self.salon.id}:v0:detail:other.example'), None)
+
+    def test_list_only_queries_ids_when_cached(self):
+        self.api.get('/api/salons/')
+        with self.assertNumQueries(3):
+            self.api.get('/api/salons/')
+
+    def test_staff_change_invalidates(self):
+        self.api.get(f'/api/salons/{self.salon.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.staff.full_name = 'Мария'
+            self.staff.save()
+        response = self.api.get(f'/api/salons/{self.salon.id}/')
+        self.assertEqual(response.data['staff'][0]['full_name'], 'Мария')
+
+    def test_invalidated_after_commit(self):
+        self.api.get(f'/api/salons/{self.salon.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.salon.title = 'Новый'
+            self.salon.save()
+            # Until the commit other requests may only cache the old row under the old version
+            self.assertEqual(self.counted('invalidations'), 0)
+        self.assertEqual(self.counted('invalidations'), 1)
+        self.assertEqual(self.api.get(f'/api/salons/{self.salon.id}/').data['title'], 'Новый')
+
+    def test_main_photo_change_invalidates_list(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            SalonPhoto.objects.create(salon=self.salon, image='salon_photos/a.jpg', is_main=True)
+        self.assertTrue(self.api.get('/api/salons/').data[0]['main_photo'].endswith('a.jpg'))
+        with self.captureOnCommitCallbacks(execute=True):
+            SalonPhoto.objects.create(salon=self.salon, image='salon_photos/b.jpg', is_main=True)
+        self.assertTrue(self.api.get('/api/salons/').data[0]['main_photo'].endswith('b.jpg'))
+
+    def test_owner_change_invalidates(self):
+        self.api.get(f'/api/salons/{self.salon.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.first_name = 'Иван'
+            self.owner.save()
+        response = self.api.get(f'/api/salons/{self.salon.id}/')
+        self.assertEqual(response.data['owner']['first_name'], 'Иван')
+
+    def test_owner_save_without_embedded_changes(self):
+        owner = User.objects.get(pk=self.owner.pk)
+        # Only the UPDATE of the user: salons are left alone
+        with self.assertNumQueries(1):
+            owner.save(update_fields=['last_login'])
+        with self.assertNumQueries(1):
+            owner.is_staff = True
+            owner.save()
+
+    def test_deleted_salon_is_not_served(self):
+        self.api.get(f'/api/salons/{self.salon.id}/')
+        salon_id = self.salon.id
+        self.salon.delete()
+        self.assertEqual(self.api.get(f'/api/salons/{salon_id}/').status_code, 404)
+
+    def test_cache_fill_does_not_pin_to_primary(self):
+        response = self.api.get(f'/api/salons/{self.salon.id}/')
+        self.assertEqual(self.counted('misses'), 1)
+        self.assertNotIn(PrimaryPinMiddleware.cookie_name, response.cookies)
+
+    @override_settings(DEBUG=False)
+    def test_per_process_cache_fails_check(self):
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        self.assertEqual(check_salon_cache(None), [])
+        with override_settings(CACHES={'default': locmem, 'shared': locmem}):
+            self.assertEqual([error.id for error in check_salon_cache(None)], ['salons.E001'])
+            with override_settings(SALON_CACHE_ENABLED=False):
+                self.assertEqual(check_salon_cache(None), [])
+            with override_settings(DEBUG=True):
+                self.assertEqual(check_salon_cache(None), [])
+
+    @override_settings(DEBUG=False, SALON_CACHE_HOST='')
+    def test_missing_cache_host_warns(self):
+        self.assertEqual([error.id for error in check_salon_cache(None)], ['salons.W001'])
+
+
+class ConditionalRequestTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('+998900000002')
+        self.client_user = create_user('+998900000001')
+        self.salon = create_salon(self.owner)
+        self.staff = Staff.objects.create(salon=self.salon, full_name='Анна', services=['Стрижка'])
+        self.booking = Booking.objects.create(
+            salon=self.salon, staff=self.staff, client=self.client_user,
+            service={'name': 'Стрижка'}, booking_date=date.today() + timedelta(days=1),
+            booking_time=time(10, 0),
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+
+    def test_salon_list_not_modified(self):
+        etag = self.api.get('/api/salons/')['ETag']
+        response = self.api.get('/api/salons/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_salon_detail_changes_with_staff(self):
+        url = f'/api/salons/{self.salon.id}/'
+        etag = self.api.get(url)['ETag']
+        self.assertEqual(self.api.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.staff.full_name = 'Мария'
+        self.staff.save()
+        response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_salon_detail_if_modified_since(self):
+        url = f'/api/salons/{self.salon.id}/'
+        last_modified = self.api.get(url)['Last-Modified']
+        self.assertEqual(self.api.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_booking_list_not_modified_until_new_booking(self):
+        etag = self.api.get('/api/bookings/')['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.api.get('/api/bookings/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Booking.objects.create(
+            salon=self.salon, staff=self.staff, client=self.client_user,
+            service={'name': 'Стрижка'}, booking_date=self.booking.booking_date,
+            booking_time=time(12, 0),
+        )
+        self.assertEqual(self.api.get('/api/bookings/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_booking_list_changes_with_salon_and_staff(self):
+        etag = self.api.get('/api/bookings/')['ETag']
+        self.salon.title = 'Новый салон'
+        self.salon.save()
+        response = self.api.get('/api/bookings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['salon_title'], 'Новый салон')
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        self.staff.full_name = 'Мария'
+        self.staff.save()
+        response = self.api.get('/api/bookings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['staff_full_name'], 'Мария')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_booking_update_if_match(self):
+        url = f'/api/bookings/{self.booking.id}/'
+        etag = self.api.get(url)['ETag']
+        response = self.api.patch(url, {'booking_time': '11:00'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        # The old ETag is stale now
+        response = self.api.patch(url, {'booking_time': '12:00'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.booking_time, time(11, 0))
+
+    def test_interleaved_updates_with_same_etag(self):
+        url = f'/api/bookings/{self.booking.id}/'
+        etag = self.api.get(url)['ETag']
+        perform_update = BookingViewSet.perform_update
+        second = {}
+
+        def update_in_between(view, serializer):
+            # The second client sends its PATCH after the first one passed If-Match
+            if not second:
+                second['response'] = self.api.patch(url, {'booking_time': '12:00'}, format='json', HTTP_IF_MATCH=etag)
+            perform_update(view, serializer)
+
+        with mock.patch.object(BookingViewSet, 'perform_update', update_in_between):
+            first = self.api.patch(url, {'booking_time': '11:00'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second['response'].status_code, 412)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.booking_time, time(11, 0))
+
+    def test_salon_update_if_match(self):
+        self.api.force_authenticate(self.owner)
+        url = f'/api/salons/{self.salon.id}/'
+        response = self.api.patch(url, {'title': 'Новый'}, format='json', HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, 412)
+        etag = self.api.get(url)['ETag']
+        response = self.api.patch(url, {'title': 'Новый'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class ServiceFilterTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = create_user('+998900000002')
+        self.cheap = create_salon(owner, title='Дешёвый')
+        self.expensive = create_salon(owner, title='Дорогой')
+        self.other = create_salon(owner, title='Другой')
+        Staff.objects.create(salon=self.cheap, full_name='Анна', services=[
+            {'name': 'Окрашивание', 'price': 1800}, {'name': 'Стрижка', 'price': 900},
+        ])
+        self.expensive_staff = Staff.objects.create(salon=self.expensive, full_name='Мария', services=[
+            {'name': 'Окрашивание', 'price': 3500},
+        ])
+        Staff.objects.create(salon=self.other, full_name='Ольга', services=['Маникюр'])
+        self.api = APIClient()
+
+    def titles(self, params):
+        response = self.api.get('/api/salons/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(item['title'] for item in response.data)
+
+    def test_filter_by_service(self):
+        self.assertEqual(self.titles({'service': 'окрашивание'}), ['Дешёвый', 'Дорогой'])
+        self.assertEqual(self.titles({'service': 'Маникюр'}), ['Другой'])
+
+    def test_filter_by_service_and_price(self):
+        self.assertEqual(self.titles({'service': 'Окрашивание', 'max_price': 2000}), ['Дешёвый'])
+
+    def test_rows_follow_staff_services(self):
+        self.expensive_staff.services = [{'name': 'Окрашивание', 'price': 1500}]
+        self.expensive_staff.save()
+        self.assertEqual(self.titles({'service': 'Окрашивание', 'max_price': 2000}), ['Дешёвый', 'Дорогой'])
+        self.expensive_staff.delete()
+        self.assertEqual(self.titles({'service': 'Окрашивание'}), ['Дешёвый'])
+
+    def test_backfill_command(self):
+        StaffService.objects.all().delete()
+        call_command('sync_staff_services', batch_size=2, stdout=StringIO())
+        self.assertEqual(StaffService.objects.count(), 4)
+        self.assertEqual(self.titles({'service': 'Стрижка', 'max_price': 900}), ['Дешёвый'])
+
+    def test_max_price_requires_service(self):
+        self.assertEqual(self.api.get('/api/salons/', {'max_price': 100}).status_code, 400)
+
+    def test_price_over_field_bounds(self):
+        params = {'service': 'Окрашивание', 'max_price': '1' + '0' * 20}
+        self.assertEqual(self.api.get('/api/salons/', params).status_code, 400)
+        self.assertEqual(self.api.get('/api/salons/', {**params, 'max_price': 'NaN'}).status_code, 400)
+
+    def test_staff_services_out_of_bounds(self):
+        owner = self.cheap.owner
+        api = token_api(owner)
+        for services in (
+            [{'name': 'Стрижка', 'price': '1e20'}],
+            [{'name': 'Стрижка', 'price': 'NaN'}],
+            [{'name': 'Стрижка', 'price': -1}],
+            [{'name': 'Стрижка', 'duration': 10 ** 12}],
+            [{'price': 100}],
+            'Стрижка',
+        ):
+            response = api.post('/api/staff/', {
+                'salon': self.cheap.pk, 'full_name': 'Ирина', 'services': services,
+            }, format='json')
+            self.assertEqual(response.status_code, 400, services)
+            self.assertIn('services', response.data)
+        response = api.post('/api/staff/', {
+            'salon': self.cheap.pk, 'full_name': 'Ирина',
+            'services': ['Укладка', {'name': 'Брови', 'price': '9999999999.99', 'duration': 30}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_legacy_price_out_of_bounds_is_not_indexed(self):
+        Staff.objects.create(salon=self.other, full_name='Ирина', services=[
+            {'name': 'Стрижка', 'price': '1e20', 'duration': 10 ** 12},
+        ])
+        row = StaffService.objects.get(salon=self.other, name_key='стрижка')
+        self.assertEqual((row.price, row.duration), (None, None))
+
+
+class SalonSearchTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = create_user('+998900000002')
+        # The index is updated on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coloring = create_salon(owner, title='Студия окрашивания', description='Сложное окрашивание волос')
+            self.barber = create_salon(owner, title='Барбершоп', description='Мужские стрижки и бритьё')
+            self.nails = create_salon(owner, title='Ногти', description='Маникюр и педикюр')
+            Staff.objects.create(salon=self.barber, full_name='Тимур Алиев', services=[{'name': 'Стрижка бороды'}])
+            Staff.objects.create(salon=self.nails, full_name='Анна', services=[{'name': 'Окрашивание бровей'}])
+        self.api = APIClient()
+
+    def search(self, q):
+        response = self.api.get('/api/salons/search/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data]
+
+    def test_word_forms_match(self):
+        # "окрашиванием" and "окрашивания" share the stem of the indexed text
+        self.assertEqual(self.search('окрашиванием'), [self.coloring.id, self.nails.id])
+
+    def test_title_ranks_above_service(self):
+        results = self.api.get('/api/salons/search/', {'q': 'окрашивание'}).data
+        self.assertEqual(results[0]['id'], self.coloring.id)
+        self.assertGreater(results[0]['score'], results[1]['score'])
+
+    def test_staff_name_and_services(self):
+        self.assertEqual(self.search('Тимур'), [self.barber.id])
+        self.assertIn(self.barber.id, self.search('бороды'))
+
+    def test_trigram_fallback_for_typos(self):
+        self.assertEqual(self.search('барбершап')[0], self.barber.id)
+
+    def test_index_follows_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            staff = Staff.objects.create(salon=self.coloring, full_name='Светлана', services=[])
+        self.assertEqual(self.search('Светлана'), [self.coloring.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            staff.delete()
+        self.assertEqual(self.search('Светлана'), [])
+
+    def test_moved_staff_reindexes_both_salons(self):
+        staff = Staff.objects.get(salon=self.barber)
+        with self.captureOnCommitCallbacks(execute=True):
+            staff.salon = self.nails
+            staff.save()
+        self.assertEqual(self.search('Тимур'), [self.nails.id])
+
+    def test_reindexed_only_when_indexed_fields_change(self):
+        salon = Salon.objects.get(pk=self.barber.pk)
+        staff = Staff.objects.get(salon=self.barber)
+        with mock.patch('salons.signals.index_salon') as index_salon:
+            with self.captureOnCommitCallbacks(execute=True):
+                salon.yandex_link = 'https://yandex.ru/maps/1'
+                salon.save()
+                salon.save(update_fields=['title'])
+                staff.services = [{'name': 'Стрижка бороды'}]
+                staff.save()
+            index_salon.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                salon.description = 'Стрижки и кофе'
+                salon.save(update_fields=['description'])
+                staff.services.append({'name': 'Бритьё'})
+                staff.save()
+            self.assertEqual(index_salon.call_count, 2)
+
+    def test_salon_count_reused(self):
+        # Term frequencies, salon count, ranking
+        with self.assertNumQueries(3):
+            search_salons('окрашивание')
+        with self.assertNumQueries(2):
+            search_salons('окрашивание')
+        create_salon(self.coloring.owner)
+        with self.assertNumQueries(3):
+            search_salons('окрашивание')
+
+    def test_rebuild_command(self):
+        SearchTerm.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('Тимур'), [self.barber.id])
+
+    def test_query_required(self):
+        self.assertEqual(self.api.get('/api/salons/search/').status_code, 400)
+
+
+class AutocompleteTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_index()
+        self.addCleanup(reset_index)
+        owner = create_user('+998900000002')
+        self.studio = create_salon(owner, title='Студия окрашивания')
+        self.barber = create_salon(owner, title='Барбершоп Old Boy')
+        self.staff = Staff.objects.create(salon=self.barber, full_name='Тимур', services=['Стрижка', 'Окрашивание'])
+        self.api = APIClient()
+
+    def lookup(self, prefix):
+        response = self.api.get('/api/salons/autocomplete/', {'prefix': prefix})
+        self.assertEqual(response.status_code, 200)
+        return [(item['type'], item['text']) for item in response.data]
+
+    def test_title_and_word_prefixes(self):
+        self.assertEqual(self.lookup('студ'), [('salon', 'Студия окрашивания')])
+        self.assertEqual(self.lookup('old'), [('salon', 'Барбершоп Old Boy')])
+
+    def test_services_and_salons(self):
+        self.assertEqual(self.lookup('Окр'), [('service', 'Окрашивание'), ('salon', 'Студия окрашивания')])
+
+    def test_incremental_updates(self):
+        self.lookup('x')  # load the index
+        with self.captureOnCommitCallbacks(execute=True):
+            self.studio.title = 'Студия маникюра'
+            self.studio.save()
+            Staff.objects.create(salon=self.studio, full_name='Анна', services=['Маникюр'])
+        self.assertEqual(self.lookup('ман'), [('service', 'Маникюр'), ('salon', 'Студия маникюра')])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.staff.delete()
+        self.assertEqual(self.lookup('стриж'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.barber.delete()
+        self.assertEqual(self.lookup('барб'), [])
+
+    def test_rolled_back_changes_not_indexed(self):
+        self.lookup('x')
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.studio.title = 'Студия маникюра'
+                    self.studio.save()
+                    raise DatabaseError('rolled back')
+            except DatabaseError:
+                pass
+        self.assertEqual(self.lookup('ман'), [])
+        self.assertEqual(self.lookup('студ'), [('salon', 'Студия окрашивания')])
+
+    def test_service_stays_while_offered(self):
+        other = Staff.objects.create(salon=self.studio, full_name='Анна', services=['Стрижка'])
+        self.lookup('x')
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(self.lookup('стриж'), [('service', 'Стрижка')])
+
+    def test_requests_never_rebuild_the_index(self):
+        self.lookup('x')
+        loaded_index().loaded_at -= 10 ** 6
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lookup('студ'), [('salon', 'Студия окрашивания')])
+
+    def test_refresh_swaps_in_new_index(self):
+        self.lookup('x')
+        # bulk_create sends no signals, as if another worker had created the salon
+        Salon.objects.bulk_create([Salon(
+            title='Маникюрная', description='', location_lat=41.3, location_lon=69.2,
+            yandex_link='https://yandex.ru/maps/', owner=self.studio.owner,
+        )])
+        old = loaded_index()
+        self.assertEqual(self.lookup('маник'), [])
+        refresh_index()
+        self.assertIsNot(loaded_index(), old)
+        self.assertEqual(self.lookup('маник'), [('salon', 'Маникюрная')])
+
+    @override_settings(AUTOCOMPLETE_REFRESH_SECONDS=3600)
+    def test_start_index_loads_and_refreshes_in_background(self):
+        start_index()
+        self.assertIsNotNone(loaded_index())
+        refresher = autocomplete._refresher
+        self.assertTrue(refresher._thread.is_alive())
+        with self.assertNumQueries(0):
+            self.lookup('студ')
+        self.assertIs(autocomplete._refresher, refresher)
+        reset_index()
+        self.assertFalse(refresher._thread.is_alive())
+
+    def test_refresher_keeps_serving_on_failure(self):
+        calls = []
+
+        def failing_refresh():
+            calls.append(1)
+            raise DatabaseError('gone')
+
+        with mock.patch.object(autocomplete, 'refresh_index', failing_refresh), \
+                self.assertLogs('salons.autocomplete', 'ERROR'):
+            refresher = autocomplete.IndexRefresher(0.01).start()
+            while len(calls) < 2:
+                time_module.sleep(0.01)
+            refresher.stop()
+
+
+@override_settings(AUTOCOMPLETE_REFRESH_SECONDS=0)
+class AutocompleteStartupTests(TransactionTestCase):
+    def test_start_index_closes_its_connection(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        create_salon(create_user('+998900000002'), title='Студия')
+        start_index()
+        self.assertIsNotNone(loaded_index())
+        self.assertIsNone(connection.connection)
+
+
+class TokenPermissionTests(SalonTestCase):
+    """Staff and booking ownership checks with stateless token users."""
+
+    def setUp(self):
+        super().setUp()
+        self.owner = create_user('+998900000002')
+        self.other_owner = create_user('+998900000003')
+        self.client_user = create_user('+998900000001')
+        self.salon = create_salon(self.owner)
+        self.staff = Staff.objects.create(salon=self.salon, full_name='Анна', services=['Стрижка'])
+        Staff.objects.create(salon=create_salon(self.other_owner), full_name='Олег', services=['Стрижка'])
+        self.booking = Booking.objects.create(
+            salon=self.salon, staff=self.staff, client=self.client_user, service={'name': 'Стрижка'},
+            booking_date=date.today() + timedelta(days=1), booking_time=time(10, 0),
+        )
+
+    def api_for(self, user):
+        return token_api(user)
+
+    def test_owner_sees_only_own_staff(self):
+        response = self.api_for(self.owner).get('/api/staff/')
+        self.assertEqual([row['id'] for row in response.data], [self.staff.pk])
+        response = self.api_for(self.other_owner).get(f'/api/staff/{self.staff.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_client_sees_only_own_bookings(self):
+        response = self.api_for(self.client_user).get('/api/bookings/')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.booking.pk])
+        response = self.api_for(self.owner).post(f'/api/bookings/{self.booking.pk}/cancel/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_create_sets_owner_and_client(self):
+        response = self.api_for(self.other_owner).post('/api/salons/', {
+            'title': 'Новый', 'description': 'Описание', 'location_lat': 41.3, 'location_lon': 69.2,
+            'yandex_link': 'https://yandex.ru/maps/',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Salon.objects.get(pk=response.data['id']).owner, self.other_owner)
+        response = self.api_for(self.other_owner).post('/api/bookings/', {
+            'salon': self.salon.pk, 'staff': self.staff.pk, 'service': {'name': 'Стрижка'},
+            'booking_date': str(date.today() + timedelta(days=1)), 'booking_time': '12:00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Booking.objects.get(pk=response.data['id']).client, self.other_owner)
+
+
+@override_settings(SALON_CACHE_ENABLED=False, SALON_CACHE_HOST='testserver')
+class AsyncEndpointTests(TransactionTestCase):
+    """
+    The async endpoints return the same responses as the viewset ones. Concurrent
+    queries run on their own connections, so the data has to be committed.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        get_cache().clear()
+        owner = create_user('+998900000002')
+        self.salon = create_salon(owner, title='Центр')
+        create_salon(owner, title='1 км', location_lat=41.320081)
+        self.staff = Staff.objects.create(salon=self.salon, full_name='Анна', services=['Стрижка'])
+        Staff.objects.create(salon=self.salon, full_name='Олег', services=['Окрашивание'])
+        SalonPhoto.objects.create(salon=self.salon, image='salon_photos/a.jpg', order=1)
+        SalonPhoto.objects.create(salon=self.salon, image='salon_photos/b.jpg', order=2, is_main=True)
+        self.day = date.today() + timedelta(days=1)
+        Booking.objects.create(
+            salon=self.salon, staff=self.staff, client=owner, service={'name': 'Стрижка'},
+            booking_date=self.day, booking_time=time(10, 0),
+        )
+        self.api = APIClient()
+
+    def assert_same(self, path, params=None):
+        sync_response = self.api.get(f'/api/{path}', params)
+        async_response = self.api.get(f'/api/async/{path}', params)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.json(), sync_response.json())
+        return async_response
+
+    def test_list_and_detail(self):
+        self.assert_same('salons/')
+        self.assert_same('salons/', {'service': 'стрижка'})
+        response = self.assert_same(f'salons/{self.salon.pk}/')
+        self.assertEqual(len(response.json()['photos']), 2)
+        self.assert_same('salons/0/')
+
+    def test_nearby(self):
+        response = self.assert_same('salons/nearby/', {'lat': 41.311081, 'lon': 69.240562, 'radius': 5})
+        self.assertEqual([item['title'] for item in response.json()], ['Центр', '1 км'])
+        self.assert_same('salons/nearby/', {'lat': 100, 'lon': 69})
+
+    def test_availability(self):
+        response = self.assert_same(f'salons/{self.salon.pk}/availability/', {'date': self.day.isoformat()})
+        self.assertNotIn('10:00', response.json()['staff'][0]['slots'])
+        self.assert_same(f'salons/{self.salon.pk}/availability/', {'date': self.day.isoformat(), 'service': 'Стрижка'})
+        self.assert_same(f'salons/{self.salon.pk}/availability/', {'date': 'tomorrow'})
+
+    def test_conditional_and_methods(self):
+        response = self.api.get(f'/api/async/salons/{self.salon.pk}/')
+        self.assertEqual(response['ETag'], self.api.get(f'/api/salons/{self.salon.pk}/')['ETag'])
+        response = self.api.get(f'/api/async/salons/{self.salon.pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.api.post('/api/async/salons/').status_code, 405)
+
+    @override_settings(SALON_CACHE_ENABLED=True)
+    def test_shares_salon_cache(self):
+        self.api.get(f'/api/async/salons/{self.salon.pk}/')
+        hits = salon_cache_counts()['hits']
+        self.api.get(f'/api/salons/{self.salon.pk}/')
+        self.assertEqual(salon_cache_counts()['hits'], hits + 1)
+
+
+@override_settings(SERVER_TIMING_ENABLED=True, METRICS_ENABLED=True)
+class AsyncMiddlewareTests(SimpleTestCase):
+    def test_middleware_stays_async(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        for middleware_class in (ServerTimingMiddleware, metrics.MetricsMiddleware, PrimaryPinMiddleware):
+            middleware = middleware_class(get_response)
+            self.assertTrue(iscoroutinefunction(middleware), middleware_class)
+            response = async_to_sync(middleware)(RequestFactory().get('/'))
+            self.assertEqual(response.status_code, 200)
+        self.assertIn('Server-Timing', async_to_sync(ServerTimingMiddleware(get_response))(RequestFactory().get('/')))
+        self.assertTrue(iscoroutinefunction(PrimaryPinMiddleware(get_response).process_view))
+        self.assertTrue(iscoroutinefunction(ServerTimingMiddleware(get_response).process_template_response))
+
+
+def image_upload(name='photo.jpg', size=(1000, 500)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 120, 80)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class PhotoRenditionsMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name, PHOTO_RENDITION_WIDTHS=[320, 640])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media_root = media_root.name
+        reset_queue()
+        self.addCleanup(reset_queue)
+        self.owner = create_user('+998900000003')
+        self.salon = create_salon(self.owner)
+
+
+@override_settings(PHOTO_RENDITION_WORKERS=0)
+class PhotoRenditionTests(PhotoRenditionsMixin, SalonTestCase):
+    def create_photo(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return SalonPhoto.objects.create(salon=self.salon, image=image_upload(**kwargs), is_main=True)
+
+    def test_renditions_built_after_upload(self):
+        photo = self.create_photo()
+        photo.refresh_from_db()
+        self.assertEqual(photo.renditions['source'], photo.image.name)
+        for kind in ('webp', 'jpeg'):
+            self.assertEqual(
+                [(rendition['width'], rendition['height']) for rendition in photo.renditions[kind]],
+                [(320, 160), (640, 320)],
+            )
+            for rendition in photo.renditions[kind]:
+                self.assertTrue(rendition['name'].endswith(f'.{kind}'))
+                self.assertEqual(os.path.getsize(os.path.join(self.media_root, rendition['name'])), rendition['size'])
+
+    def test_small_photo_not_upscaled(self):
+        photo = self.create_photo(size=(200, 100))
+        photo.refresh_from_db()
+        self.assertEqual([rendition['width'] for rendition in photo.renditions['jpeg']], [200])
+
+    def test_srcset_in_responses(self):
+        photo = self.create_photo()
+        data = APIClient().get(f'/api/salons/{self.salon.pk}/').json()['photos'][0]
+        self.assertEqual(data['id'], photo.pk)
+        self.assertRegex(data['srcset']['webp'], r'^http://testserver/media/\S+\.webp 320w, \S+\.webp 640w$')
+        self.assertIn('640w', data['srcset']['jpeg'])
+        item = APIClient().get('/api/salons/').json()[0]
+        self.assertEqual(item['main_photo_srcset'], data['srcset'])
+
+    def test_unprocessed_photo_has_empty_srcset(self):
+        # Callbacks are not executed: the upload is not processed yet
+        SalonPhoto.objects.create(salon=self.salon, image=image_upload())
+        data = APIClient().get(f'/api/salons/{self.salon.pk}/').json()['photos'][0]
+        self.assertEqual(data['srcset'], {})
+
+    def test_stale_job_is_ignored(self):
+        photo = self.create_photo()
+        photo.refresh_from_db()
+        renditions = photo.renditions
+        # A job for an image the photo no longer has, e.g. replaced before the worker got to it
+        other = SalonPhoto.objects.create(salon=self.salon, image=image_upload())
+        self.assertFalse(process_photo(photo.pk, self.salon.pk, other.image.name))
+        photo.refresh_from_db()
+        self.assertEqual(photo.renditions, renditions)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'salon_photos/renditions'))), 4)
+
+    def renditions_on_disk(self):
+        return sorted(os.listdir(os.path.join(self.media_root, 'salon_photos/renditions')))
+
+    def test_replaced_image_removes_previous_renditions(self):
+        photo = self.create_photo()
+        photo.refresh_from_db()
+        photo.image = image_upload('other.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.save()
+        photo.refresh_from_db()
+        self.assertEqual(photo.renditions['source'], photo.image.name)
+        current = sorted(os.path.basename(rendition['name']) for kind in ('webp', 'jpeg') for rendition in photo.renditions[kind])
+        self.assertEqual(self.renditions_on_disk(), current)
+
+    def test_deleted_photo_removes_renditions(self):
+        photo = self.create_photo()
+        photo.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.delete()
+        self.assertEqual(self.renditions_on_disk(), [])
+
+    def test_build_renditions_command(self):
+        done = self.create_photo()
+        # Callbacks are not executed: like a job lost with a restarted worker
+        missing = SalonPhoto.objects.create(salon=self.salon, image=image_upload())
+        out = StringIO()
+        call_command('build_renditions', stdout=out)
+        self.assertIn('Built renditions of 1 photos, 0 failed.', out.getvalue())
+        missing.refresh_from_db()
+        self.assertEqual(missing.renditions['source'], missing.image.name)
+        call_command('build_renditions', '--force', stdout=out)
+        self.assertIn('Built renditions of 2 photos, 0 failed.', out.getvalue())
+        done.refresh_from_db()
+        self.assertEqual(len(self.renditions_on_disk()), 8)
+
+
+@override_settings(PHOTO_RENDITION_WORKERS=0, SALON_PHOTO_BULK_MAX=5)
+class PhotoBulkTests(PhotoRenditionsMixin, SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = token_api(self.owner)
+
+    def upload(self, *images, api=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return (api or self.api).post(
+                f'/api/salons/{self.salon.pk}/photos/bulk/', {'images': list(images)}, format='multipart',
+            )
+
+    def test_bulk_upload(self):
+        SalonPhoto.objects.create(salon=self.salon, image='salon_photos/existing.jpg', order=4, is_main=True)
+        images = [image_upload(f'{number}.jpg') for number in range(3)]
+        self.salon.refresh_from_db()
+        updated_at = self.salon.updated_at
+        # Salon, max order, main check and the batch INSERT in a savepoint
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(6):
+            response = self.api.post(f'/api/salons/{self.salon.pk}/photos/bulk/', {'images': images}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        # The salon is touched once the photos are committed
+        self.salon.refresh_from_db()
+        self.assertEqual(self.salon.updated_at, updated_at)
+        for callback in callbacks:
+            callback()
+        self.salon.refresh_from_db()
+        self.assertGreater(self.salon.updated_at, updated_at)
+        self.assertEqual([(item['order'], item['is_main']) for item in response.data], [(5, False), (6, False), (7, False)])
+        for item in response.data:
+            photo = SalonPhoto.objects.get(pk=item['id'])
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, photo.image.name)))
+            self.assertEqual(photo.renditions['source'], photo.image.name)
+
+    def test_files_streamed_to_temporary_files(self):
+        request = RequestFactory().post('/', {'images': [image_upload()]})
+        data = Request(request, parsers=[TemporaryFileMultiPartParser()]).data
+        self.assertIsInstance(data['images'], TemporaryUploadedFile)
+
+    def test_first_upload_becomes_main(self):
+        response = self.upload(image_upload('a.jpg'), image_upload('b.jpg'))
+        self.assertEqual([item['is_main'] for item in response.data], [True, False])
+
+    def test_invalid_uploads(self):
+        not_image = SimpleUploadedFile('notes.jpg', b'not an image', content_type='image/jpeg')
+        self.assertEqual(self.upload(image_upload(), not_image).status_code, 400)
+        self.assertEqual(self.upload(*[image_upload(f'{number}.jpg') for number in range(6)]).status_code, 400)
+        self.assertEqual(self.upload().status_code, 400)
+        self.assertFalse(SalonPhoto.objects.exists())
+
+    def test_owner_only(self):
+        other = token_api(create_user('+998900000004'))
+        self.assertEqual(self.upload(image_upload(), api=other).status_code, 403)
+        response = other.patch(f'/api/salons/{self.salon.pk}/photos/reorder/', {'photos': [1]}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.upload(image_upload(), api=APIClient()).status_code, 401)
+
+    def test_reorder(self):
+        photos = [
+            SalonPhoto.objects.create(salon=self.salon, image=f'salon_photos/{number}.jpg', order=number, is_main=number == 0)
+            for number in range(3)
+        ]
+        ids = [photos[2].pk, photos[0].pk, photos[1].pk]
+        # Salon, locked photos and one bulk UPDATE (inside a savepoint); the salon is touched on commit
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(5):
+            response = self.api.patch(
+                f'/api/salons/{self.salon.pk}/photos/reorder/', {'photos': ids, 'main': photos[0].pk}, format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['id'], item['order'], item['is_main']) for item in response.data],
+                         [(ids[0], 0, False), (ids[1], 1, True), (ids[2], 2, False)])
+        self.assertEqual(list(SalonPhoto.objects.filter(is_main=True)), [photos[0]])
+        detail = self.api.get(f'/api/salons/{self.salon.pk}/').json()
+        self.assertEqual([item['id'] for item in detail['photos']], ids)
+
+    def test_reorder_must_list_every_photo(self):
+        photos = [SalonPhoto.objects.create(salon=self.salon, image=f'salon_photos/{number}.jpg') for number in range(2)]
+        url = f'/api/salons/{self.salon.pk}/photos/reorder/'
+        self.assertEqual(self.api.patch(url, {'photos': [photos[0].pk]}, format='json').status_code, 400)
+        self.assertEqual(self.api.patch(url, {'photos': [photos[0].pk] * 2}, format='json').status_code, 400)
+        response = self.api.patch(url, {'photos': [photo.pk for photo in photos], 'main': 999}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class RenditionQueueTests(PhotoRenditionsMixin, TransactionTestCase):
+    """Renditions built by the worker thread, which needs committed data."""
+    databases = '__all__'
+
+    def test_worker_builds_renditions(self):
+        photo = SalonPhoto.objects.create(salon=self.salon, image=image_upload())
+        self.assertTrue(get_queue().flush(timeout=30))
+        photo.refresh_from_db()
+        self.assertEqual([rendition['width'] for rendition in photo.renditions['webp']], [320, 640])
+        self.assertEqual(get_queue().processed, 1)
+
+
+@override_settings(SERVER_TIMING_ENABLED=True, SERVER_TIMING_DUPLICATE_THRESHOLD=3, SALON_CACHE_ENABLED=False)
+class ServerTimingTests(SalonTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = create_user('+998901234567')
+        self.salon = create_salon(owner)
+        Staff.objects.create(salon=self.salon, full_name='Мастер', services=[{'name': 'Стрижка', 'price': 1000}])
+
+    def metrics(self, response):
+        return {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+
+    def test_header_and_log_line(self):
+        with self.assertLogs('BookingSalons.timing', 'INFO') as logs, CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(f'/api/salons/{self.salon.pk}/')
+        metrics = self.metrics(response)
+        self.assertEqual(set(metrics), {'db', 'serialize', 'render', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', metrics['db'])
+        record = logs.records[0]
+        self.assertEqual(record.levelname, 'INFO')
+        self.assertEqual(record.route, 'salon-detail')
+        self.assertEqual(record.queries, len(queries))
+        self.assertGreater(record.serialize_ms, 0)
+        self.assertGreater(record.render_ms, 0)
+        self.assertEqual(record.duplicate_queries, [])
+
+    def test_flags_n_plus_one_with_call_site(self):
+        for number in range(3):
+            create_salon(create_user(f'+99890000000{number}'), title=f'Салон {number}')
+
+        def view(request):
+            for salon in Salon.objects.order_by('pk'):
+                salon.owner.phone_number
+            return HttpResponse()
+
+        middleware = ServerTimingMiddleware(view)
+        with self.assertLogs('BookingSalons.timing', 'WARNING') as logs:
+            response = middleware(RequestFactory().get('/'))
+        self.assertIn('dup;desc="1 repeated queries"', response['Server-Timing'])
+        duplicate, = logs.records[0].duplicate_queries
+        self.assertEqual(duplicate['kind'], 'n+1')
+        self.assertEqual(duplicate['count'], 4)
+        self.assertIn('FROM "users_user"', duplicate['sql'])
+        self.assertTrue(duplicate['site'].startswith('salons/tests.py:'))
+
+    @override_settings(SERVER_TIMING_ENABLED=False)
+    def test_disabled(self):
+        self.assertNotIn('Server-Timing', APIClient().get('/api/salons/'))
+
+
+def increment_booking_creates(amount):
+    metrics.BOOKING_CREATES.inc(amount)
+
+
+class MetricsTests(SalonTestCase):
+    @override_settings(METRICS_TOKEN='secret')
+    def test_request_and_cache_metrics(self):
+        create_salon(create_user('+998901234567'))
+        api = APIClient()
+        api.get('/api/salons/')
+        api.get('/api/salons/')
+        response = api.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="salon-list",le="+Inf"}', text)
+        self.assertIn('http_request_db_queries_count{route="salon-list"}', text)
+        self.assertGreaterEqual(
+            metrics.registry.value('http_requests_total', method='GET', route='salon-list', status=200), 2)
+        self.assertGreaterEqual(metrics.registry.value('cache_requests_total', cache='salon', result='hit'), 1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(APIClient().get('/metrics').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_no_token_only_served_in_debug(self):
+        self.assertEqual(APIClient().get('/metrics').status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(APIClient().get('/metrics').status_code, 200)
+        self.assertEqual([error.id for error in metrics.check_metrics(None)], ['BookingSalons.W001'])
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_MULTIPROC_DIR='', WEB_CONCURRENCY=4)
+    def test_several_workers_need_a_directory(self):
+        self.assertEqual([error.id for error in metrics.check_metrics(None)], ['BookingSalons.E001'])
+        with override_settings(METRICS_MULTIPROC_DIR='/tmp/metrics'):
+            self.assertEqual(metrics.check_metrics(None), [])
+
+    def test_processes_share_a_directory(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_MULTIPROC_DIR=directory):
+            metrics.registry.reset()
+            self.addCleanup(metrics.registry.reset)
+            metrics.BOOKING_CREATES.inc()
+            for amount in (2, 3):
+                worker = multiprocessing.get_context('fork').Process(target=increment_booking_creates, args=(amount,))
+                worker.start()
+                worker.join()
+            self.assertEqual(len(os.listdir(directory)), 3)
+            # Exited workers still count; their files are merged into the archive
+            self.assertIn('booking_creates_total 6\n', metrics.registry.exposition())
+            self.assertEqual(
+                sorted(name for name in os.listdir(directory) if not name.startswith(f'{os.getpid()}-')),
+                [metrics.ARCHIVE_FILE, metrics.LOCK_FILE],
+            )
+            self.assertIn('booking_creates_total 6\n', metrics.registry.exposition())
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRoutingTests(TestCase):
+    """Router decisions only, so the replica aliases do not have to exist."""
+
+    def route(self, method, view, write=False, cookies=None):
+        """Run a request through PrimaryPinMiddleware, returns (read aliases, response)."""
+        aliases = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            aliases.append(router.db_for_read(Salon))
+            if write:
+                router.db_for_write(Salon)
+                aliases.append(router.db_for_read(Salon))
+            return HttpResponse()
+
+        middleware = PrimaryPinMiddleware(get_response)
+        request = RequestFactory().generic(method, '/')
+        request.COOKIES.update(cookies or {})
+        return aliases, middleware(request)
+
+    def test_viewset_reads_use_replicas(self):
+        for view in (SalonViewSet.as_view({'get': 'list'}), StaffViewSet.as_view({'get': 'list'})):
+            aliases, response = self.route('GET', view)
+            self.assertIn(aliases[0], ['replica_1', 'replica_2'])
+            self.assertNotIn('db_primary', response.cookies)
+
+    def test_other_requests_use_primary(self):
+        self.assertEqual(self.route('GET', BookingViewSet.as_view({'get': 'list'}))[0], ['default'])
+        self.assertEqual(self.route('POST', SalonViewSet.as_view({'post': 'create'}))[0], ['default'])
+        # Outside a request
+        self.assertEqual(router.db_for_read(Salon), 'default')
+
+    def test_reads_after_write_stick_to_primary(self):
+        aliases, response = self.route('GET', SalonViewSet.as_view({'get': 'list'}), write=True)
+        self.assertEqual(aliases[1], 'default')
+        self.assertIn('db_primary', response.cookies)
+        aliases, response = self.route('GET', SalonViewSet.as_view({'get': 'list'}), cookies={'db_primary': '1'})
+        self.assertEqual(aliases, ['default'])
+
+    @override_settings(SALON_CACHE_ENABLED=False)
+    def test_pin_cookie_sends_next_request_to_primary(self):
+        owner = create_user('+998901111111')
+        salon = create_salon(owner)
+        api = APIClient()
+        api.force_authenticate(owner)
+        reads = []
+        db_for_read = PrimaryReplicaRouter.db_for_read
+
+        def record_read(self, model, **hints):
+            alias = db_for_read(self, model, **hints)
+            reads.append(alias)
+            return alias
+
+        with mock.patch.object(PrimaryReplicaRouter, 'db_for_read', record_read):
+            response = api.patch(f'/api/salons/{salon.pk}/', {'title': 'Новое'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('db_primary', response.cookies)
+            reads.clear()
+            # The client sends the cookie back with the next request
+            response = api.get(f'/api/salons/{salon.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Новое')
+        self.assertTrue(reads)
+        self.assertFalse(set(reads) & {'replica_1', 'replica_2'})
+
+    def test_related_objects_follow_instance(self):
+        salon = Salon(pk=1)
+        salon._state.db = 'replica_2'
+        self.assertEqual(router.db_for_read(Staff, instance=salon), 'replica_2')
+        self.assertFalse(router.allow_migrate('replica_1', 'salons'))
+        self.assertTrue(router.allow_migrate('default', 'salons'))
@@ -1,26 +1,255 @@
+from functools import partial
+
 from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .models import Salon, Staff, Booking, SalonPhoto
-from .serializers import SalonSerializer, StaffSerializer, BookingSerializer, SalonPhotoSerializer
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from django.db.models import Max
+from django.http import Http404
+from .models import Salon, Staff, Booking, SalonPhoto, StaffService, touch_salon
+from .catalog import service_key
+from .serializers import (
+    SalonSerializer,
+    SalonListSerializer,
+    StaffSerializer,
+    BookingSerializer,
+    SalonPhotoSerializer,
+    AvailabilityQuerySerializer,
+    NearbyQuerySerializer,
+    BookingFilterSerializer,
+    SalonFilterSerializer,
+    SearchQuerySerializer,
+    AutocompleteQuerySerializer,
+    PhotoBulkUploadSerializer,
+    PhotoReorderSerializer,
+    parse_expand,
+)
+from .pagination import BookingCursorPagination
+from .cache import get_salons_data
+from .conditional import ConditionalMixin, collection_validators
+from .availability import salon_availability, is_slot_free
+from .geo import nearby
+from .search import search
+from .autocomplete import get_index
+from .exceptions import SlotConflict
+from .parsers import TemporaryFileMultiPartParser
+from .permissions import IsSalonOwner
+from .photos import schedule_renditions
 from django.utils import timezone
 from datetime import datetime, timedelta
+from BookingSalons import metrics
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 
 # Create your views here.
 
-class SalonViewSet(viewsets.ModelViewSet):
+def salon_queryset(detail=True):
+    """
+    Salons with everything SalonSerializer/SalonListSerializer need loaded up front:
+    one query for salons with owners plus one per prefetched relation.
+    """
+    if not detail:
+        # Main photo first, SalonListSerializer takes only the first one
+        return Salon.objects.prefetch_related(
+            Prefetch('photos', queryset=SalonPhoto.objects.order_by('-is_main', 'order', 'created_at')),
+        )
+    return Salon.objects.select_related('owner').prefetch_related(
+        Prefetch('photos', queryset=SalonPhoto.objects.order_by('order', 'created_at')),
+        Prefetch('staff', queryset=Staff.objects.order_by('id')),
+    )
+
+
+def filter_salons(queryset, query_params):
+    """Apply the ?service=&max_price= filters of salon listings (raises ValidationError)."""
+    filters = SalonFilterSerializer(data=query_params)
+    filters.is_valid(raise_exception=True)
+    if 'service' in filters.validated_data:
+        # Served by staffservice_name_price_idx, no JSON is decoded
+        services = StaffService.objects.filter(
+            salon=OuterRef('pk'),
+            name_key=service_key(filters.validated_data['service']),
+        )
+        if 'max_price' in filters.validated_data:
+            services = services.filter(price__lte=filters.validated_data['max_price'])
+        queryset = queryset.filter(Exists(services))
+    return queryset
+
+
+def booking_queryset():
+    # BookingSerializer needs only the salon title and staff name
+    return Booking.objects.select_related('salon', 'staff')
+
+
+def side_load(bookings, expand, context=None):
+    """
+    Serialize the salons and staff referenced by `bookings` once each, keyed by id,
+    for the `included` part of a booking list response.
+    """
+    included = {}
+    if 'salon' in expand:
+        salons = list(salon_queryset().filter(pk__in={booking.salon_id for booking in bookings}))
+        data = SalonSerializer(salons, many=True, context=context).data
+        included['salons'] = {str(salon.pk): item for salon, item in zip(salons, data)}
+    if 'staff' in expand:
+        staff = list(Staff.objects.filter(pk__in={booking.staff_id for booking in bookings}))
+        data = StaffSerializer(staff, many=True, context=context).data
+        included['staff'] = {str(member.pk): item for member, item in zip(staff, data)}
+    return included
+
+
+def booking_list_response(request, bookings, context=None):
+    """
+    Filtered, cursor paginated compact booking list:
+    {"next": ..., "results": [...]}. With ?expand=salon,staff the related objects
+    of the page are added as {"included": {"salons": {...}, "staff": {...}}}.
+    """
+    expand = parse_expand(request.query_params.get('expand'))
+    filters = BookingFilterSerializer(data=request.query_params)
+    filters.is_valid(raise_exception=True)
+    bookings = filters.filter_queryset(bookings)
+
+    paginator = BookingCursorPagination()
+    page = paginator.paginate_queryset(bookings, request)
+
+    # Validators come from the page rows (salon and staff are joined already),
+    # so unchanged pages are answered before serialization. Salon and staff
+    # timestamps count even without ?expand: rows embed their title and name.
+    validators = collection_validators(request, Booking, [
+        (booking.pk, booking.updated_at, booking.salon.updated_at, booking.staff.updated_at)
+        for booking in page
+    ], extra=[paginator.has_next])
+    response = validators.precondition_response(request)
+    if response is not None:
+        return response
+
+    response = paginator.get_paginated_response(
+        BookingSerializer(page, many=True, context=context).data
+    )
+    if expand:
+        response.data['included'] = side_load(page, expand, context=context)
+    return validators.apply(response)
+
+
+class SalonViewSet(ConditionalMixin, viewsets.ModelViewSet):
     """
     API endpoint для управления салонами.
     """
     queryset = Salon.objects.all()
     serializer_class = SalonSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    # GET requests read from a replica, see BookingSalons.routers
+    replica_reads = True
+    list_actions = ('list', 'nearby', 'search')
+    # Actions that only need the salon row itself
+    plain_actions = ('staff', 'bookings', 'staff_availability', 'bulk_photos', 'reorder_photos')
+
+    def get_queryset(self):
+        if self.action in self.plain_actions:
+            return Salon.objects.all()
+        return salon_queryset(detail=self.action not in self.list_actions)
+
+    def get_serializer_class(self):
+        if self.action in self.list_actions:
+            return SalonListSerializer
+        return super().get_serializer_class()
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action not in self.list_actions:
+            return queryset
+        return filter_salons(queryset, self.request.query_params)
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        serializer.save(owner_id=self.request.user.id)
+
+    def salon_data(self, pks, detail):
+        """
+        Serialized salons for `pks` in order, from the per-salon cache where possible.
+        """
+        serializer_class = SalonSerializer if detail else SalonListSerializer
+        context = self.get_serializer_context()
+
+        def build(missing):
+            # Cache entries are filled from the primary: a lagging replica must not
+            # be cached under the version bumped by the write it has not seen yet
+            salons = list(salon_queryset(detail=detail).using(DEFAULT_DB_ALIAS).filter(pk__in=missing))
+            data = serializer_class(salons, many=True, context=context).data
+            return {salon.pk: item for salon, item in zip(salons, data)}
+
+        return get_salons_data(
+            pks,
+            'detail' if detail else 'list',
+            build,
+            host=self.request.get_host(),
+        )
+
+    def list(self, request, *args, **kwargs):
+        rows = list(self.filter_queryset(Salon.objects.order_by('pk')).values_list('pk', 'updated_at'))
+        return self.conditional_response(
+            collection_validators(request, Salon, rows),
+            lambda: Response(self.salon_data([pk for pk, updated_at in rows], detail=False)),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        validators = self.get_object_validators(pk)
+        if validators is None:
+            raise Http404
+
+        def render():
+            data = self.salon_data([int(pk)], detail=True)
+            if not data:
+                raise Http404
+            return Response(data[0])
+
+        return self.conditional_response(validators, render)
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Салоны рядом с точкой, отсортированные по расстоянию: ?lat=&lon=&radius=&limit=
+        """
+        params = NearbyQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        salons = nearby(
+            self.filter_queryset(Salon.objects.only('pk', 'location_lat', 'location_lon')),
+            params.validated_data['lat'],
+            params.validated_data['lon'],
+            params.validated_data['radius'],
+            params.validated_data['limit'],
+        )
+        distances = {salon.pk: salon.distance for salon in salons}
+        data = self.salon_data(list(distances), detail=False)
+        for item in data:
+            item['distance'] = round(distances[item['id']], 3)
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Полнотекстовый поиск салонов по названию, описанию, мастерам и услугам: ?q=&limit=
+        """
+        params = SearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        scores = dict(search(params.validated_data['q'], limit=params.validated_data['limit']))
+        data = self.salon_data(list(scores), detail=False)
+        for item in data:
+            item['score'] = round(scores[item['id']], 4)
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Подсказки по началу названия салона или услуги: ?prefix=&limit=
+        """
+        params = AutocompleteQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(get_index().lookup(
+            params.validated_data['prefix'],
+            limit=params.validated_data['limit'],
+        ))
 
     @action(detail=True, methods=['get'])
     def staff(self, request, pk=None):
@@ -32,9 +261,93 @@ class SalonViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def bookings(self, request, pk=None):
         salon = self.get_object()
-        bookings = Booking.objects.filter(salon=salon)
-        serializer = BookingSerializer(bookings, many=True)
-        return Response(serializer.data)
+        bookings = booking_queryset().filter(salon=salon)
+        return booking_list_response(request, bookings, context=self.get_serializer_context())
+
+    def _availability_response(self, salon, staff=None):
+        params = AvailabilityQuerySerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        day = params.validated_data['date']
+        service = params.validated_data.get('service')
+        return Response({
+            'date': day,
+            'service': service,
+            'staff': salon_availability(salon, day, service=service, staff=staff),
+        })
+
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """
+        Свободные слоты всех мастеров салона на дату: ?date=YYYY-MM-DD&service=...
+        """
+        salon = self.get_object()
+        return self._availability_response(salon)
+
+    @action(detail=True, methods=['get'], url_path=r'staff/(?P<staff_id>\d+)/availability')
+    def staff_availability(self, request, pk=None, staff_id=None):
+        """
+        Свободные слоты одного мастера салона на дату.
+        """
+        salon = self.get_object()
+        staff = get_object_or_404(Staff, pk=staff_id, salon=salon)
+        return self._availability_response(salon, staff=[staff])
+
+    @action(detail=True, methods=['post'], url_path='photos/bulk',
+            parser_classes=[TemporaryFileMultiPartParser], permission_classes=[IsAuthenticated, IsSalonOwner])
+    def bulk_photos(self, request, pk=None):
+        """
+        Загрузка нескольких фотографий салона одним multipart-запросом (поле images).
+        """
+        salon = self.get_object()
+        serializer = PhotoBulkUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            last_order = salon.photos.aggregate(last_order=Max('order'))['last_order']
+            start = 0 if last_order is None else last_order + 1
+            has_main = salon.photos.filter(is_main=True).exists()
+            photos = [
+                SalonPhoto(salon=salon, image=image, order=start + number, is_main=number == 0 and not has_main)
+                for number, image in enumerate(serializer.validated_data['images'])
+            ]
+            # One INSERT; bulk_create sends no signals, so do their work once for the batch
+            SalonPhoto.objects.bulk_create(photos)
+            transaction.on_commit(partial(touch_salon, salon.pk))
+            transaction.on_commit(lambda: [schedule_renditions(photo) for photo in photos])
+        data = SalonPhotoSerializer(photos, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['patch'], url_path='photos/reorder',
+            permission_classes=[IsAuthenticated, IsSalonOwner])
+    def reorder_photos(self, request, pk=None):
+        """
+        Новый порядок всех фотографий салона и главное фото: {"photos": [id, ...], "main": id}
+        """
+        salon = self.get_object()
+        serializer = PhotoReorderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = {photo_id: number for number, photo_id in enumerate(serializer.validated_data['photos'])}
+        main = serializer.validated_data['main']
+
+        with transaction.atomic():
+            photos = list(salon.photos.select_for_update().order_by())
+            if set(order) != {photo.pk for photo in photos}:
+                return Response(
+                    {'photos': ['Must list every photo of the salon exactly once.']},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            changed = []
+            for photo in photos:
+                if photo.order != order[photo.pk] or photo.is_main != (photo.pk == main):
+                    photo.order = order[photo.pk]
+                    photo.is_main = photo.pk == main
+                    changed.append(photo)
+            if changed:
+                # One UPDATE instead of a save() (and its is_main reset) per photo; no signals are sent
+                SalonPhoto.objects.bulk_update(changed, ['order', 'is_main'])
+                transaction.on_commit(partial(touch_salon, salon.pk))
+        photos.sort(key=lambda photo: photo.order)
+        return Response(SalonPhotoSerializer(photos, many=True, context=self.get_serializer_context()).data)
 
 class StaffViewSet(viewsets.ModelViewSet):
     """
@@ -43,11 +356,12 @@ class StaffViewSet(viewsets.ModelViewSet):
     queryset = Staff.objects.all()
     serializer_class = StaffSerializer
     permission_classes = [IsAuthenticated]
+    replica_reads = True
 
     def get_queryset(self):
-        return Staff.objects.filter(salon__owner=self.request.user)
+        return Staff.objects.filter(salon__owner_id=self.request.user.id)
 
-class BookingViewSet(viewsets.ModelViewSet):
+class BookingViewSet(ConditionalMixin, viewsets.ModelViewSet):
     """
     API endpoint для управления бронированиями.
     """
@@ -56,10 +370,44 @@ class BookingViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Booking.objects.filter(client=self.request.user)
+        return booking_queryset().filter(client_id=self.request.user.id)
+
+    def list(self, request, *args, **kwargs):
+        bookings = self.filter_queryset(self.get_queryset())
+        return booking_list_response(request, bookings, context=self.get_serializer_context())
 
     def perform_create(self, serializer):
-        serializer.save(client=self.request.user)
+        self._reserve_slot(serializer, client_id=self.request.user.id)
+
+    def perform_update(self, serializer):
+        self._reserve_slot(serializer)
+
+    def _reserve_slot(self, serializer, **kwargs):
+        """
+        Save the booking only if its staff member is free at that time.
+
+        The staff row is locked so concurrent requests for the same staff member are
+        serialized while other staff are booked in parallel; the partial unique
+        constraint on active bookings is the final guard.
+        """
+        instance = serializer.instance
+        data = serializer.validated_data
+        staff = data.get('staff', getattr(instance, 'staff', None))
+        booking_date = data.get('booking_date', getattr(instance, 'booking_date', None))
+        booking_time = data.get('booking_time', getattr(instance, 'booking_time', None))
+        service = data.get('service', getattr(instance, 'service', None))
+        try:
+            with transaction.atomic():
+                Staff.objects.select_for_update().get(pk=staff.pk)
+                if not is_slot_free(staff, booking_date, booking_time, service,
+                                    exclude_pk=getattr(instance, 'pk', None)):
+                    raise SlotConflict()
+                serializer.save(**kwargs)
+        except (IntegrityError, SlotConflict):
+            metrics.BOOKING_CONFLICTS.inc(action='update' if instance else 'create')
+            raise SlotConflict()
+        if instance is None:
+            metrics.BOOKING_CREATES.inc()
 
     @action(detail=True, methods=['post'])
     def confirm(self, request, pk=None):
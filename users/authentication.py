@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import models as jwt_models
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from BookingSalons import metrics
+
+USER_CACHE_KEY = 'auth:user:{pk}'
+
+
+class UserRefreshToken(RefreshToken):
+    """Refresh token carrying the claims TokenUser needs; access tokens copy them."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['phone_number'] = user.phone_number
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        # Only a hint for clients: salon ownership is always checked against the database
+        token['is_owner'] = user.owned_salons.exists()
+        return token
+
+
+def _user_cache():
+    return caches[settings.AUTH_USER_CACHE_ALIAS]
+
+
+def get_cached_user(pk):
+    """The User row, cached for AUTH_USER_CACHE_TTL seconds (dropped by users.signals on save/delete)."""
+    from .models import User
+
+    cache = _user_cache()
+    key = USER_CACHE_KEY.format(pk=pk)
+    user = cache.get(key)
+    metrics.CACHE_REQUESTS.inc(cache='auth_user', result='miss' if user is None else 'hit')
+    if user is None:
+        user = User.objects.filter(pk=pk).first()
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+    return user
+
+
+def forget_user(pk):
+    _user_cache().delete(USER_CACHE_KEY.format(pk=pk))
+
+
+class TokenUser(jwt_models.TokenUser):
+    """
+    Request user built from access token claims, no query is made to authenticate.
+
+    Claims cover id, phone number and staff/owner flags; any other model attribute
+    is read from the full User, loaded through the short-lived user cache on first
+    access. Views that modify the user must call get_full_user().
+    """
+
+    @property
+    def phone_number(self):
+        return self.token.get('phone_number') or self.full_user.phone_number
+
+    @property
+    def username(self):
+        return self.token.get('username') or self.phone_number
+
+    @property
+    def full_user(self):
+        if '_full_user' not in self.__dict__:
+            self.__dict__['_full_user'] = get_cached_user(self.id)
+        return self.__dict__['_full_user']
+
+    def __getattr__(self, attr):
+        if attr.startswith('_') or attr == 'token':
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        return getattr(self.full_user, attr)
+
+
+def get_full_user(user):
+    """The User model instance behind request.user, fetched only for a TokenUser."""
+    if isinstance(user, TokenUser):
+        return user.full_user
+    return user
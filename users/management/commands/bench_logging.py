@@ -0,0 +1,83 @@
+import logging
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from users import sms
+
+LOGGERS = ('django', 'users', 'salons')
+
+
+class Command(BaseCommand):
+    help = ('Measure OTP send/verify latency with logging off, with synchronous handlers '
+            'and with the queue handler from LOGGING. Users are created in a rolled back transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300, help='Login flows per mode')
+        parser.add_argument('--level', default='DEBUG', help='Level of the users logger during the run')
+
+    def handle(self, *args, **options):
+        loggers = [logging.getLogger(name) for name in LOGGERS]
+        saved = [(logger.handlers[:], logger.level) for logger in loggers]
+        queue_handler = next(h for h in loggers[1].handlers if hasattr(h, 'listener'))
+        rows = []
+        try:
+            with override_settings(SMS_BACKEND='users.sms.LocmemBackend', DEFAULT_OTP='11111'), transaction.atomic():
+                sms.reset_queue()
+                loggers[1].setLevel(options['level'])
+                for offset, mode in enumerate(('off', 'sync', 'queue')):
+                    self.configure(mode, loggers, queue_handler)
+                    rows.append((mode, self.run(offset * options['requests'], options['requests'])))
+                    logging.disable(logging.NOTSET)
+                transaction.set_rollback(True)
+        finally:
+            logging.disable(logging.NOTSET)
+            for logger, (handlers, level) in zip(loggers, saved):
+                logger.handlers[:] = handlers
+                logger.setLevel(level)
+            sms.reset_queue()
+            sms.outbox.clear()
+            queue_handler.stop()
+
+        self.stdout.write(f"{'logging':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+        for mode, timings in rows:
+            self.stdout.write(
+                f"{mode:<10}{self.percentile(timings, 50):>10.2f}{self.percentile(timings, 95):>10.2f}"
+                f"{self.percentile(timings, 99):>10.2f}{statistics.mean(timings):>10.2f}"
+            )
+        self.stdout.write(f'records dropped by the queue handler: {queue_handler.dropped}')
+
+    def configure(self, mode, loggers, queue_handler):
+        if mode == 'off':
+            logging.disable(logging.CRITICAL)
+            return
+        # 'sync' writes from the request thread through the handlers the listener uses
+        handlers = list(queue_handler.listener.handlers) if mode == 'sync' else [queue_handler]
+        for logger in loggers:
+            logger.handlers[:] = handlers
+
+    def run(self, offset, count):
+        client = APIClient()
+        timings = []
+        for i in range(offset, offset + count):
+            phone_number = f'+000{i:09d}'
+            address = f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'
+            started = time.perf_counter()
+            client.post('/api/users/auth/', {'phone_number': phone_number}, format='json', REMOTE_ADDR=address)
+            client.post('/api/users/auth/verify-otp/', {'phone_number': phone_number, 'otp': '00000'},
+                        format='json', REMOTE_ADDR=address)
+            response = client.post('/api/users/auth/verify-otp/', {'phone_number': phone_number, 'otp': '11111'},
+                                   format='json', REMOTE_ADDR=address)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.status_code
+        return timings
+
+    @staticmethod
+    def percentile(values, percent):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+        return ordered[index]
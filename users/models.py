@@ -2,10 +2,13 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
-class User(AbstractUser):
+from BookingSalons.tracking import TrackedFieldsMixin
+
+class User(TrackedFieldsMixin, AbstractUser):
+    # Embedded as the owner in salon details (salons.serializers.UserSerializer)
+    tracked_fields = ('username', 'phone_number', 'first_name', 'last_name')
+
     phone_number = models.CharField(_('phone number'), max_length=15, unique=True)
-    otp_code = models.CharField(max_length=6, null=True, blank=True)
-    otp_created_at = models.DateTimeField(null=True, blank=True)
     
     USERNAME_FIELD = 'phone_number'
     REQUIRED_FIELDS = ['username']
@@ -0,0 +1,86 @@
+import secrets
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+from BookingSalons.checks import require_shared_cache
+
+VALID = 'valid'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+LOCKED = 'locked'
+
+
+class CacheOTPStore:
+    """
+    One-time codes kept in a Django cache with a TTL instead of user rows.
+
+    A code and its failed attempt counter live under separate keys so the counter
+    can be incremented atomically; both expire with the code. Too many wrong
+    attempts burn the code.
+    """
+    CODE_KEY = 'otp:{phone}:code'
+    ATTEMPTS_KEY = 'otp:{phone}:attempts'
+
+    def __init__(self, alias=None, ttl=None, max_attempts=None):
+        self.cache = caches[alias or settings.OTP_CACHE_ALIAS]
+        self.ttl = ttl or settings.OTP_TTL
+        self.max_attempts = max_attempts or settings.OTP_MAX_ATTEMPTS
+
+    def issue(self, phone_number, code):
+        """Store a new code for the phone, replacing any pending one."""
+        self.cache.set(self.CODE_KEY.format(phone=phone_number), code, self.ttl)
+        self.cache.set(self.ATTEMPTS_KEY.format(phone=phone_number), 0, self.ttl)
+
+    def verify(self, phone_number, code):
+        """Check a code, returns VALID, INVALID, EXPIRED or LOCKED. A valid code is consumed."""
+        code_key = self.CODE_KEY.format(phone=phone_number)
+        attempts_key = self.ATTEMPTS_KEY.format(phone=phone_number)
+        expected = self.cache.get(code_key)
+        if expected is None:
+            return EXPIRED
+        try:
+            attempts = self.cache.incr(attempts_key)
+        except ValueError:
+            # Counter evicted before the code
+            self.cache.add(attempts_key, 0, self.ttl)
+            attempts = self.cache.incr(attempts_key)
+        if attempts > self.max_attempts:
+            self.discard(phone_number)
+            return LOCKED
+        if not constant_time_compare(str(expected), str(code)):
+            return INVALID
+        # Only the request that actually deletes the code may use it
+        if not self.cache.delete(code_key):
+            return EXPIRED
+        self.cache.delete(attempts_key)
+        return VALID
+
+    def discard(self, phone_number):
+        self.cache.delete_many([
+            self.CODE_KEY.format(phone=phone_number),
+            self.ATTEMPTS_KEY.format(phone=phone_number),
+        ])
+
+
+def generate_code():
+    """DEFAULT_OTP when configured (development), otherwise a random numeric code."""
+    if settings.DEFAULT_OTP:
+        return settings.DEFAULT_OTP
+    return ''.join(secrets.choice('0123456789') for _ in range(settings.OTP_LENGTH))
+
+
+def get_otp_store():
+    return import_string(settings.OTP_STORE)()
+
+
+@checks.register(checks.Tags.caches)
+def check_otp_caches(app_configs, **kwargs):
+    # A code issued by one worker must verify in another, and limits must count every worker's requests
+    errors = require_shared_cache('THROTTLE_CACHE_ALIAS', 'users.E002')
+    if issubclass(import_string(settings.OTP_STORE), CacheOTPStore):
+        errors += require_shared_cache('OTP_CACHE_ALIAS', 'users.E001')
+    return errors
@@ -1,4 +1,6 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer
+from .authentication import UserRefreshToken
 from .models import User
 
 class SendOTPSerializer(serializers.Serializer):
@@ -58,4 +60,9 @@ class UserProfileSerializer(serializers.ModelSerializer):
                 "first_name": "Иван",
                 "last_name": "Иванов"
             }
-        } 
\ No newline at end of file
+        } 
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    """Password login issuing tokens with the claims of users.authentication.TokenUser."""
+    token_class = UserRefreshToken
@@ -0,0 +1,224 @@
+import logging
+import sys
+import threading
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from BookingSalons.workers import WorkerQueue
+
+logger = logging.getLogger(__name__)
+
+
+class SMSDeliveryError(Exception):
+    """Raised by backends when the provider did not accept the messages; delivery is retried."""
+
+
+class SMSMessage:
+    def __init__(self, phone_number, text):
+        self.phone_number = phone_number
+        self.text = text
+        self.attempts = 0
+
+    def __repr__(self):
+        return f'<SMSMessage {self.phone_number}>'
+
+
+class BaseSMSBackend:
+    """
+    Interface of an SMS provider, in the spirit of Django email backends.
+
+    `send_messages()` receives a batch of at most `batch_size` messages and
+    raises SMSDeliveryError (or any exception) if they have to be retried.
+    At most `max_concurrency` batches are sent to one provider at a time.
+    """
+    name = 'base'
+    batch_size = 50
+    max_concurrency = 4
+
+    def send_messages(self, messages):
+        raise NotImplementedError('subclasses of BaseSMSBackend must implement send_messages()')
+
+
+class ConsoleBackend(BaseSMSBackend):
+    """Prints messages, for local development."""
+    name = 'console'
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def send_messages(self, messages):
+        with self._lock:
+            for message in messages:
+                self.stream.write(f'SMS to {message.phone_number}: {message.text}\n')
+            self.stream.flush()
+        return len(messages)
+
+
+class FileBackend(ConsoleBackend):
+    """Appends messages to SMS_FILE_PATH."""
+    name = 'file'
+
+    def __init__(self, file_path=None):
+        super().__init__()
+        self.file_path = file_path or settings.SMS_FILE_PATH
+
+    def send_messages(self, messages):
+        with self._lock, open(self.file_path, 'a', encoding='utf-8') as stream:
+            for message in messages:
+                stream.write(f'{message.phone_number}\t{message.text}\n')
+        return len(messages)
+
+
+outbox = []
+
+
+class LocmemBackend(BaseSMSBackend):
+    """Fake gateway keeping messages in `users.sms.outbox`, for tests."""
+    name = 'locmem'
+
+    def send_messages(self, messages):
+        outbox.extend(messages)
+        return len(messages)
+
+
+_provider_limits = {}
+_provider_limits_lock = threading.Lock()
+
+
+def provider_limit(backend):
+    """Semaphore shared by every queue sending through the same provider."""
+    with _provider_limits_lock:
+        if backend.name not in _provider_limits:
+            _provider_limits[backend.name] = threading.BoundedSemaphore(backend.max_concurrency)
+        return _provider_limits[backend.name]
+
+
+class DeliveryQueue(WorkerQueue):
+    """
+    Background SMS delivery so requests return as soon as a message is enqueued.
+
+    Worker threads take a message and drain up to `backend.batch_size` more
+    waiting ones into one batch. A failed batch is retried with exponential
+    backoff (`backoff * 2 ** attempt` seconds) up to `max_retries` times, then
+    dropped and logged. Messages still waiting for a retry or in the queue
+    when the queue is stopped are dropped and logged as well.
+    """
+
+    def __init__(self, backend, workers=2, max_retries=3, backoff=1.0):
+        super().__init__(workers)
+        self.backend = backend
+        self.thread_name = f'sms-{backend.name}'
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Retry timer -> messages it will requeue
+        self._timers = {}
+
+    @property
+    def sent(self):
+        return self.processed
+
+    def stop(self):
+        with self._lock:
+            timers, self._timers = self._timers, {}
+        for timer, messages in timers.items():
+            timer.cancel()
+            self.drop(messages, 'a retry was pending')
+        super().stop()
+
+    def drop(self, messages, reason):
+        for message in messages:
+            logger.error('SMS to %s dropped on shutdown, %s', message.phone_number, reason)
+        self.done(len(messages), ok=False)
+
+    def handle(self, message):
+        batch = [message, *self.take(self.backend.batch_size - 1)]
+        try:
+            with provider_limit(self.backend):
+                self.backend.send_messages(batch)
+        except Exception:
+            self._retry(batch)
+        else:
+            self.done(len(batch), ok=True)
+
+    def _retry(self, batch):
+        retry = []
+        for message in batch:
+            message.attempts += 1
+            if message.attempts > self.max_retries:
+                logger.error('SMS to %s dropped after %s attempts', message.phone_number, message.attempts)
+                self.done(1, ok=False)
+            else:
+                retry.append(message)
+        if not retry:
+            return
+        delay = self.backoff * 2 ** (retry[0].attempts - 1)
+        logger.warning('SMS delivery via %s failed, retrying %s messages in %.1fs',
+                       self.backend.name, len(retry), delay)
+        timer = threading.Timer(delay, self._requeue, args=(retry,))
+        timer.daemon = True
+        with self._lock:
+            self._timers[timer] = retry
+        timer.start()
+
+    def _requeue(self, messages):
+        with self._lock:
+            if self._timers.pop(threading.current_thread(), None) is None:
+                # Stopped meanwhile: stop() has dropped the messages
+                return
+        for message in messages:
+            self._queue.put(message)
+
+
+def get_backend(path=None, **kwargs):
+    path = path or settings.SMS_BACKEND
+    if not path:
+        raise ImproperlyConfigured('SMS_BACKEND is not set, OTP codes cannot be delivered')
+    return import_string(path)(**kwargs)
+
+
+@checks.register()
+def check_sms_backend(app_configs, **kwargs):
+    # SMS_BACKEND only defaults to ConsoleBackend, which prints the codes, when DEBUG is on
+    if settings.SMS_BACKEND:
+        return []
+    return [checks.Error(
+        'SMS_BACKEND is not set.',
+        hint='Set it to the provider backend; users.sms.ConsoleBackend prints OTP codes to stdout.',
+        id='users.E003',
+    )]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """The process-wide delivery queue for SMS_BACKEND, created on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = DeliveryQueue(
+                    get_backend(),
+                    workers=settings.SMS_WORKERS,
+                    max_retries=settings.SMS_MAX_RETRIES,
+                    backoff=settings.SMS_RETRY_BACKOFF,
+                )
+    return _queue
+
+
+def reset_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.stop()
+        _queue = None
+
+
+def send_sms(phone_number, text):
+    """Enqueue an SMS for background delivery."""
+    get_queue().enqueue(SMSMessage(phone_number, text))
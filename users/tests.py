@@ -1,3 +1,391 @@
-from django.test import TestCase
+import json
+import logging
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User
+from BookingSalons.log import JSONFormatter, QueueListenerHandler, SamplingFilter
+from BookingSalons.metrics import registry
+from . import sms
+from .authentication import TokenUser, UserRefreshToken, get_cached_user
+from .otp import CacheOTPStore, VALID, INVALID, EXPIRED, LOCKED, check_otp_caches
+
+LOCMEM = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'users-tests'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'users-tests-shared'},
+}
+
+
+def clear_caches():
+    for alias in LOCMEM:
+        caches[alias].clear()
+
+
+@override_settings(CACHES=LOCMEM)
+class OTPStoreTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.store = CacheOTPStore(max_attempts=3)
+
+    def test_code_is_single_use(self):
+        self.store.issue('+998901111111', '11111')
+        self.assertEqual(self.store.verify('+998901111111', '11111'), VALID)
+        self.assertEqual(self.store.verify('+998901111111', '11111'), EXPIRED)
+
+    def test_unknown_phone(self):
+        self.assertEqual(self.store.verify('+998901111111', '11111'), EXPIRED)
+
+    def test_too_many_attempts_burn_the_code(self):
+        self.store.issue('+998901111111', '11111')
+        for _ in range(3):
+            self.assertEqual(self.store.verify('+998901111111', '00000'), INVALID)
+        self.assertEqual(self.store.verify('+998901111111', '11111'), LOCKED)
+        self.assertEqual(self.store.verify('+998901111111', '11111'), EXPIRED)
+
+    def test_new_code_resets_attempts(self):
+        self.store.issue('+998901111111', '11111')
+        for _ in range(3):
+            self.store.verify('+998901111111', '00000')
+        self.store.issue('+998901111111', '22222')
+        self.assertEqual(self.store.verify('+998901111111', '22222'), VALID)
+
+
+@override_settings(CACHES=LOCMEM, SMS_BACKEND='users.sms.LocmemBackend', DEFAULT_OTP='11111')
+class OTPFlowTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        sms.reset_queue()
+        sms.outbox.clear()
+        self.addCleanup(sms.reset_queue)
+        self.api = APIClient()
+
+    def send(self, phone_number='+998901111111', **extra):
+        return self.api.post('/api/users/auth/', {'phone_number': phone_number}, format='json', **extra)
+
+    def verify(self, otp, phone_number='+998901111111'):
+        return self.api.post(
+            '/api/users/auth/verify-otp/', {'phone_number': phone_number, 'otp': otp}, format='json',
+        )
+
+    def test_user_created_only_after_verification(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.send().status_code, 200)
+        self.assertFalse(User.objects.exists())
+
+        self.assertEqual(self.verify('00000').status_code, 400)
+        self.assertFalse(User.objects.exists())
+
+        response = self.verify('11111')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data['tokens'])
+        self.assertTrue(User.objects.filter(phone_number='+998901111111').exists())
+
+    def test_code_delivered_by_sms(self):
+        self.send()
+        self.assertTrue(sms.get_queue().flush(timeout=5))
+        self.assertEqual([(m.phone_number, m.text) for m in sms.outbox],
+                         [('+998901111111', 'Код подтверждения: 11111')])
+
+    @override_settings(DEFAULT_OTP='')
+    def test_random_code(self):
+        self.send()
+        sms.get_queue().flush(timeout=5)
+        code = sms.outbox[0].text.rsplit(' ', 1)[1]
+        self.assertRegex(code, r'^\d{5}$')
+        self.assertEqual(self.verify(code).status_code, 200)
+
+    def test_existing_user_logs_in(self):
+        user = User.objects.create(phone_number='+998901111111', username='+998901111111')
+        self.send()
+        self.assertEqual(self.verify('11111').status_code, 200)
+        self.assertEqual(User.objects.get().pk, user.pk)
+
+    def test_otp_is_not_logged(self):
+        self.send('+998907777777')
+        with self.assertLogs('users.views', 'DEBUG') as logs:
+            self.verify('12345', '+998907777777')
+            self.verify('11111', '+998907777777')
+        self.assertFalse([line for line in logs.output if '12345' in line or '11111' in line])
+
+    def test_metrics(self):
+        sent = registry.value('otp_sent_total')
+        self.send()
+        self.verify('00000')
+        valid = registry.value('otp_verifications_total', result=VALID)
+        self.verify('11111')
+        self.verify('11111')
+        self.assertEqual(registry.value('otp_sent_total'), sent + 1)
+        self.assertEqual(registry.value('otp_verifications_total', result=VALID), valid + 1)
+        self.assertGreaterEqual(registry.value('otp_verifications_total', result=INVALID), 1)
+        self.assertGreaterEqual(registry.value('otp_verifications_total', result=EXPIRED), 1)
+
+    def test_verify_without_code(self):
+        self.assertEqual(self.verify('11111').data, {'error': 'OTP has expired'})
+
+    @override_settings(OTP_MAX_ATTEMPTS=2)
+    def test_brute_force_locks_code(self):
+        self.send()
+        self.verify('00000')
+        self.verify('00001')
+        self.assertEqual(self.verify('11111').status_code, 429)
+        self.assertFalse(User.objects.exists())
+
+    def test_send_throttled_per_phone(self):
+        for _ in range(5):
+            self.assertEqual(self.send().status_code, 200)
+        self.assertEqual(self.send().status_code, 429)
+        # Other numbers are not affected
+        self.assertEqual(self.send('+998902222222').status_code, 200)
+
+    def test_send_throttled_per_ip(self):
+        for i in range(30):
+            self.assertEqual(self.send(f'+99890{i:07d}').status_code, 200)
+        self.assertEqual(self.send('+998909999999').status_code, 429)
+        self.assertEqual(self.send('+998909999999', REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_codes_and_throttles_use_the_shared_cache(self):
+        self.send()
+        self.assertEqual(caches['shared'].get(CacheOTPStore.CODE_KEY.format(phone='+998901111111')), '11111')
+        self.assertTrue([key for key in caches['shared']._cache if 'throttle_otp_send_phone' in key])
+        self.assertFalse(caches['default']._cache)
+
+    @override_settings(DEBUG=False)
+    def test_per_process_cache_fails_check(self):
+        self.assertEqual(sorted(error.id for error in check_otp_caches(None)), ['users.E001', 'users.E002'])
+        with override_settings(CACHES={**LOCMEM, 'shared': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                                            'LOCATION': 'cache_entries'}}):
+            self.assertEqual(check_otp_caches(None), [])
+
+
+class FlakyBackend(sms.BaseSMSBackend):
+    """Fake gateway failing the first `failures` calls and tracking concurrent sends."""
+    name = 'flaky'
+    batch_size = 10
+    max_concurrency = 2
+
+    def __init__(self, failures=0, delay=0):
+        self.failures = failures
+        self.delay = delay
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def send_messages(self, messages):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            with self._lock:
+                if self.failures:
+                    self.failures -= 1
+                    raise sms.SMSDeliveryError('gateway unavailable')
+                self.batches.append(list(messages))
+            return len(messages)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+class DeliveryQueueTests(TestCase):
+    def make_queue(self, backend, **kwargs):
+        delivery = sms.DeliveryQueue(backend, **kwargs)
+        self.addCleanup(delivery.stop)
+        return delivery
+
+    def enqueue(self, delivery, count):
+        for i in range(count):
+            delivery.enqueue(sms.SMSMessage(f'+99890{i:07d}', 'code'))
+
+    def test_retries_with_backoff(self):
+        backend = FlakyBackend(failures=2)
+        delivery = self.make_queue(backend, workers=1, max_retries=3, backoff=0.01)
+        self.enqueue(delivery, 1)
+        self.assertTrue(delivery.flush(timeout=5))
+        self.assertEqual((delivery.sent, delivery.failed), (1, 0))
+        self.assertEqual(len(backend.batches), 1)
+
+    def test_gives_up_after_max_retries(self):
+        backend = FlakyBackend(failures=10)
+        delivery = self.make_queue(backend, workers=1, max_retries=2, backoff=0.01)
+        self.enqueue(delivery, 1)
+        with self.assertLogs('users.sms', 'ERROR'):
+            self.assertTrue(delivery.flush(timeout=5))
+        self.assertEqual((delivery.sent, delivery.failed), (0, 1))
+
+    def test_batches_and_provider_concurrency(self):
+        backend = FlakyBackend(delay=0.02)
+        delivery = self.make_queue(backend, workers=6)
+        self.enqueue(delivery, 100)
+        self.assertTrue(delivery.flush(timeout=10))
+        self.assertEqual(delivery.sent, 100)
+        self.assertLessEqual(max(len(batch) for batch in backend.batches), 10)
+        self.assertLess(len(backend.batches), 100)
+        self.assertLessEqual(backend.max_active, 2)
+
+    def test_stop_drops_pending_retries(self):
+        backend = FlakyBackend(failures=10)
+        delivery = self.make_queue(backend, workers=1, max_retries=3, backoff=60)
+        with self.assertLogs('users.sms', 'WARNING'):
+            self.enqueue(delivery, 2)
+            deadline = time.monotonic() + 5
+            while not delivery._timers and time.monotonic() < deadline:
+                time.sleep(0.01)
+        with self.assertLogs('users.sms', 'ERROR') as logs:
+            delivery.stop()
+        self.assertEqual(len([line for line in logs.output if 'dropped on shutdown' in line]), 2)
+        # Nothing is left pending: flush() returns at once
+        self.assertTrue(delivery.flush(timeout=0))
+        self.assertEqual((delivery.sent, delivery.failed), (0, 2))
+
+    def test_stop_drops_queued_messages(self):
+        # No workers: the messages stay in the queue
+        delivery = self.make_queue(FlakyBackend(), workers=0)
+        self.enqueue(delivery, 3)
+        with self.assertLogs('users.sms', 'ERROR') as logs:
+            delivery.stop()
+        self.assertEqual(len(logs.output), 3)
+        self.assertTrue(delivery.flush(timeout=0))
+
+    def test_stopped_at_exit(self):
+        delivery = self.make_queue(FlakyBackend(), workers=0)
+        with mock.patch('BookingSalons.workers.atexit') as at_exit:
+            self.enqueue(delivery, 2)
+            at_exit.register.assert_called_once_with(delivery.stop)
+            # What the interpreter runs on exit
+            with self.assertLogs('users.sms', 'ERROR') as logs:
+                at_exit.register.call_args.args[0]()
+            at_exit.unregister.assert_called_once_with(delivery.stop)
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(delivery.failed, 2)
+
+    def test_backend_required_without_debug(self):
+        with override_settings(SMS_BACKEND=''):
+            self.assertEqual([error.id for error in sms.check_sms_backend(None)], ['users.E003'])
+            with self.assertRaises(ImproperlyConfigured):
+                sms.get_backend()
+        self.assertEqual(sms.check_sms_backend(None), [])
+
+
+@override_settings(CACHES=LOCMEM)
+class StatelessAuthTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create(phone_number='+998901111111', username='+998901111111')
+        self.api = APIClient()
+        access = UserRefreshToken.for_user(self.user).access_token
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_claims(self):
+        access = UserRefreshToken.for_user(self.user).access_token
+        user = TokenUser(access)
+        self.assertEqual((user.id, user.phone_number, user.is_staff, user.is_owner),
+                         (self.user.pk, '+998901111111', False, False))
+
+    def test_requests_do_not_load_the_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/bookings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if 'users_user' in q['sql']])
+
+    def test_full_user_is_cached(self):
+        with self.assertNumQueries(1):
+            get_cached_user(self.user.pk)
+            get_cached_user(self.user.pk)
+
+    def test_update_profile_refreshes_cached_user(self):
+        get_cached_user(self.user.pk)
+        response = self.api.post('/api/users/auth/update-profile/', {'first_name': 'Иван'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['first_name'], 'Иван')
+        self.assertEqual(User.objects.get().first_name, 'Иван')
+        self.assertEqual(get_cached_user(self.user.pk).first_name, 'Иван')
+
+    def test_password_login_issues_claims(self):
+        self.user.set_password('secret-pass')
+        self.user.save()
+        response = APIClient().post('/api/users/auth/token/', {
+            'phone_number': '+998901111111', 'password': 'secret-pass',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.data['access'])['phone_number'], '+998901111111')
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class LoggingPipelineTests(TestCase):
+    def make_logger(self, handler):
+        logger = logging.getLogger(f'tests.{self._testMethodName}')
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger
+
+    def test_json_records_through_queue(self):
+        target = ListHandler()
+        target.setFormatter(JSONFormatter())
+        handler = QueueListenerHandler([target])
+        logger = self.make_logger(handler)
+        logger.info('booking %s confirmed', 42, extra={'salon_id': 7})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception('failed')
+        handler.stop()
+        first, second = map(json.loads, target.lines)
+        self.assertEqual((first['message'], first['level'], first['salon_id']), ('booking 42 confirmed', 'INFO', 7))
+        self.assertIn('ZeroDivisionError', second['exc_info'])
+
+    def test_message_formatted_in_calling_thread(self):
+        threads = []
+
+        class Salon:
+            def __str__(self):
+                threads.append(threading.current_thread())
+                return 'Салон'
+
+        target = ListHandler()
+        target.setFormatter(JSONFormatter())
+        handler = QueueListenerHandler([target])
+        logger = self.make_logger(handler)
+        services = ['Стрижка']
+        logger.info('%s offers %s', Salon(), services)
+        services.append('Маникюр')
+        handler.stop()
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertEqual(json.loads(target.lines[0])['message'], "Салон offers ['Стрижка']")
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = QueueListenerHandler([ListHandler()], queue_size=1)
+        handler.stop()
+        logger = self.make_logger(handler)
+        for _ in range(3):
+            logger.info('message')
+        self.assertEqual(handler.dropped, 2)
+
+    def test_debug_sampling(self):
+        target = ListHandler()
+        target.addFilter(SamplingFilter(rate=0.25))
+        logger = self.make_logger(target)
+        for i in range(100):
+            logger.debug('debug %s', i)
+        logger.warning('kept')
+        self.assertEqual(len(target.lines), 26)
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class OTPRateThrottle(SimpleRateThrottle):
+    """
+    Sliding-window limit for the OTP endpoints.
+
+    SimpleRateThrottle keeps the request timestamps of the last `duration`
+    seconds per key in the cache, so the window slides with every request.
+    The rate is looked up as `<view.throttle_scope>_<kind>` in
+    DEFAULT_THROTTLE_RATES, e.g. `otp_send_phone`. Windows live in the
+    THROTTLE_CACHE_ALIAS cache, shared by all worker processes.
+    """
+    kind = None
+
+    @property
+    def cache(self):
+        return caches[settings.THROTTLE_CACHE_ALIAS]
+
+    def __init__(self):
+        # The rate depends on the view, it is resolved in allow_request()
+        pass
+
+    def allow_request(self, request, view):
+        self.scope = f'{view.throttle_scope}_{self.kind}'
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
+
+    def get_cache_key(self, request, view):
+        ident = self.get_ident_value(request)
+        if not ident:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class PhoneRateThrottle(OTPRateThrottle):
+    kind = 'phone'
+
+    def get_ident_value(self, request):
+        phone_number = request.data.get('phone_number') if hasattr(request.data, 'get') else None
+        return str(phone_number).strip() if phone_number else None
+
+
+class IPRateThrottle(OTPRateThrottle):
+    kind = 'ip'
+
+    def get_ident_value(self, request):
+        return self.get_ident(request)
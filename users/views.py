@@ -3,9 +3,10 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from django.utils import timezone
-from datetime import timedelta
 from .models import User
+from .otp import generate_code, get_otp_store, VALID, INVALID, LOCKED
+from .sms import send_sms
+from .throttling import PhoneRateThrottle, IPRateThrottle
 from .serializers import (
     SendOTPSerializer,
     VerifyOTPSerializer,
@@ -14,13 +15,15 @@ from .serializers import (
 )
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-import random
-from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import UserRefreshToken, get_full_user
+from BookingSalons import metrics
 import logging
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+OTP_MESSAGE = 'Код подтверждения: {code}'
+
 # Create your views here.
 
 class SendOTPView(APIView):
@@ -36,6 +39,8 @@ class SendOTPView(APIView):
     """
     permission_classes = [AllowAny]
     serializer_class = SendOTPSerializer
+    throttle_classes = [PhoneRateThrottle, IPRateThrottle]
+    throttle_scope = 'otp_send'
 
     @swagger_auto_schema(
         request_body=SendOTPSerializer,
@@ -55,7 +60,8 @@ class SendOTPView(APIView):
                         "error": "Phone number is required"
                     }
                 }
-            )
+            ),
+            429: openapi.Response(description="Слишком много запросов для номера или IP")
         }
     )
     def post(self, request):
@@ -65,17 +71,14 @@ class SendOTPView(APIView):
 
         phone_number = serializer.validated_data['phone_number']
         
-        # Generate OTP (for development, always use 11111)
-        otp = '11111'
-        
-        user, created = User.objects.get_or_create(
-            phone_number=phone_number,
-            defaults={'username': phone_number}
-        )
-        
-        user.otp_code = otp
-        user.otp_created_at = timezone.now()
-        user.save()
+        otp = generate_code()
+
+        # The user is created only once the code is verified
+        get_otp_store().issue(phone_number, otp)
+        # Delivered in the background, the response does not wait for the provider
+        send_sms(phone_number, OTP_MESSAGE.format(code=otp))
+        metrics.OTP_SENT.inc()
+        logger.debug("OTP sent to %s", phone_number)
 
         return Response({'message': 'OTP sent successfully'})
 
@@ -93,6 +96,8 @@ class VerifyOTPView(APIView):
     """
     permission_classes = [AllowAny]
     serializer_class = VerifyOTPSerializer
+    throttle_classes = [PhoneRateThrottle, IPRateThrottle]
+    throttle_scope = 'otp_verify'
 
     @swagger_auto_schema(
         request_body=VerifyOTPSerializer,
@@ -122,11 +127,11 @@ class VerifyOTPView(APIView):
                     }
                 }
             ),
-            404: openapi.Response(
-                description="Пользователь не найден",
+            429: openapi.Response(
+                description="Слишком много попыток",
                 examples={
                     "application/json": {
-                        "error": "User not found"
+                        "error": "Too many attempts"
                     }
                 }
             )
@@ -134,43 +139,37 @@ class VerifyOTPView(APIView):
     )
     def post(self, request):
         try:
-            logger.info(f"Received verify OTP request: {request.data}")
-            
             serializer = self.serializer_class(data=request.data)
             if not serializer.is_valid():
-                logger.error(f"Validation error: {serializer.errors}")
+                logger.info("Invalid verify OTP request: %s", serializer.errors)
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
             phone_number = serializer.validated_data['phone_number']
             otp = serializer.validated_data['otp']
             
-            logger.info(f"Looking for user with phone number: {phone_number}")
-            try:
-                user = User.objects.get(phone_number=phone_number)
-            except User.DoesNotExist:
-                logger.error(f"User not found: {phone_number}")
-                return Response({'error': 'User not found'}, 
-                              status=status.HTTP_404_NOT_FOUND)
-
-            # Check if OTP is expired (5 minutes)
-            if user.otp_created_at and timezone.now() - user.otp_created_at > timedelta(minutes=5):
-                logger.error(f"OTP expired for user: {phone_number}")
-                return Response({'error': 'OTP has expired'}, 
+            result = get_otp_store().verify(phone_number, otp)
+            metrics.OTP_VERIFICATIONS.inc(result=result)
+            if result == LOCKED:
+                logger.warning("Too many OTP attempts for %s", phone_number)
+                return Response({'error': 'Too many attempts'},
+                              status=status.HTTP_429_TOO_MANY_REQUESTS)
+            if result == INVALID:
+                logger.info("Invalid OTP for %s", phone_number)
+                return Response({'error': 'Invalid OTP'},
                               status=status.HTTP_400_BAD_REQUEST)
-
-            if user.otp_code != otp:
-                logger.error(f"Invalid OTP for user: {phone_number}")
-                return Response({'error': 'Invalid OTP'}, 
+            if result != VALID:
+                logger.info("OTP expired for %s", phone_number)
+                return Response({'error': 'OTP has expired'},
                               status=status.HTTP_400_BAD_REQUEST)
 
-            # Clear OTP after successful verification
-            user.otp_code = None
-            user.otp_created_at = None
-            user.save()
+            # Accounts exist only for verified phone numbers
+            user, created = User.objects.get_or_create(
+                phone_number=phone_number,
+                defaults={'username': phone_number}
+            )
 
             # Generate JWT tokens
-            logger.info(f"Generating tokens for user: {phone_number}")
-            refresh = RefreshToken.for_user(user)
+            refresh = UserRefreshToken.for_user(user)
             
             response_data = {
                 'message': 'OTP verified successfully',
@@ -180,11 +179,11 @@ class VerifyOTPView(APIView):
                 },
                 'user': UserProfileSerializer(user).data
             }
-            logger.info(f"Sending successful response for user: {phone_number}")
+            logger.info("OTP verified for %s (user %s, created=%s)", phone_number, user.pk, created)
             return Response(response_data)
             
-        except Exception as e:
-            logger.exception(f"Unexpected error in verify OTP: {str(e)}")
+        except Exception:
+            logger.exception("Unexpected error in verify OTP")
             return Response(
                 {'error': 'Internal server error'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -235,13 +234,13 @@ class UpdateProfileView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        user = request.user
+        user = get_full_user(request.user)
         if 'first_name' in serializer.validated_data:
             user.first_name = serializer.validated_data['first_name']
         if 'last_name' in serializer.validated_data:
             user.last_name = serializer.validated_data['last_name']
 
-        user.save()
+        user.save(update_fields=list(serializer.validated_data))
 
         return Response({
             'message': 'Profile updated successfully',